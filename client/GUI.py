@@ -5,20 +5,24 @@ import threading
 import time
 import os
 from datetime import datetime
-from PIL import Image, ImageTk
-import cv2
 
-from data_manager import DataManager
-from face_processor import FaceProcessor
-from camera_capture import CameraCapture
 from tcp_client import TCPClient
+from startup_profile import StartupProfile
+
+# OpenCV、PIL、人脸库和识别模型在后台预热线程中导入和加载（见 warm_up），窗口先显示出来
+cv2 = None
+Image = None
+ImageTk = None
 
 class FaceAttendanceSystem:
-    def __init__(self, root):
+    def __init__(self, root, startup_profile=None):
         self.root = root
-        self.data_manager = DataManager()
-        self.face_processor = FaceProcessor(self.data_manager)
-        self.camera_capture = CameraCapture(camera_index=9)
+        self.startup_profile = startup_profile or StartupProfile()
+        # 以下对象由预热线程创建，创建完成前相关功能不可用
+        self.data_manager = None
+        self.face_processor = None
+        self.camera_capture = None
+        self.recognition_ready = False
         self.client = TCPClient('192.168.137.96', 8888)
 
         self.current_mode = "attendance"  # "attendance" or "registration"
@@ -29,9 +33,10 @@ class FaceAttendanceSystem:
         self.last_recognition_time = 0
         self.recognition_interval = 3
         
-        self.setup_gui()
-        self.start_camera()
+        with self.startup_profile.phase("创建界面"):
+            self.setup_gui()
         self.show_tcp()
+        self.start_warm_up()
     
     def setup_gui(self):
         """设置GUI界面"""
@@ -147,7 +152,7 @@ class FaceAttendanceSystem:
                                   command=self.show_registered_list, width=15)
         self.list_btn.grid(row=0, column=0, padx=10)
         
-        self.clear_btn = ttk.Button(common_buttons_frame, text="清空所有数据", 
+        self.clear_btn = ttk.Button(common_buttons_frame, text="重置本机人脸库", 
                                    command=self.clear_all_data, width=15)
         self.clear_btn.grid(row=0, column=1, padx=10)
         
@@ -171,12 +176,110 @@ class FaceAttendanceSystem:
         # 初始显示考勤模式
         self.show_attendance_controls()
 
+        # 预热完成前不能注册或查看人脸数据
+        for button in (self.registration_btn, self.list_btn, self.clear_btn):
+            button.state(['disabled'])
+        self.status_label.config(text="正在加载识别模型...", foreground='blue')
+        self.log_message("界面已启动，正在后台加载摄像头和识别模型")
+    
+    def start_warm_up(self):
+        """启动后台预热线程"""
+        threading.Thread(target=self.warm_up, name="warm-up", daemon=True).start()
+    
+    def warm_up(self):
+        """
+        后台预热: 导入OpenCV/PIL并打开摄像头（完成后立即开始预览），
+        再加载人脸库和识别模型并做一次空推理，完成后开启识别。
+        界面控件只在界面线程中通过 root.after 更新。
+        """
+        global cv2, Image, ImageTk
+        profile = self.startup_profile
+        try:
+            with profile.phase("导入OpenCV/PIL"):
+                import cv2 as cv2_module
+                from PIL import Image as image_module, ImageTk as imagetk_module
+                cv2, Image, ImageTk = cv2_module, image_module, imagetk_module
+            
+            with profile.phase("打开摄像头"):
+                from camera_capture import CameraCapture
+                camera_capture, camera_index = self.open_camera(CameraCapture)
+            self.root.after(0, lambda: self.on_camera_opened(camera_capture, camera_index))
+            
+            with profile.phase("加载人脸库"):
+                from data_manager import DataManager
+                data_manager = DataManager()
+            
+            with profile.phase("加载识别模型"):
+                from face_processor import FaceProcessor, load_models
+                face_processor = FaceProcessor(data_manager)
+                load_models()
+            
+            with profile.phase("预热推理"):
+                face_processor.warm_up()
+        except Exception as e:
+            self.root.after(0, lambda error=e: self.on_warm_up_failed(error))
+            return
+        
+        self.root.after(0, lambda: self.on_warm_up_finished(data_manager, face_processor))
+    
+    def open_camera(self, camera_class):
+        """
+        依次尝试摄像头索引
+        
+        Returns:
+            tuple: (CameraCapture, 索引)，全部失败时为 (None, None)
+        """
+        for index in (9, 1, 2, 3, 4):
+            camera_capture = camera_class(camera_index=index)
+            if camera_capture.start_camera():
+                return camera_capture, index
+        return None, None
+    
+    def on_camera_opened(self, camera_capture, camera_index):
+        """摄像头打开后开始预览（界面线程）"""
+        if camera_capture is None:
+            self.log_message("错误：无法启动摄像头")
+            messagebox.showerror("错误", "无法启动摄像头，请检查摄像头连接")
+            return
+        self.camera_capture = camera_capture
+        self.log_message(f"摄像头启动成功 (索引 {camera_index})")
+        self.update_camera()
+    
+    def on_warm_up_finished(self, data_manager, face_processor):
+        """模型预热完成，开启识别（界面线程）"""
+        self.data_manager = data_manager
+        self.face_processor = face_processor
+        self.recognition_ready = True
+        
+        if self.current_mode == "attendance":
+            self.registration_btn.state(['!disabled'])
+        for button in (self.list_btn, self.clear_btn):
+            button.state(['!disabled'])
+        self.status_label.config(text="系统就绪", foreground='blue')
+        
         self.log_message("系统初始化完成")
         self.log_message(f"已加载 {self.data_manager.get_registered_count()} 个注册人脸")
+        report = self.startup_profile.report()
+        print(report)
+        for line in report.splitlines():
+            self.log_message(line.strip())
+    
+    def on_warm_up_failed(self, error):
+        """预热失败（界面线程）"""
+        self.status_label.config(text=f"识别模型加载失败: {error}", foreground='red')
+        self.log_message(f"错误：识别模型加载失败: {error}")
+        print(self.startup_profile.report())
     
     def show_tcp(self):
-        """更新tcpt通信连接状态"""
-        if self.client.connect():
+        """更新tcp通信连接状态，连接在后台线程中进行，不阻塞界面"""
+        def check_thread():
+            connected = self.client.connect()
+            self.root.after(0, lambda: self.update_tcp_status(connected))
+        
+        threading.Thread(target=check_thread, daemon=True).start()
+    
+    def update_tcp_status(self, connected):
+        if connected:
             self.tcp_label.config(text=f"成功连接服务器", foreground='green')
         else:
             self.tcp_label.config(text=f"服务器连接失败", foreground='red')
@@ -212,32 +315,15 @@ class FaceAttendanceSystem:
         self.registration_btn.state(['disabled'])
         self.log_message("切换到注册模式")
     
-    def start_camera(self):
-        """启动摄像头"""
-        if self.camera_capture.start_camera():
-            self.log_message("摄像头启动成功")
-            self.update_camera()
-        else:
-            # 尝试其他摄像头索引
-            for i in range(1, 5):
-                self.camera_capture = CameraCapture(camera_index=i)
-                if self.camera_capture.start_camera():
-                    self.log_message(f"摄像头启动成功 (索引 {i})")
-                    self.update_camera()
-                    return
-            
-            self.log_message("错误：无法启动摄像头")
-            messagebox.showerror("错误", "无法启动摄像头，请检查摄像头连接")
-    
     def update_camera(self):
         """更新摄像头画面"""
         if self.camera_capture.is_camera_active():
             frame = self.camera_capture.get_frame()
             if frame is not None:
-                # 考勤模式下进行人脸识别
+                # 考勤模式下进行人脸识别（模型预热完成后）
                 if self.current_mode == "attendance":
                     current_time = time.time()
-                    if (self.recognition_active and 
+                    if (self.recognition_active and self.recognition_ready and
                         current_time - self.last_recognition_time >= self.recognition_interval):
                         self.last_recognition_time = current_time
                         self.perform_recognition(frame.copy())
@@ -331,6 +417,9 @@ class FaceAttendanceSystem:
         if not self.registration_name:
             messagebox.showwarning("警告", "请先开始注册流程")
             return
+        if self.camera_capture is None:
+            messagebox.showwarning("警告", "摄像头尚未启动")
+            return
             
         if self.sample_count >= 5:
             messagebox.showinfo("提示", "已采集5张照片，正在处理...")
@@ -425,18 +514,22 @@ class FaceAttendanceSystem:
             self.log_message("查看已注册列表")
     
     def clear_all_data(self):
-        """清空所有数据"""
-        if messagebox.askyesno("确认清空", "确定要清空所有人脸数据吗？此操作不可恢复！"):
+        """重置本机人脸库（服务器人脸库不变）"""
+        if messagebox.askyesno("确认重置",
+                               "确定要清空本机的人脸数据吗？\n"
+                               "服务器人脸库不受影响，清空后会重新下载；尚未上传的注册将丢失。\n"
+                               "删除人员请在服务器上使用 gallery.py remove。"):
             if self.data_manager.clear_all_data():
-                self.log_message("已清空所有人脸数据")
-                messagebox.showinfo("成功", "已清空所有人脸数据")
+                self.log_message("已清空本机人脸数据，正在从服务器重新下载")
+                messagebox.showinfo("成功", "已清空本机人脸数据，正在从服务器重新下载")
             else:
                 messagebox.showerror("错误", "清空数据失败")
     
     def quit_system(self):
         """退出系统"""
         if messagebox.askokcancel("退出", "确定要退出系统吗？"):
-            self.camera_capture.stop_camera()
+            if self.camera_capture:
+                self.camera_capture.stop_camera()
             self.root.destroy()
     
     def log_message(self, message):
@@ -446,9 +539,15 @@ class FaceAttendanceSystem:
         self.log_text.insert(tk.END, formatted_message)
         self.log_text.see(tk.END)
 
-def main():
+def main(start_time=None):
+    """
+    Args:
+        start_time: 进程启动时刻（time.perf_counter），用于统计启动耗时
+    """
+    startup_profile = StartupProfile(start_time)
+    startup_profile.record("导入界面模块", startup_profile.start_time)
     root = tk.Tk()
-    app = FaceAttendanceSystem(root)
+    app = FaceAttendanceSystem(root, startup_profile)
 
     # 设置窗口在屏幕中央显示
     window_width = 700
@@ -458,6 +557,8 @@ def main():
     x = (screen_width - window_width) // 2
     y = (screen_height - window_height) // 2
     root.geometry(f"{window_width}x{window_height}+{x}+{y}")
+    # 事件循环开始处理事件时窗口即可交互
+    root.after_idle(lambda: startup_profile.record("窗口可交互", startup_profile.start_time))
 
     root.mainloop()
 
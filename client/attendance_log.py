@@ -0,0 +1,175 @@
+# attendance_log.py
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+
+
+class DailyDedupIndex:
+    """按天划分的持久化考勤去重索引，键为 (日期, 姓名)"""
+
+    def __init__(self, index_dir="attendance_index", keep_days=7):
+        """
+        Args:
+            index_dir: 索引文件目录，每天一个 YYYY-MM-DD.idx 文件
+            keep_days: 保留最近多少天的索引文件
+        """
+        self.index_dir = index_dir
+        self.keep_days = keep_days
+        self.current_date = None
+        self.names = set()
+        self._file = None
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.index_dir):
+            os.makedirs(self.index_dir)
+
+        self._roll_over(datetime.now().strftime("%Y-%m-%d"))
+
+    def _index_path(self, date_str):
+        return os.path.join(self.index_dir, f"{date_str}.idx")
+
+    def _roll_over(self, date_str):
+        """切换到新的一天：关闭旧索引文件，只加载当天的索引"""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+        self.current_date = date_str
+        self.names = set()
+
+        index_path = self._index_path(date_str)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self.names = {line.rstrip('\n') for line in f if line.strip()}
+
+        self._file = open(index_path, 'a', encoding='utf-8')
+        self._remove_expired()
+
+    def _remove_expired(self):
+        """删除超过保留天数的旧索引文件"""
+        cutoff = (datetime.strptime(self.current_date, "%Y-%m-%d")
+                  - timedelta(days=self.keep_days)).strftime("%Y-%m-%d")
+        try:
+            for filename in os.listdir(self.index_dir):
+                if filename.endswith('.idx') and filename[:-4] < cutoff:
+                    os.remove(os.path.join(self.index_dir, filename))
+        except OSError as e:
+            print(f"清理过期索引失败: {e}")
+
+    def _check_date(self, date_str=None):
+        date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+        if date_str != self.current_date:
+            self._roll_over(date_str)
+        return date_str
+
+    def contains(self, name, date_str=None):
+        """检查某人当天是否已记录"""
+        with self._lock:
+            self._check_date(date_str)
+            return name in self.names
+
+    def add(self, name, date_str=None):
+        """
+        记录 (日期, 姓名)
+
+        Returns:
+            bool: 新记录返回True，当天已存在返回False
+        """
+        with self._lock:
+            self._check_date(date_str)
+            if name in self.names:
+                return False
+            # 每人每天只写一次，直接落盘保证重启后不会重复上报
+            self._file.write(name + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.names.add(name)
+            return True
+
+    def count(self):
+        """获取当天已记录人数"""
+        with self._lock:
+            self._check_date()
+            return len(self.names)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class AttendanceLogWriter:
+    """带缓冲、按天轮转的考勤CSV写入器"""
+
+    HEADER = "日期,时间,姓名,状态\n"
+
+    def __init__(self, log_dir="attendance_logs", prefix="attendance_log",
+                 flush_every=20, flush_interval=5.0):
+        """
+        Args:
+            log_dir: 日志目录，每天一个 {prefix}_YYYY-MM-DD.csv 文件
+            flush_every: 缓冲多少条记录后写盘
+            flush_interval: 距上次写盘超过多少秒后写盘
+        """
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.current_date = None
+        self._file = None
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+
+    def get_log_path(self, date_str):
+        return os.path.join(self.log_dir, f"{self.prefix}_{date_str}.csv")
+
+    def _rotate(self, date_str):
+        """切换到指定日期的日志文件"""
+        self._flush_locked()
+        if self._file:
+            self._file.close()
+
+        log_path = self.get_log_path(date_str)
+        is_new = not os.path.exists(log_path)
+        # 大缓冲区，由 flush_every/flush_interval 控制写盘时机
+        self._file = open(log_path, 'a', encoding='utf-8', buffering=64 * 1024)
+        if is_new:
+            self._file.write(self.HEADER)
+        self.current_date = date_str
+
+    def write(self, date_str, time_str, name, status="考勤成功"):
+        """追加一条考勤记录"""
+        with self._lock:
+            if date_str != self.current_date:
+                self._rotate(date_str)
+
+            self._file.write(f"{date_str},{time_str},{name},{status}\n")
+            self._pending += 1
+
+            if (self._pending >= self.flush_every or
+                    time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._file and self._pending:
+            self._file.flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            if self._file:
+                self._file.close()
+                self._file = None
+            self.current_date = None
\ No newline at end of file
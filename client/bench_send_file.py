@@ -0,0 +1,117 @@
+# bench_send_file.py
+# 文件发送吞吐量测试：对比旧的4KB分块发送与socket.sendfile零拷贝发送
+#
+# 用法: python bench_send_file.py [--size-mb 20] [--rounds 5]
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+
+from tcp_client import TCPClient
+
+
+class SinkServer:
+    """本地接收端，按旧协议的FILE格式收取数据后回复确认"""
+
+    def __init__(self, host='127.0.0.1'):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, 0))
+        self.socket.listen(1)
+        self.host, self.port = self.socket.getsockname()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _recv_exact(self, conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _serve(self):
+        conn, _ = self.socket.accept()
+        buffer = bytearray(1024 * 1024)
+        view = memoryview(buffer)
+        with conn:
+            while True:
+                data_type = self._recv_exact(conn, 4)
+                if not data_type or data_type == b'EXIT':
+                    break
+                file_info = self._recv_exact(conn, 256).decode('utf-8').strip()
+                filesize = int(file_info.split('|')[1])
+                remaining = filesize
+                while remaining:
+                    count = conn.recv_into(view, min(len(buffer), remaining))
+                    if not count:
+                        return
+                    remaining -= count
+                conn.sendall(b"FILE_RECEIVED")
+
+
+def send_file_chunked(client, file_path):
+    """原实现：Python中4KB分块读取后逐块send"""
+    sock = client.socket
+    filesize = os.path.getsize(file_path)
+    sock.sendall(b"FILE")
+    sock.sendall(f"{os.path.basename(file_path)}|{filesize}".encode('utf-8').ljust(256))
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+    return sock.recv(1024) == b"FILE_RECEIVED"
+
+
+def run(method, file_path, rounds):
+    server = SinkServer()
+    client = TCPClient(server.host, server.port, use_framing=False)
+    if not client.connect():
+        raise RuntimeError("无法连接本地接收端")
+
+    filesize = os.path.getsize(file_path)
+    cpu_start = time.thread_time()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if method == 'chunked':
+            ok = send_file_chunked(client, file_path)
+        else:
+            ok = client.send_file(file_path)
+        if not ok:
+            raise RuntimeError(f"{method} 发送失败")
+    elapsed = time.perf_counter() - start
+    cpu = time.thread_time() - cpu_start
+    client.disconnect()
+
+    total_mb = filesize * rounds / (1024 * 1024)
+    return total_mb / elapsed, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文件发送吞吐量测试")
+    parser.add_argument('--size-mb', type=float, default=20, help="测试文件大小(MB)")
+    parser.add_argument('--rounds', type=int, default=5, help="每种方式发送次数")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as f:
+        f.write(os.urandom(int(args.size_mb * 1024 * 1024)))
+        file_path = f.name
+
+    try:
+        print(f"文件大小 {args.size_mb} MB，每种方式 {args.rounds} 次")
+        print(f"sendfile可用: {hasattr(os, 'sendfile')}")
+        for method in ('chunked', 'sendfile'):
+            throughput, cpu = run(method, file_path, args.rounds)
+            print(f"{method:>9}: {throughput:8.1f} MB/s, 发送线程CPU时间 {cpu:.3f} s")
+    finally:
+        os.remove(file_path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -1,23 +1,74 @@
 # data_manager.py
 import os
+import time
+import atexit
 import pickle
-import cv2
+import threading
 from datetime import datetime
+import numpy as np
 from tcp_client import TCPClient
+import protocol
+from attendance_log import DailyDedupIndex, AttendanceLogWriter
+from photo_encoder import encode_jpeg, crop_face, make_thumbnail, PhotoArchiver
+from quantized_gallery import QuantizedGallery
 
 
 class DataManager:
     def __init__(self):
         self.face_data_file = "face_data.pkl"
-        self.attendance_file = "attendance_log.csv"
+        self.attendance_log_dir = "attendance_logs"
+        self.attendance_index_dir = "attendance_index"
         self.photos_dir = "attendance_photos"
-        self.known_face_encodings = []
+        self.outbox_dir = "attendance_outbox"
+        # 人脸特征的存储格式: "float64"原始特征, "float16"半精度(内存1/4),
+        # "int8"按维度缩放的8位整数(内存1/8)，匹配直接在量化数据上计算距离；
+        # 可用 python quantized_gallery.py 标注集.pkl 检查量化对识别结果的影响
+        self.gallery_format = "float64"
+        self.known_face_encodings = QuantizedGallery.empty(self.gallery_format)
         self.known_face_names = []
-        self.recognized_names = set()
-        self.client = TCPClient('192.168.137.96', 8888)
+        # 服务器人脸库分配的face_id，本地注册尚未上传的人脸为None
+        self.known_face_ids = []
+        # 已同步到的服务器人脸库版本号
+        self.gallery_version = 0
+        # 同步线程整体替换特征矩阵和上面两个列表，识别时通过get_gallery取一致的快照
+        self.gallery_lock = threading.Lock()
+        # 同步线程和界面线程都会保存人脸数据，取快照到替换文件整个过程串行化，
+        # 临时文件不会被同时写入，较旧的快照也不会覆盖较新的；识别线程只使用gallery_lock，不受影响
+        self.save_lock = threading.Lock()
+        self.gallery_sync_interval = 30  # 人脸库同步间隔（秒）
+        self.gallery_sync_event = threading.Event()
+        self.closed = False
+        # 流水线发送，断线期间积压的记录重连后按窗口连续发出；
+        # 未确认的记录保存在磁盘队列中，去重索引已落盘的记录重启后也会继续上传
+        self.client = TCPClient('192.168.137.96', 8888, window_size=8, spool_dir=self.outbox_dir)
+
+        # 考勤照片设置
+        self.jpeg_quality = 85         # JPEG编码质量
+        self.upload_mode = "full"      # 上传内容: "full"整帧, "face"人脸裁剪, "thumbnail"缩略图
+        self.face_padding = 0.3        # 人脸裁剪外扩比例
+        self.thumbnail_width = 160     # 缩略图宽度
+
+        # 识别方式: "local"本地识别, "server"上传缩小的帧由服务器检测和识别,
+        # "detect"本地只检测人脸，上传缩小的帧和人脸位置由服务器识别；服务器不可用时退回本地识别
+        self.recognition_mode = "local"
+        self.remote_retry_interval = 30  # 服务器识别失败后，多久再尝试（秒）
+        self.remote_retry_at = 0
         
         self.load_known_faces()
         self.create_attendance_file()
+
+        # 按天持久化的去重索引，重启后不会重复上报，跨天自动重置
+        self.recognized_index = DailyDedupIndex(self.attendance_index_dir)
+        # 按天轮转的缓冲考勤日志
+        self.attendance_log = AttendanceLogWriter(self.attendance_log_dir)
+        # 本地整帧存档在后台线程中编码写盘
+        self.photo_archiver = PhotoArchiver(self.photos_dir, self.jpeg_quality)
+        atexit.register(self.close)
+
+        # 后台同步服务器人脸库: 上传本地注册的人脸，拉取其他开发板注册或服务器删除的变化
+        self.gallery_sync_thread = threading.Thread(target=self._gallery_sync_loop,
+                                                    name="gallery-sync", daemon=True)
+        self.gallery_sync_thread.start()
     
     def load_known_faces(self):
         """加载已知人脸数据"""
@@ -25,8 +76,16 @@ class DataManager:
             if os.path.exists(self.face_data_file):
                 with open(self.face_data_file, 'rb') as f:
                     data = pickle.load(f)
-                    self.known_face_encodings = data['encodings']
+                    if 'quantized' in data:
+                        encodings = QuantizedGallery.from_state(data['quantized'])
+                    else:
+                        encodings = QuantizedGallery.from_encodings(data['encodings'])
+                    # 保存的格式与当前设置不同时转换（由量化格式转回float64不能恢复精度）
+                    self.known_face_encodings = encodings.convert(self.gallery_format)
                     self.known_face_names = data['names']
+                    # 旧版本的数据没有face_id，作为本地注册的人脸在同步时上传
+                    self.known_face_ids = data.get('ids', [None] * len(self.known_face_names))
+                    self.gallery_version = data.get('version', 0)
                 return True
             else:
                 return False
@@ -35,75 +94,248 @@ class DataManager:
             return False
     
     def save_known_faces(self):
-        """保存人脸数据"""
+        """保存人脸数据（先写临时文件再替换，同步线程写入时中断不会损坏原文件）"""
         try:
-            data = {
-                'encodings': self.known_face_encodings,
-                'names': self.known_face_names
-            }
-            with open(self.face_data_file, 'wb') as f:
-                pickle.dump(data, f)
+            with self.save_lock:
+                with self.gallery_lock:
+                    data = {
+                        'names': self.known_face_names,
+                        'ids': self.known_face_ids,
+                        'version': self.gallery_version
+                    }
+                    encodings = self.known_face_encodings
+                # float64格式保持原来的特征列表，旧版本程序和服务器导入工具可以直接读取
+                if encodings.format == "float64":
+                    data['encodings'] = encodings.rows()
+                else:
+                    data['quantized'] = encodings.state()
+                temp_file = self.face_data_file + ".tmp"
+                with open(temp_file, 'wb') as f:
+                    pickle.dump(data, f)
+                os.replace(temp_file, self.face_data_file)
             return True
         except Exception as e:
             print(f"保存人脸数据失败: {e}")
             return False
     
     def create_attendance_file(self):
-        """创建考勤记录文件"""
-        if not os.path.exists(self.attendance_file):
-            with open(self.attendance_file, 'w', encoding='utf-8') as f:
-                f.write("日期,时间,姓名,状态\n")
-
+        """创建考勤记录目录"""
         if not os.path.exists(self.photos_dir):
             os.makedirs(self.photos_dir)
     
-    def record_attendance(self, name, frame=None):
-        """记录考勤"""
-        if name in self.recognized_names:
-            return False  # 已经记录过，避免重复
-        
+    def record_attendance(self, name, frame=None, face_location=None):
+        """
+        记录考勤
+
+        Args:
+            name: 识别出的姓名
+            frame: 原始帧
+            face_location: 原始帧中的人脸位置 (top, right, bottom, left)，用于裁剪上传
+        """
         current_time = datetime.now()
         date_str = current_time.strftime("%Y-%m-%d")
         time_str = current_time.strftime("%H:%M:%S")
-        
-        with open(self.attendance_file, 'a', encoding='utf-8') as f:
-            f.write(f"{date_str},{time_str},{name},考勤成功\n")
-                
-        # 保存考勤照片
+
+        if self.recognized_index.contains(name, date_str):
+            return False  # 当天已经记录过，避免重复
+
+        photo_filename = None
+        upload_data = None
         if frame is not None:
             photo_filename = f"{name}_{date_str}_{time_str.replace(':', '')}.jpg"
-            photo_path = os.path.join(self.photos_dir, photo_filename)
-            cv2.imwrite(photo_path, frame)
+            upload_data = self.encode_upload_photo(frame, face_location, photo_filename)
 
-        if self.client.connect():
-            self.client.send_text(f"{date_str},{time_str},{name}")
-            self.client.send_file(photo_path)
+        # 记录先写入客户端的磁盘队列，再写入去重索引: 两者之间中断最多重复上报一次，
+        # 不会出现已标记考勤而记录丢失；未确认的记录连接恢复后重发
+        self.client.queue_record(f"{date_str},{time_str},{name}", photo_filename, upload_data)
+        self.recognized_index.add(name, date_str)
+        self.attendance_log.write(date_str, time_str, name)
+
+        if not self.client.is_connected():
+            self.client.connect()
+        self.client.send_queued()
 
-        self.recognized_names.add(name)
         return True
+
+    def encode_upload_photo(self, frame, face_location, photo_filename):
+        """在内存中编码待上传照片，并提交整帧到后台存档"""
+        if self.upload_mode == "face" and face_location is not None:
+            upload_image = crop_face(frame, face_location, self.face_padding)
+        elif self.upload_mode == "thumbnail":
+            upload_image = make_thumbnail(frame, self.thumbnail_width)
+        else:
+            upload_image = None
+
+        if upload_image is None:
+            # 整帧上传时只编码一次，上传和存档共用
+            upload_data = encode_jpeg(frame, self.jpeg_quality)
+            self.photo_archiver.archive(photo_filename, jpeg_data=upload_data)
+        else:
+            upload_data = encode_jpeg(upload_image, self.jpeg_quality)
+            self.photo_archiver.archive(photo_filename, frame=frame)
+        return upload_data
+    
+    def recognize_remote(self, image_data, locations=None):
+        """
+        请求服务器识别（与考勤记录共用连接）
+
+        Returns:
+            list: [(name, distance, location), ...]；服务器不可用或未启用识别时返回None，
+                  调用方退回本地识别，并在remote_retry_interval秒内不再尝试
+        """
+        if time.monotonic() < self.remote_retry_at:
+            return None
+        if not self.client.is_connected():
+            self.client.connect()
+        reply = self.client.recognize(image_data, locations)
+        if reply is not None and reply[0] == protocol.STATUS_OK:
+            return reply[1]
+        if reply is None:
+            print("服务器识别不可用，暂时使用本地识别")
+        else:
+            print(f"服务器识别失败（状态码 {reply[0]}），暂时使用本地识别")
+        self.remote_retry_at = time.monotonic() + self.remote_retry_interval
+        return None
+    
+    def get_gallery(self):
+        """
+        Returns:
+            tuple: (names, encodings)，同一版本的姓名列表与特征矩阵（QuantizedGallery）
+        """
+        with self.gallery_lock:
+            return self.known_face_names, self.known_face_encodings
     
     def is_name_registered(self, name):
         """检查姓名是否已注册"""
         return name in self.known_face_names
     
     def add_face_data(self, name, encoding):
-        """添加人脸数据"""
-        self.known_face_encodings.append(encoding)
-        self.known_face_names.append(name)
-        return self.save_known_faces()
+        """添加人脸数据，立即可用于本地识别，由同步线程上传到服务器人脸库"""
+        with self.gallery_lock:
+            self.known_face_encodings = self.known_face_encodings.append([encoding])
+            self.known_face_names = self.known_face_names + [name]
+            self.known_face_ids = self.known_face_ids + [None]
+        saved = self.save_known_faces()
+        self.gallery_sync_event.set()
+        return saved
     
     def clear_all_data(self):
-        """清空所有人脸数据"""
-        self.known_face_encodings = []
-        self.known_face_names = []
-        if os.path.exists(self.face_data_file):
-            os.remove(self.face_data_file)
+        """
+        重置本机的人脸数据缓存（含尚未上传的注册）
+
+        服务器人脸库是权威数据，不受影响，清空后立即从服务器重新下载；
+        要删除某个人，需在服务器上用 gallery.py remove，删除会同步到各开发板。
+        """
+        with self.save_lock:
+            with self.gallery_lock:
+                self.known_face_encodings = QuantizedGallery.empty(self.gallery_format)
+                self.known_face_names = []
+                self.known_face_ids = []
+                self.gallery_version = 0
+            if os.path.exists(self.face_data_file):
+                os.remove(self.face_data_file)
+        self.gallery_sync_event.set()
         return True
     
+    def _gallery_sync_loop(self):
+        """
+        同步线程: 启动时和每隔gallery_sync_interval秒同步一次，本地注册后立即同步；
+        同步时连接已恢复，一并发出断线期间（或上次运行）积压的考勤记录，不等下一次考勤
+        """
+        while not self.closed:
+            try:
+                self.sync_gallery()
+                if self.client.get_pending_count():
+                    self.client.flush()
+            except Exception as e:
+                print(f"同步人脸库时出错: {e}")
+            self.gallery_sync_event.wait(self.gallery_sync_interval)
+            self.gallery_sync_event.clear()
+    
+    def sync_gallery(self):
+        """
+        上传本地注册的人脸，再拉取服务器人脸库的增量并应用到识别使用的列表
+        
+        Returns:
+            bool: 已同步到服务器最新版本返回True，服务器不可用返回False
+        """
+        if not self.client.is_connected() and not self.client.connect():
+            return False
+        
+        # 量化格式下上传的是还原后的特征（含量化误差）
+        with self.gallery_lock:
+            pending = [(name, self.known_face_encodings.decode(index)) for index, (face_id, name)
+                       in enumerate(zip(self.known_face_ids, self.known_face_names))
+                       if face_id is None]
+        for name, encoding in pending:
+            base = self.gallery_version
+            reply = self.client.enroll(base, name, np.asarray(encoding, dtype='<f8').tobytes())
+            if reply is None or reply[0] != protocol.STATUS_OK:
+                return False
+            self.apply_gallery_delta(reply[1], reply[3], base)
+            print(f"已上传注册人脸: {name}")
+        
+        while True:
+            base = self.gallery_version
+            reply = self.client.sync_gallery(base)
+            if reply is None or reply[0] != protocol.STATUS_OK:
+                return False
+            status, reached, latest, changes = reply
+            self.apply_gallery_delta(reached, changes, base)
+            if reached >= latest:
+                return True
+    
+    def apply_gallery_delta(self, version, changes, base=None):
+        """
+        应用服务器人脸库的增量，识别线程不需要停止
+        
+        Args:
+            version: 应用后达到的版本号
+            changes: [(face_id, name, encoding), ...]，encoding为None表示删除
+            base: 请求增量时的本地版本号，期间本地人脸库被重置时丢弃该增量
+        """
+        if not changes and version == self.gallery_version:
+            return
+        with self.gallery_lock:
+            if base is not None and base != self.gallery_version:
+                return
+            changed_ids = {face_id for face_id, _, _ in changes}
+            # 服务器返回的同名人脸替换本地待上传的条目
+            uploaded_names = {name for _, name, encoding in changes if encoding is not None}
+            kept = [index for index, (face_id, name)
+                    in enumerate(zip(self.known_face_ids, self.known_face_names))
+                    if face_id not in changed_ids
+                    and not (face_id is None and name in uploaded_names)]
+            added = [(face_id, name, np.frombuffer(encoding, dtype='<f8'))
+                     for face_id, name, encoding in changes if encoding is not None]
+            
+            # 整体替换列表和特征矩阵，识别线程持有的旧对象不受影响
+            encodings = self.known_face_encodings.select(kept)
+            if added:
+                encodings = encodings.append([encoding for _, _, encoding in added])
+            self.known_face_ids = [self.known_face_ids[i] for i in kept] + [face_id for face_id, _, _ in added]
+            self.known_face_names = [self.known_face_names[i] for i in kept] + [name for _, name, _ in added]
+            self.known_face_encodings = encodings
+            self.gallery_version = version
+        self.save_known_faces()
+        if changes:
+            removed = sum(1 for _, _, encoding in changes if encoding is None)
+            print(f"人脸库已同步到版本 {version}（新增或更新 {len(changes) - removed}，删除 {removed}）")
+    
     def get_registered_count(self):
         """获取已注册人数"""
         return len(self.known_face_names)
     
     def get_attendance_count(self):
         """获取已考勤人数"""
-        return len(self.recognized_names)
\ No newline at end of file
+        return self.recognized_index.count()
+
+    def close(self):
+        """发送未确认记录，写出缓冲的考勤日志和待存档照片并关闭索引"""
+        self.closed = True
+        self.gallery_sync_event.set()
+        self.client.flush()
+        self.client.disconnect()
+        self.photo_archiver.close()
+        self.attendance_log.close()
+        self.recognized_index.close()
\ No newline at end of file
@@ -1,15 +1,36 @@
 # face_processor.py
 import cv2
-import face_recognition
 import numpy as np
+from photo_encoder import encode_jpeg
+
+# 导入face_recognition时会加载dlib模型，耗时较长，推迟到 load_models 中进行
+face_recognition = None
+
+
+def load_models():
+    """导入face_recognition并加载模型，已加载时直接返回"""
+    global face_recognition
+    if face_recognition is None:
+        import face_recognition as module
+        face_recognition = module
+    return face_recognition
+
 
 class FaceProcessor:
     def __init__(self, data_manager):
         self.data_manager = data_manager
     
+    def warm_up(self):
+        """加载模型并对空白图像做一次检测和特征提取，使首次识别不再承担初始化开销"""
+        load_models()
+        dummy = np.zeros((120, 120, 3), dtype=np.uint8)
+        face_recognition.face_locations(dummy)
+        face_recognition.face_encodings(dummy, [(10, 110, 110, 10)])
+    
     def extract_face_features(self, image_path):
         """从图片中提取人脸特征"""
         try:
+            load_models()
             image = face_recognition.load_image_file(image_path)
             face_locations = face_recognition.face_locations(image)
             
@@ -30,6 +51,7 @@ class FaceProcessor:
     def extract_face_features_from_frame(self, frame):
         """从视频帧中提取人脸特征"""
         try:
+            load_models()
             # 缩小帧以加速处理
             small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
             rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
@@ -46,49 +68,36 @@ class FaceProcessor:
             return None, f"处理帧时出错: {e}"
     
     def recognize_faces(self, frame):
-        """识别人脸并返回结果"""
+        """识别人脸并返回结果，按data_manager.recognition_mode选择本地或服务器识别"""
         try:
             # 缩小帧以加速处理
             small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
             
-            # 检测人脸
-            face_locations = face_recognition.face_locations(rgb_small_frame)
-            face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+            matches = None
+            if self.data_manager.recognition_mode != "local":
+                matches = self.match_faces_remote(small_frame)
+            if matches is None:
+                matches = self.match_faces_local(small_frame)
             
-            if not face_encodings:
+            if not matches:
                 return None, "未检测到人脸"
             
             recognition_results = []
-            for face_encoding in face_encodings:
+            for name, distance, face_location in matches:
                 # 如果没有已知人脸，标记为未知
-                if not self.data_manager.known_face_encodings:
+                if distance is None:
                     recognition_results.append(("Unknown", "识别失败：未注册"))
                     continue
-                    
-                # 检查是否匹配已知人脸
-                matches = face_recognition.compare_faces(
-                    self.data_manager.known_face_encodings, 
-                    face_encoding
-                )
-                name = "Unknown"
-                status = "识别失败：未注册"
                 
-                # 使用已知人脸中距离最小的
-                face_distances = face_recognition.face_distance(
-                    self.data_manager.known_face_encodings, 
-                    face_encoding
-                )
-                best_match_index = np.argmin(face_distances)
-                
-                # 设置匹配阈值
-                if matches[best_match_index] and face_distances[best_match_index] < 0.6:
-                    name = self.data_manager.known_face_names[best_match_index]
-                    if self.data_manager.record_attendance(name, frame):
+                if name is not None:
+                    # 检测在1/4缩放帧上进行，还原到原始帧坐标
+                    full_location = tuple(v * 4 for v in face_location)
+                    if self.data_manager.record_attendance(name, frame, full_location):
                         status = "考勤成功"
                     else:
                         status = "考勤重复"
                 else:
+                    name = "Unknown"
                     status = "识别失败：匹配度不足"
                 
                 recognition_results.append((name, status))
@@ -98,6 +107,59 @@ class FaceProcessor:
         except Exception as e:
             return None, f"识别过程中出错: {e}"
     
+    def match_faces_local(self, small_frame):
+        """
+        在本地检测人脸并与已知人脸匹配
+        
+        Returns:
+            list: [(name, distance, location), ...]，未匹配时name为None，没有已知人脸时distance为None
+        """
+        load_models()
+        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+        
+        # 检测人脸
+        face_locations = face_recognition.face_locations(rgb_small_frame)
+        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+        
+        # 人脸库可能被同步线程更新，整个识别过程使用同一个快照
+        known_names, known_encodings = self.data_manager.get_gallery()
+        
+        matches = []
+        for face_location, face_encoding in zip(face_locations, face_encodings):
+            if not len(known_encodings):
+                matches.append((None, None, face_location))
+                continue
+            
+            # 使用已知人脸中距离最小的（量化格式的人脸库直接在量化数据上计算）
+            face_distances = known_encodings.distances(face_encoding)
+            best_match_index = np.argmin(face_distances)
+            distance = float(face_distances[best_match_index])
+            
+            # 设置匹配阈值
+            name = known_names[best_match_index] if distance < 0.6 else None
+            matches.append((name, distance, face_location))
+        return matches
+    
+    def match_faces_remote(self, small_frame):
+        """
+        上传缩小的帧由服务器识别，"detect"模式下先在本地检测人脸位置
+        
+        Returns:
+            list: 格式同match_faces_local；服务器不可用时返回None
+        """
+        locations = None
+        if self.data_manager.recognition_mode == "detect":
+            load_models()
+            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+            locations = face_recognition.face_locations(rgb_small_frame)
+            if not locations:
+                return []
+        
+        image_data = encode_jpeg(small_frame, self.data_manager.jpeg_quality)
+        if image_data is None:
+            return None
+        return self.data_manager.recognize_remote(image_data, locations)
+    
     def process_registration_samples(self, sample_images, name):
         """处理注册样本"""
         features_collected = []
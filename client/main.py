@@ -1,4 +1,9 @@
+import time
+
+# 在导入界面模块之前记录启动时刻，用于统计启动耗时
+start_time = time.perf_counter()
+
 from GUI import main
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main(start_time)
\ No newline at end of file
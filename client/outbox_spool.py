@@ -0,0 +1,86 @@
+# outbox_spool.py
+import os
+import threading
+from collections import deque
+
+
+class OutboxSpool:
+    """
+    未确认考勤记录的磁盘队列
+
+    每条记录一个文件（编码后的帧负载），写入时fsync，服务器确认后删除，
+    重启或断线期间积压的记录不会丢失。内存中的outbox只装载其中最早的一部分，
+    其余留在磁盘上，outbox有空位时按顺序装载。
+    """
+
+    SUFFIX = ".rec"
+
+    def __init__(self, spool_dir="attendance_outbox"):
+        """
+        Args:
+            spool_dir: 队列目录，文件名为递增的序号
+        """
+        self.spool_dir = spool_dir
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.spool_dir):
+            os.makedirs(self.spool_dir)
+
+        # 上次运行未确认的记录按序号排在最前面
+        keys = sorted(int(filename[:-len(self.SUFFIX)]) for filename in os.listdir(self.spool_dir)
+                      if filename.endswith(self.SUFFIX) and filename[:-len(self.SUFFIX)].isdigit())
+        self.pending = deque(keys)  # 尚未装载到outbox的记录
+        self.next_key = keys[-1] + 1 if keys else 1
+        self.count = len(keys)      # 磁盘上的记录总数
+
+    def _path(self, key):
+        return os.path.join(self.spool_dir, f"{key:010d}{self.SUFFIX}")
+
+    def append(self, payload):
+        """追加一条记录并落盘"""
+        with self._lock:
+            key = self.next_key
+            self.next_key += 1
+            temp_path = self._path(key) + ".tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self._path(key))
+            self.pending.append(key)
+            self.count += 1
+            return key
+
+    def has_pending(self):
+        """是否还有未装载到outbox的记录"""
+        return bool(self.pending)
+
+    def take(self):
+        """
+        取出下一条未装载的记录
+
+        Returns:
+            tuple: (key, payload)，没有可读取的记录时返回None
+        """
+        with self._lock:
+            while self.pending:
+                key = self.pending.popleft()
+                try:
+                    with open(self._path(key), 'rb') as f:
+                        return key, f.read()
+                except OSError as e:
+                    print(f"读取待发送记录 {key} 失败: {e}")
+                    self.count -= 1
+            return None
+
+    def remove(self, key):
+        """记录已被服务器确认，删除文件"""
+        with self._lock:
+            try:
+                os.remove(self._path(key))
+                self.count -= 1
+            except OSError as e:
+                print(f"删除已确认记录失败: {e}")
+
+    def __len__(self):
+        return self.count
\ No newline at end of file
@@ -0,0 +1,94 @@
+# photo_encoder.py
+import os
+import queue
+import threading
+import cv2
+
+
+def encode_jpeg(image, quality=85):
+    """在内存中将图像编码为JPEG，返回bytes，失败返回None"""
+    ok, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    if not ok:
+        return None
+    return buffer.tobytes()
+
+
+def crop_face(frame, face_location, padding=0.3):
+    """
+    按人脸位置裁剪出带边距的人脸区域
+
+    Args:
+        frame: 原始帧
+        face_location: (top, right, bottom, left)，原始帧坐标
+        padding: 相对人脸宽高的外扩比例
+    """
+    top, right, bottom, left = face_location
+    height, width = frame.shape[:2]
+    pad_y = int((bottom - top) * padding)
+    pad_x = int((right - left) * padding)
+
+    top = max(0, top - pad_y)
+    bottom = min(height, bottom + pad_y)
+    left = max(0, left - pad_x)
+    right = min(width, right + pad_x)
+
+    if bottom <= top or right <= left:
+        return frame
+    return frame[top:bottom, left:right]
+
+
+def make_thumbnail(frame, max_width=160):
+    """等比缩小为缩略图"""
+    height, width = frame.shape[:2]
+    if width <= max_width:
+        return frame
+    scale = max_width / width
+    return cv2.resize(frame, (max_width, int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+class PhotoArchiver:
+    """后台保存考勤照片，避免在识别线程中编码和写SD卡"""
+
+    def __init__(self, photos_dir, quality=85, max_pending=32):
+        self.photos_dir = photos_dir
+        self.quality = quality
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self.worker.start()
+
+    def archive(self, filename, frame=None, jpeg_data=None):
+        """
+        提交一张待保存照片，已编码的数据直接写入，否则在后台编码
+
+        Returns:
+            bool: 成功入队返回True，队列已满返回False
+        """
+        try:
+            self.queue.put_nowait((filename, frame, jpeg_data))
+            return True
+        except queue.Full:
+            print(f"照片保存队列已满，丢弃: {filename}")
+            return False
+
+    def _worker_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            filename, frame, jpeg_data = item
+            try:
+                if jpeg_data is None:
+                    jpeg_data = encode_jpeg(frame, self.quality)
+                if jpeg_data:
+                    with open(os.path.join(self.photos_dir, filename), 'wb') as f:
+                        f.write(jpeg_data)
+            except Exception as e:
+                print(f"保存考勤照片失败: {e}")
+            finally:
+                self.queue.task_done()
+
+    def close(self, timeout=5.0):
+        """等待已提交的照片写完后停止"""
+        self.queue.put(None)
+        self.worker.join(timeout)
\ No newline at end of file
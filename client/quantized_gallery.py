@@ -0,0 +1,275 @@
+# quantized_gallery.py
+# 人脸特征矩阵，可选float16/int8量化存储，匹配直接在量化数据上计算距离
+#
+# 精度检查: python quantized_gallery.py 标注集.pkl [--gallery face_data.pkl] [--format int8]
+#   标注集格式与face_data.pkl相同（{'encodings': [...], 'names': [...]}），
+#   姓名不在人脸库中的样本应识别为未知；报告量化前后识别结果的差异
+import sys
+import pickle
+import argparse
+import numpy as np
+
+FORMATS = ("float64", "float16", "int8")
+
+# 新特征超出当前量化范围时按此比例留出余量，减少重新量化的次数
+SCALE_HEADROOM = 1.25
+
+# 匹配时每次处理的行数，限制大规模人脸库计算距离时的临时内存
+MATCH_CHUNK_ROWS = 16384
+
+
+class QuantizedGallery:
+    """
+    不可变的人脸特征矩阵（每行一个人脸），修改操作返回新对象，
+    同步线程替换时识别线程持有的旧对象不受影响。
+
+    float64: 原始特征，距离与face_recognition.face_distance完全相同
+    float16: 半精度存储，内存为1/4
+    int8:    按维度缩放，第d维存储 round(x_d / scale_d)，内存为1/8；
+             距离 sqrt(sum_d scale_d^2 * (q_d - p_d)^2) 在整数数据上分块计算，
+             查询特征按同样的缩放量化，不需要把人脸库还原为浮点矩阵
+    """
+
+    def __init__(self, data, fmt="float64", scale=None):
+        """
+        Args:
+            data: 特征矩阵，形状 (人数, 维度)，dtype与fmt对应
+            fmt: 存储格式，见FORMATS
+            scale: int8格式的每维缩放系数（float32），其他格式为None
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"不支持的人脸库格式: {fmt}")
+        self.data = data
+        self.format = fmt
+        self.scale = scale
+        # 距离展开式 |q-p|^2 = |q|^2 - 2q·p + |p|^2 中每行的 |q|^2（含缩放权重）
+        self.row_norms = self._weighted_norms(data) if len(data) else np.zeros(0, dtype=np.float32)
+
+    @classmethod
+    def empty(cls, fmt="float64", dims=128):
+        return cls(np.zeros((0, dims), dtype=cls._storage_dtype(fmt)), fmt)
+
+    @classmethod
+    def from_encodings(cls, encodings, fmt="float64"):
+        """由float64特征列表创建"""
+        if not len(encodings):
+            return cls.empty(fmt)
+        return cls.empty(fmt, len(encodings[0])).append(encodings)
+
+    @staticmethod
+    def _storage_dtype(fmt):
+        return {"float64": np.float64, "float16": np.float16, "int8": np.int8}[fmt]
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        """特征数据占用的内存（字节）"""
+        return self.data.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def _weights(self):
+        """每维的距离权重（int8为scale的平方）"""
+        if self.scale is None:
+            return None
+        return self.scale.astype(np.float32) ** 2
+
+    def _weighted_norms(self, data):
+        norms = np.empty(len(data), dtype=np.float32)
+        weights = self._weights()
+        for start in range(0, len(data), MATCH_CHUNK_ROWS):
+            chunk = data[start:start + MATCH_CHUNK_ROWS].astype(np.float32)
+            squared = chunk * chunk
+            norms[start:start + len(chunk)] = squared @ weights if weights is not None else squared.sum(axis=1)
+        return norms
+
+    def _quantize(self, encodings, scale):
+        """按给定缩放量化float64特征（int8），超出范围的截断"""
+        return np.clip(np.rint(encodings / scale), -127, 127).astype(np.int8)
+
+    def append(self, encodings):
+        """
+        追加float64特征
+
+        int8格式下新特征超出当前范围时先放大对应维度的缩放系数并重新量化已有数据
+        （已有数据的误差最多增加半个量化步长），不会截断新特征。
+
+        Returns:
+            QuantizedGallery: 新对象
+        """
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, self.data.shape[1])
+        if self.format == "float64":
+            return QuantizedGallery(np.concatenate([self.data, encodings]), self.format)
+        if self.format == "float16":
+            return QuantizedGallery(np.concatenate([self.data, encodings.astype(np.float16)]), self.format)
+
+        needed = np.abs(encodings).max(axis=0) / 127
+        data = self.data
+        scale = self.scale
+        if scale is None or np.any(needed > scale):
+            widened = np.maximum(needed * SCALE_HEADROOM, np.float32(1e-6))
+            scale = widened if scale is None else np.where(needed > scale, widened, scale)
+            scale = scale.astype(np.float32)
+            if len(data):
+                data = self._quantize(data.astype(np.float64) * self.scale, scale)
+        return QuantizedGallery(np.concatenate([data, self._quantize(encodings, scale)]), self.format, scale)
+
+    def select(self, indices):
+        """保留指定行，返回新对象（缩放系数不变）"""
+        return QuantizedGallery(self.data[np.asarray(indices, dtype=np.intp)], self.format, self.scale)
+
+    def decode(self, index):
+        """还原第index行为float64特征（int8/float16有量化误差）"""
+        row = self.data[index].astype(np.float64)
+        return row * self.scale if self.scale is not None else row
+
+    def rows(self):
+        """全部特征（float64）列表"""
+        return [self.decode(i) for i in range(len(self))]
+
+    def convert(self, fmt):
+        """转换为另一种存储格式"""
+        if fmt == self.format:
+            return self
+        return QuantizedGallery.from_encodings(self.rows(), fmt) if len(self) else QuantizedGallery.empty(fmt)
+
+    def distances(self, encoding):
+        """
+        查询特征到每个人脸的欧氏距离
+
+        Returns:
+            ndarray: 形状 (人数,)；float64格式为精确距离，其他格式为float32
+        """
+        encoding = np.asarray(encoding, dtype=np.float64)
+        if self.format == "float64":
+            return np.linalg.norm(self.data - encoding, axis=1)
+
+        weights = self._weights()
+        if weights is None:
+            query = encoding.astype(np.float16).astype(np.float32)
+            weighted_query = query
+            query_norm = float(query @ query)
+        else:
+            query = self._quantize(encoding, self.scale).astype(np.float32)
+            weighted_query = query * weights
+            query_norm = float(query @ weighted_query)
+
+        squared = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), MATCH_CHUNK_ROWS):
+            chunk = self.data[start:start + MATCH_CHUNK_ROWS].astype(np.float32)
+            end = start + len(chunk)
+            squared[start:end] = self.row_norms[start:end] - 2 * (chunk @ weighted_query) + query_norm
+        return np.sqrt(np.maximum(squared, 0))
+
+    def state(self):
+        """可序列化的状态（保存到face_data.pkl）"""
+        return {'format': self.format, 'data': self.data,
+                'scale': self.scale}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['data'], state['format'], state.get('scale'))
+
+
+def match(gallery, names, encoding, tolerance=0.6):
+    """
+    Returns:
+        tuple: (name, distance)，未匹配时name为None，人脸库为空时返回 (None, None)
+    """
+    if not len(gallery):
+        return None, None
+    distances = gallery.distances(encoding)
+    best_match_index = int(np.argmin(distances))
+    distance = float(distances[best_match_index])
+    return (names[best_match_index] if distance < tolerance else None), distance
+
+
+def accuracy_drift(encodings, names, probe_encodings, probe_names, fmt, tolerance=0.6):
+    """
+    在标注集上比较量化人脸库与float64人脸库的识别结果
+
+    Args:
+        encodings, names: 人脸库（float64特征与姓名）
+        probe_encodings, probe_names: 标注集，姓名不在人脸库中的样本期望识别为未知
+        fmt: 量化格式
+        tolerance: 匹配阈值
+
+    Returns:
+        dict: 两种格式的准确率、识别结果一致率、距离误差和内存占用
+    """
+    exact = QuantizedGallery.from_encodings(encodings, "float64")
+    quantized = QuantizedGallery.from_encodings(encodings, fmt)
+    known = set(names)
+
+    exact_correct = quantized_correct = agree = 0
+    errors = []
+    for encoding, label in zip(probe_encodings, probe_names):
+        expected = label if label in known else None
+        exact_name, _ = match(exact, names, encoding, tolerance)
+        quantized_name, _ = match(quantized, names, encoding, tolerance)
+        exact_correct += exact_name == expected
+        quantized_correct += quantized_name == expected
+        agree += exact_name == quantized_name
+        if len(exact):
+            errors.append(np.abs(quantized.distances(encoding) - exact.distances(encoding)).max())
+
+    count = max(len(probe_names), 1)
+    return {
+        'format': fmt,
+        'identities': len(names),
+        'probes': len(probe_names),
+        'float64_accuracy': exact_correct / count,
+        'quantized_accuracy': quantized_correct / count,
+        'accuracy_drift': (quantized_correct - exact_correct) / count,
+        'agreement': agree / count,
+        'max_distance_error': float(max(errors)) if errors else 0.0,
+        'mean_distance_error': float(np.mean(errors)) if errors else 0.0,
+        'float64_bytes': exact.nbytes,
+        'quantized_bytes': quantized.nbytes,
+    }
+
+
+def format_report(report):
+    """精度检查报告（多行文本）"""
+    return "\n".join([
+        f"人脸库 {report['identities']} 人，标注样本 {report['probes']} 个，量化格式 {report['format']}",
+        f"  准确率: float64 {report['float64_accuracy']:.2%}，{report['format']} {report['quantized_accuracy']:.2%}"
+        f"（变化 {report['accuracy_drift']:+.2%}）",
+        f"  识别结果一致率: {report['agreement']:.2%}",
+        f"  距离误差: 最大 {report['max_distance_error']:.5f}，平均 {report['mean_distance_error']:.5f}",
+        f"  内存: float64 {report['float64_bytes']} 字节，{report['format']} {report['quantized_bytes']} 字节",
+    ])
+
+
+def load_face_data(path):
+    """
+    读取face_data.pkl格式的文件（量化保存的人脸库还原为float64）
+
+    Returns:
+        tuple: (encodings, names)
+    """
+    with open(path, 'rb') as f:
+        data = pickle.load(f)
+    if 'quantized' in data:
+        return QuantizedGallery.from_state(data['quantized']).rows(), list(data['names'])
+    return list(data['encodings']), list(data['names'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量化人脸库精度检查")
+    parser.add_argument('labelled', help="标注集（face_data.pkl格式）")
+    parser.add_argument('--gallery', default="face_data.pkl", help="人脸库")
+    parser.add_argument('--format', choices=FORMATS[1:], action='append', help="量化格式，可重复，默认全部")
+    parser.add_argument('--tolerance', type=float, default=0.6, help="匹配阈值")
+    args = parser.parse_args()
+
+    encodings, names = load_face_data(args.gallery)
+    probe_encodings, probe_names = load_face_data(args.labelled)
+    for fmt in args.format or FORMATS[1:]:
+        report = accuracy_drift(encodings, names, probe_encodings, probe_names, fmt, args.tolerance)
+        print(format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
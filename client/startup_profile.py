@@ -0,0 +1,56 @@
+# startup_profile.py
+import time
+import threading
+
+
+class StartupProfile:
+    """记录启动各阶段的耗时，界面线程和后台预热线程都可以记录"""
+
+    def __init__(self, start_time=None):
+        """
+        Args:
+            start_time: 进程启动时刻（time.perf_counter），默认为创建时刻
+        """
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.phases = []  # [(阶段名, 耗时, 结束时距启动的时间), ...]
+        self.lock = threading.Lock()
+
+    def record(self, name, started):
+        """记录一个从started（time.perf_counter）开始、到现在结束的阶段"""
+        now = time.perf_counter()
+        with self.lock:
+            self.phases.append((name, now - started, now - self.start_time))
+
+    def phase(self, name):
+        """上下文管理器: 记录代码块的耗时"""
+        return _Phase(self, name)
+
+    def elapsed(self):
+        """启动至今的时间（秒）"""
+        return time.perf_counter() - self.start_time
+
+    def report(self):
+        """
+        Returns:
+            str: 启动耗时明细，每行一个阶段
+        """
+        with self.lock:
+            phases = list(self.phases)
+        lines = [f"启动耗时明细 (共 {self.elapsed():.2f} 秒):"]
+        for name, duration, finished_at in phases:
+            lines.append(f"  {name}: {duration:.2f} 秒 (启动后 {finished_at:.2f} 秒完成)")
+        return "\n".join(lines)
+
+
+class _Phase:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.record(self.name, self.started)
+        return False
\ No newline at end of file
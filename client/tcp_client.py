@@ -1,21 +1,90 @@
 #client.py
 import socket
 import os
+import time
+import select
+import threading
+import itertools
+from collections import OrderedDict, deque
+import protocol
+from outbox_spool import OutboxSpool
 
 class TCPClient:
-    def __init__(self, server_host='192.168.137.96', server_port=8888):
+    def __init__(self, server_host='192.168.137.96', server_port=8888, use_framing=True,
+                 window_size=1, max_outbox=500, timeout=10,
+                 batch_size=50, max_batch_bytes=4 * 1024 * 1024, retry_interval=5, spool_dir=None):
+        """
+        Args:
+            server_host: 服务器IP地址
+            server_port: 服务器端口
+            use_framing: 使用二进制帧协议，连接旧版服务器时设为False
+            window_size: 允许同时在途的未确认帧数，1为逐条等待确认
+            max_outbox: 内存中未确认消息的最大条数；设置了spool_dir时其余留在磁盘上，
+                        否则超出时丢弃最旧的尚未发出的消息
+            timeout: 等待服务器确认的超时时间（秒）
+            batch_size: 积压时合并为一个批量帧的最大记录数，1为不合并
+            max_batch_bytes: 批量帧的最大负载字节数
+            retry_interval: 服务器回复处理失败后，多久再重发未确认的消息（秒）
+            spool_dir: 未确认记录的磁盘队列目录，重启后继续发送上次未确认的记录；None为只保存在内存中
+        """
         self.server_host = server_host
         self.server_port = server_port
+        self.use_framing = use_framing
+        self.window_size = max(1, window_size)
+        self.max_outbox = max_outbox
+        self.timeout = timeout
+        self.batch_size = max(1, batch_size)
+        self.max_batch_bytes = max_batch_bytes
+        self.retry_interval = retry_interval
+        self.retry_at = 0
         self.socket = None
+        self.next_msg_id = 1
+        
+        # 会话标识，重连后服务器据此告知已处理到的消息编号
+        self.session_id = os.urandom(8)
+        self.outbox = OrderedDict()  # msg_id -> 记录负载，按发送顺序排列的未确认消息
+        self.in_flight = 0           # outbox前in_flight条已在当前连接上发出
+        self.dropped_count = 0       # 没有磁盘队列时因outbox已满丢弃的消息数
+        self.spool = OutboxSpool(spool_dir) if spool_dir else None
+        self.spool_keys = {}         # msg_id -> 磁盘队列中的记录序号
+        self.frame_ends = deque()    # 在途帧的最后一条消息编号，窗口按帧计数
+        self.next_request_id = 1     # 请求-应答类消息的编号，与考勤消息编号互不影响
+        self.replies = {}            # 请求编号 -> 已收到的回复负载
+        self.lock = threading.RLock()
+        self._fill_outbox()
     
     def connect(self):
         """连接到服务器"""
-        try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.server_host, self.server_port))
-            return True
-        except Exception as e:
-            return False
+        with self.lock:
+            self._close_socket()
+            try:
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.settimeout(self.timeout)
+                # 帧头与负载分两次发送，关闭Nagle避免与服务器延迟确认叠加产生停顿
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.socket.connect((self.server_host, self.server_port))
+                self.in_flight = 0
+                if self.use_framing:
+                    self._send_hello()
+                return True
+            except Exception as e:
+                self._close_socket()
+                return False
+    
+    def is_connected(self):
+        """是否持有可用连接"""
+        return self.socket is not None
+    
+    def _close_socket(self):
+        if self.socket:
+            try:
+                self.socket.close()
+            except:
+                pass
+            self.socket = None
+        self.in_flight = 0
+        self.frame_ends.clear()
+        self.replies.clear()
     
     def send_text(self, text):
         """发送文本数据"""
@@ -24,15 +93,15 @@ class TCPClient:
         
         try:
             # 发送数据类型标识
-            self.socket.send("TEXT".ljust(4).encode('utf-8'))
+            self.socket.sendall("TEXT".ljust(4).encode('utf-8'))
             
             # 发送数据长度
             text_data = text.encode('utf-8')
             data_length = len(text_data)
-            self.socket.send(str(data_length).ljust(8).encode('utf-8'))
+            self.socket.sendall(str(data_length).ljust(8).encode('utf-8'))
             
             # 发送实际数据
-            self.socket.send(text_data)
+            self.socket.sendall(text_data)
             
             # 等待服务器确认
             response = self.socket.recv(1024).decode('utf-8')
@@ -45,7 +114,7 @@ class TCPClient:
             return False
     
     def send_file(self, file_path):
-        """发送文件/图片"""
+        """发送文件/图片，文件内容通过内核零拷贝发送"""
         if not self.socket:
             return False
         
@@ -54,25 +123,68 @@ class TCPClient:
         
         try:
             # 发送数据类型标识
-            self.socket.send("FILE".ljust(4).encode('utf-8'))
+            self.socket.sendall("FILE".ljust(4).encode('utf-8'))
             
             # 获取文件信息
             filename = os.path.basename(file_path)
             filesize = os.path.getsize(file_path)
             
             # 发送文件名和文件大小
-            file_info = f"{filename}|{filesize}".ljust(256)
-            self.socket.send(file_info.encode('utf-8'))
+            # 按字节补齐，中文文件名的UTF-8编码长于字符数
+            file_info = f"{filename}|{filesize}".encode('utf-8').ljust(256)
+            self.socket.sendall(file_info)
             
-            # 读取并发送文件数据
+            # 发送文件数据
             with open(file_path, 'rb') as f:
-                sent_bytes = 0
-                while sent_bytes < filesize:
-                    chunk = f.read(4096)
-                    if not chunk:
-                        break
-                    self.socket.send(chunk)
-                    sent_bytes += len(chunk)
+                self._send_file_data(f, filesize)
+            
+            # 等待服务器确认
+            response = self.socket.recv(1024).decode('utf-8')
+            if response == "FILE_RECEIVED":
+                return True
+            else:
+                return False
+                
+        except Exception as e:
+            return False
+    
+    def _send_file_data(self, f, filesize):
+        """
+        发送文件内容，优先使用socket.sendfile（内核零拷贝），
+        不支持时退回分块读取+sendall，保证不会出现部分写入
+        """
+        sent_bytes = 0
+        if hasattr(os, 'sendfile'):
+            try:
+                sent_bytes = self.socket.sendfile(f, 0, filesize)
+            except (OSError, ValueError) as e:
+                # 部分平台/文件系统不支持sendfile，从已发送位置继续
+                sent_bytes = f.tell()
+        
+        if sent_bytes < filesize:
+            f.seek(sent_bytes)
+            while sent_bytes < filesize:
+                chunk = f.read(min(256 * 1024, filesize - sent_bytes))
+                if not chunk:
+                    raise IOError("文件在发送过程中被截断")
+                self.socket.sendall(chunk)
+                sent_bytes += len(chunk)
+    
+    def send_bytes(self, filename, file_data):
+        """发送内存中的文件数据（如已编码的JPEG），协议与send_file相同"""
+        if not self.socket:
+            return False
+        
+        try:
+            # 发送数据类型标识
+            self.socket.sendall("FILE".ljust(4).encode('utf-8'))
+            
+            # 发送文件名和文件大小
+            file_info = f"{filename}|{len(file_data)}".encode('utf-8').ljust(256)
+            self.socket.sendall(file_info)
+            
+            # 发送文件数据
+            self.socket.sendall(file_data)
             
             # 等待服务器确认
             response = self.socket.recv(1024).decode('utf-8')
@@ -84,12 +196,278 @@ class TCPClient:
         except Exception as e:
             return False
     
+    def send_record(self, text, filename=None, file_data=None):
+        """
+        发送一条考勤记录，照片与文本在同一帧中
+        
+        window_size为1时等待该记录被确认；大于1时只要求记录进入发送窗口，
+        确认在后续发送或flush时累计处理。未连接时记录保留在outbox中，重连后
+        积压的记录合并为批量帧重发。
+        
+        Args:
+            text: 考勤文本 "日期,时间,姓名"
+            filename: 照片文件名
+            file_data: 照片数据（已编码的JPEG）
+        """
+        with self.lock:
+            if not self.use_framing:
+                if not self.socket:
+                    return False
+                # 旧协议: 文本和照片分两次发送
+                if not self.send_text(text):
+                    return False
+                if filename and file_data:
+                    return self.send_bytes(filename, file_data)
+                return True
+            
+            self.queue_record(text, filename, file_data)
+            if not self.socket:
+                return False
+            return self._pump(wait_all=self.window_size <= 1)
+    
+    def queue_record(self, text, filename=None, file_data=None):
+        """
+        把一条考勤记录放入outbox但不发送（仅帧协议）；设置了spool_dir时返回前已落盘，
+        调用方可据此在记录不会丢失之后再更新自己的状态，随后用send_queued发送
+        """
+        with self.lock:
+            payload = protocol.encode_record(text, filename, file_data)
+            if self.spool is not None:
+                # 先落盘，outbox已满时留在磁盘上，确认腾出空位后再装载
+                self.spool.append(payload)
+                self._fill_outbox()
+            else:
+                msg_id = self.next_msg_id
+                self.next_msg_id += 1
+                self.outbox[msg_id] = payload
+                
+                while len(self.outbox) > self.max_outbox:
+                    # 丢弃最旧的尚未发出的消息，在途消息的窗口计数（in_flight、frame_ends）不受影响；
+                    # 新消息尚未发出，总有可丢弃的消息
+                    dropped_id = next(itertools.islice(self.outbox, self.in_flight, None))
+                    del self.outbox[dropped_id]
+                    self.dropped_count += 1
+                    print(f"待发送消息过多，丢弃消息 {dropped_id}（累计丢弃 {self.dropped_count} 条）")
+    
+    def send_queued(self):
+        """发送outbox中的记录，等待方式与send_record相同"""
+        with self.lock:
+            if not self.outbox:
+                return True
+            if not self.socket:
+                return False
+            return self._pump(wait_all=self.window_size <= 1)
+    
+    def flush(self):
+        """发送全部未确认消息并等待确认"""
+        with self.lock:
+            if not self.outbox:
+                return True
+            if not self.socket:
+                return False
+            return self._pump(wait_all=True)
+    
+    def get_pending_count(self):
+        """获取未确认消息数（含磁盘队列中尚未装载的）"""
+        if self.spool is not None:
+            return len(self.spool)
+        return len(self.outbox)
+    
+    def _fill_outbox(self):
+        """从磁盘队列按顺序装载记录，直到outbox达到max_outbox条"""
+        while self.spool is not None and self.spool.has_pending() and len(self.outbox) < self.max_outbox:
+            record = self.spool.take()
+            if record is None:
+                break
+            key, payload = record
+            msg_id = self.next_msg_id
+            self.next_msg_id += 1
+            self.outbox[msg_id] = payload
+            self.spool_keys[msg_id] = key
+    
+    def _pump(self, wait_all=False):
+        """
+        在窗口允许范围内发送outbox中的消息，并处理已到达的确认
+        
+        Args:
+            wait_all: 是否阻塞直到outbox全部被确认
+        """
+        if time.monotonic() < self.retry_at:
+            # 服务器刚回复处理失败，暂不重发
+            return False
+        try:
+            while True:
+                # 填满发送窗口
+                while len(self.frame_ends) < self.window_size and self.in_flight < len(self.outbox):
+                    self._send_next_frame()
+                
+                if not self.outbox:
+                    return True
+                
+                # 窗口已满或需要等待全部确认时阻塞读取，否则只处理已到达的确认
+                if wait_all or len(self.frame_ends) >= self.window_size or self._ack_ready():
+                    self._read_frame()
+                else:
+                    return True
+                    
+        except Exception as e:
+            # 连接失效，未确认消息留在outbox中，重连后重发
+            self._close_socket()
+            return False
+    
+    def _send_next_frame(self):
+        """发送outbox中下一段未发出的消息，积压多条时合并为一个批量帧"""
+        pending = itertools.islice(self.outbox.items(), self.in_flight,
+                                   self.in_flight + self.batch_size)
+        batch_ids = []
+        batch_payloads = []
+        batch_bytes = 0
+        for msg_id, payload in pending:
+            if batch_payloads and batch_bytes + len(payload) > self.max_batch_bytes:
+                break
+            batch_ids.append(msg_id)
+            batch_payloads.append(payload)
+            batch_bytes += len(payload)
+        
+        last_id = batch_ids[-1]
+        if len(batch_payloads) == 1:
+            msg_type, payload = protocol.MSG_RECORD, batch_payloads[0]
+        else:
+            msg_type, payload = protocol.MSG_BATCH, protocol.encode_batch(batch_payloads)
+        
+        self.socket.sendall(protocol.pack_header(msg_type, last_id, len(payload)))
+        self.socket.sendall(payload)
+        self.in_flight += len(batch_ids)
+        self.frame_ends.append(last_id)
+    
+    def _ack_ready(self):
+        readable, _, _ = select.select([self.socket], [], [], 0)
+        return bool(readable)
+    
+    def _send_hello(self):
+        """声明会话，服务器回复该会话已处理到的消息编号"""
+        payload = protocol.encode_hello(self.session_id)
+        self.socket.sendall(protocol.pack_frame(protocol.MSG_HELLO, 0, payload))
+        self._read_frame()
+    
+    def _read_frame(self):
+        """
+        读取一个帧: 确认帧按累计确认移除outbox中编号不大于它的消息，
+        请求的回复帧（识别结果、人脸库增量）保存到replies中，由等待它的request取走
+        """
+        header = protocol.recv_exact(self.socket, protocol.HEADER.size)
+        if header is None:
+            raise ConnectionError("服务器关闭了连接")
+        _, msg_type, _, ack_id, payload_len = protocol.unpack_header(header)
+        payload = protocol.recv_exact(self.socket, payload_len) if payload_len else b''
+        if payload is None:
+            raise ConnectionError("服务器关闭了连接")
+        if msg_type in (protocol.MSG_RESULT, protocol.MSG_GALLERY):
+            self.replies[ack_id] = payload
+            return
+        if msg_type != protocol.MSG_ACK:
+            raise protocol.ProtocolError(f"期望确认帧，收到类型 {msg_type}")
+        
+        status = protocol.decode_ack(payload)
+        if status != protocol.STATUS_OK:
+            # 累计确认中有消息未能持久化，无法区分是哪一条: 全部保留在outbox中，
+            # 断开连接并在retry_interval秒后重连，服务器在HELLO中回复实际已处理到的编号
+            print(f"服务器处理消息 {ack_id} 失败，状态码 {status}，{self.retry_interval}秒后重发")
+            self.retry_at = time.monotonic() + self.retry_interval
+            raise ConnectionError(f"服务器处理消息 {ack_id} 失败")
+        
+        while self.outbox:
+            msg_id = next(iter(self.outbox))
+            if msg_id > ack_id:
+                break
+            self.outbox.popitem(last=False)
+            if self.in_flight:
+                self.in_flight -= 1
+            key = self.spool_keys.pop(msg_id, None)
+            if key is not None:
+                self.spool.remove(key)
+        while self.frame_ends and self.frame_ends[0] <= ack_id:
+            self.frame_ends.popleft()
+        self._fill_outbox()
+    
+    def request(self, msg_type, payload, timeout=None):
+        """
+        发送一个请求-应答类消息（识别、人脸库同步），使用与考勤记录相同的连接
+        
+        请求不进入outbox，连接失败时不重发，由调用方决定如何处理。
+        等待回复期间到达的考勤确认照常处理。
+        
+        Args:
+            msg_type: 消息类型
+            payload: 请求负载
+            timeout: 等待回复的超时时间（秒），默认与确认超时相同
+        
+        Returns:
+            bytes: 回复负载，未连接或连接失效时返回None
+        """
+        with self.lock:
+            if not self.use_framing or not self.socket:
+                return None
+            request_id = self.next_request_id
+            self.next_request_id += 1
+            deadline = time.monotonic() + (timeout or self.timeout)
+            try:
+                self.socket.sendall(protocol.pack_header(msg_type, request_id, len(payload)))
+                self.socket.sendall(payload)
+                while request_id not in self.replies:
+                    if time.monotonic() > deadline:
+                        raise socket.timeout("等待服务器回复超时")
+                    self._read_frame()
+                return self.replies.pop(request_id)
+            except Exception as e:
+                # 连接状态已无法确定，未确认的考勤记录留在outbox中，重连后重发
+                self._close_socket()
+                return None
+    
+    def recognize(self, image_data, locations=None, timeout=None):
+        """
+        请求服务器识别，失败时由调用方退回本地识别
+        
+        Args:
+            image_data: JPEG编码的图像
+            locations: 已检测的人脸位置列表（图像坐标），None表示由服务器检测
+            timeout: 等待结果的超时时间（秒）
+        
+        Returns:
+            tuple: (status, [(name, distance, location), ...])，未连接或连接失效时返回None
+        """
+        reply = self.request(protocol.MSG_RECOGNIZE, protocol.encode_recognize(image_data, locations), timeout)
+        return protocol.decode_result(reply) if reply is not None else None
+    
+    def sync_gallery(self, version):
+        """
+        拉取服务器人脸库在version之后的增量
+        
+        Returns:
+            tuple: (status, reached, latest, changes)，见protocol.decode_gallery；连接失效时返回None
+        """
+        reply = self.request(protocol.MSG_GALLERY_SYNC, protocol.encode_gallery_sync(version))
+        return protocol.decode_gallery(reply) if reply is not None else None
+    
+    def enroll(self, version, name, encoding):
+        """
+        上传注册的人脸，回复为version之后的增量（包含本次注册的人脸）
+        
+        Returns:
+            tuple: 同sync_gallery，连接失效时返回None
+        """
+        reply = self.request(protocol.MSG_ENROLL, protocol.encode_enroll(version, name, encoding))
+        return protocol.decode_gallery(reply) if reply is not None else None
+    
     def disconnect(self):
         """断开连接"""
-        if self.socket:
-            try:
-                self.socket.send("EXIT".ljust(4).encode('utf-8'))
-            except:
-                pass
-            self.socket.close()
-            self.socket = None
\ No newline at end of file
+        with self.lock:
+            if self.socket:
+                try:
+                    if self.use_framing:
+                        self.socket.sendall(protocol.pack_frame(protocol.MSG_EXIT, 0))
+                    else:
+                        self.socket.send("EXIT".ljust(4).encode('utf-8'))
+                except:
+                    pass
+            self._close_socket()
\ No newline at end of file
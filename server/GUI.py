@@ -1,41 +1,55 @@
+import os
 import sys
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QTextEdit, QLabel, QWidget, QSplitter, 
-                             QListWidget, QTabWidget, QMessageBox, QFileDialog,
-                             QScrollArea, QComboBox)
-from PyQt5.QtCore import Qt, pyqtSignal, QThread
+                             QListWidget, QListView, QTabWidget, QMessageBox, QFileDialog,
+                             QScrollArea, QComboBox, QDateEdit, QCheckBox, QLineEdit,
+                             QProgressDialog)
+from PyQt5.QtCore import Qt, pyqtSignal, QThread, QDate, QTimer
 from PyQt5.QtGui import QPixmap, QImage
 
 from data_manager import DataManager
+from history_model import HistoryListModel
+from thumbnail_cache import ThumbnailStore, ThumbnailWorker, PixmapCache
+from update_batcher import UpdateBatcher
 import tcp_server
+import async_server
+
+# 服务器实现: "asyncio" 单线程事件循环, "threaded" 每连接一个线程
+SERVER_ENGINE = "asyncio"
+# 指标服务端口（仅本机访问 http://127.0.0.1:端口/metrics），None表示不启动
+METRICS_PORT = 9108
+# 服务器端识别进程数（开发板可选择上传缩小的帧由服务器识别），0表示不启用
+RECOGNITION_WORKERS = 2
 
 class ServerThread(QThread):
     """服务器线程，用于在后台运行TCP服务器"""
-    text_received = pyqtSignal(str, tuple)
-    file_received = pyqtSignal(str, bytes, tuple)
+    # 只传递记录字典（照片为文件引用），照片数据不经过信号复制
+    record_saved = pyqtSignal(dict)
     client_connected = pyqtSignal(tuple)
     client_disconnected = pyqtSignal(tuple)
     
-    def __init__(self, host='192.168.137.96', port=8888):
+    def __init__(self, host='192.168.137.96', port=8888, engine=SERVER_ENGINE, photo_callback=None):
         super().__init__()
-        self.server = tcp_server.TCPServerModule(host, port)
+        self.photo_callback = photo_callback
+        if engine == "asyncio":
+            self.server = async_server.AsyncTCPServerModule(host, port)
+        else:
+            self.server = tcp_server.TCPServerModule(host, port)
         self.setup_callbacks()
         
     def setup_callbacks(self):
         """设置回调函数"""
         self.server.set_callbacks(
-            text_callback=self.on_text_received,
-            file_callback=self.on_file_received,
             connect_callback=self.on_client_connected,
-            disconnect_callback=self.on_client_disconnected
+            disconnect_callback=self.on_client_disconnected,
+            photo_callback=self.photo_callback,
+            record_callback=self.on_record_saved
         )
     
-    def on_text_received(self, text, client_address):
-        self.text_received.emit(text, client_address)
-    
-    def on_file_received(self, filename, file_data, client_address):
-        self.file_received.emit(filename, file_data, client_address)
+    def on_record_saved(self, record):
+        self.record_saved.emit(record)
     
     def on_client_connected(self, client_address):
         self.client_connected.emit(client_address)
@@ -45,21 +59,101 @@ class ServerThread(QThread):
     
     def run(self):
         if not self.server.start_server():
-            pass
+            return
+        if METRICS_PORT is not None:
+            self.server.start_metrics(METRICS_PORT)
+        if RECOGNITION_WORKERS:
+            self.server.enable_recognition(RECOGNITION_WORKERS)
     
     def stop(self):
         self.server.stop_server()
 
+class ExportThread(QThread):
+    """导出线程，在后台流式写出CSV并报告进度"""
+    progress = pyqtSignal(int, int)
+    finished_export = pyqtSignal(object)  # 导出记录数，取消时为None
+    failed = pyqtSignal(str)
+    
+    def __init__(self, data_manager, output_path, filters):
+        super().__init__()
+        self.data_manager = data_manager
+        self.output_path = output_path
+        self.filters = filters
+        self.cancelled = False
+    
+    def run(self):
+        try:
+            count = self.data_manager.export_to_csv(
+                self.output_path, progress_callback=self.on_progress, **self.filters)
+            self.finished_export.emit(count)
+        except Exception as e:
+            self.failed.emit(str(e))
+    
+    def on_progress(self, done, total):
+        self.progress.emit(done, total)
+        return not self.cancelled
+    
+    def cancel(self):
+        self.cancelled = True
+
 class ServerGUI(QMainWindow):
-    def __init__(self):
+    legacy_indexed = pyqtSignal(int)
+    
+    def __init__(self, attach=False):
+        """
+        Args:
+            attach: 查看模式，不启动服务器，只跟踪无界面守护进程(daemon.py)写入的记录
+        """
         super().__init__()
         self.server_thread = None
+        self.attach = attach
         self.data_manager = DataManager()
-        self.history_entries = []
+        # 历史数据按页在后台加载
+        self.history_model = HistoryListModel(self.data_manager)
+        self.history_model.total_changed.connect(self.on_history_total_changed)
+        self.history_model.load_failed.connect(self.on_history_load_failed)
+        # 缩略图在照片入库时由后台线程生成，显示时只解码缩略图
+        self.thumbnails = ThumbnailStore(self.data_manager.data_dir)
+        self.thumbnail_worker = ThumbnailWorker(self.thumbnails)
+        self.pixmap_cache = PixmapCache()
+        self.full_image_source = None  # 当前显示图片的原图（文件路径或图片数据）
+        self.session_images = None  # 服务器的当前会话照片存储
+        # 入库记录合并后按最多10Hz刷新界面
+        self.record_batcher = UpdateBatcher(self.apply_saved_records, 100, self)
+        self.export_thread = None
+        self.export_progress = None
         self.connected_ips = set()
         
         self.init_ui()
         self.load_history_data()
+        
+        # 旧版本数据目录在后台建立索引，完成后刷新历史数据
+        self.legacy_indexed.connect(self.on_legacy_indexed)
+        self.data_manager.start_legacy_indexing(self.legacy_indexed.emit)
+        
+        if self.attach:
+            self.start_attached_viewer()
+    
+    def start_attached_viewer(self):
+        """查看模式: 禁用服务器控制，定期读取守护进程新写入数据库的记录"""
+        self.start_btn.setEnabled(False)
+        self.stop_btn.setEnabled(False)
+        self.statusBar().showMessage('查看模式: 记录由守护进程写入')
+        self.tail_last_id = self.data_manager.latest_record_id()
+        self.tail_timer = QTimer(self)
+        self.tail_timer.timeout.connect(self.poll_daemon_records)
+        self.tail_timer.start(1000)
+    
+    def poll_daemon_records(self):
+        """读取守护进程新写入的记录，与本地服务器的入库记录同样显示"""
+        try:
+            records = self.data_manager.load_records_after(self.tail_last_id)
+        except Exception as e:
+            self.statusBar().showMessage(f'读取守护进程记录失败: {str(e)}')
+            return
+        if records:
+            self.tail_last_id = records[-1]['id']
+            self.apply_saved_records(records)
     
     def init_ui(self):
         """初始化UI界面"""
@@ -110,13 +204,13 @@ class ServerGUI(QMainWindow):
         self.hour_combo = QComboBox()
         for i in range(24):
             self.hour_combo.addItem(f"{i:02d}")
-        self.hour_combo.setCurrentText("09")  # 默认9点
+        self.hour_combo.setCurrentText(f"{self.data_manager.deadline_hour:02d}")  # 默认9点
         
         # 分钟下拉框
         self.minute_combo = QComboBox()
         for i in range(0, 60, 5):  # 每5分钟一个选项
             self.minute_combo.addItem(f"{i:02d}")
-        self.minute_combo.setCurrentText("00")  # 默认00分
+        self.minute_combo.setCurrentText(f"{self.data_manager.deadline_minute:02d}")  # 默认00分
         
         time_setting_layout.addWidget(self.hour_combo)
         time_setting_layout.addWidget(QLabel('时'))
@@ -131,11 +225,40 @@ class ServerGUI(QMainWindow):
         attendance_time_layout.addLayout(time_setting_layout)
         
         # 显示当前设置的截止时间
-        self.current_time_label = QLabel('当前截止时间: 09:00')
+        self.current_time_label = QLabel(
+            f'当前截止时间: {self.data_manager.deadline_hour:02d}:{self.data_manager.deadline_minute:02d}')
         attendance_time_layout.addWidget(self.current_time_label)
         
         layout.addLayout(attendance_time_layout)
         
+        # 导出筛选条件
+        export_layout = QVBoxLayout()
+        export_layout.addWidget(QLabel('导出筛选:'))
+        
+        date_layout = QHBoxLayout()
+        self.export_date_check = QCheckBox('日期')
+        self.export_date_from = QDateEdit(QDate.currentDate().addMonths(-6))
+        self.export_date_from.setCalendarPopup(True)
+        self.export_date_from.setDisplayFormat('yyyy-MM-dd')
+        self.export_date_to = QDateEdit(QDate.currentDate())
+        self.export_date_to.setCalendarPopup(True)
+        self.export_date_to.setDisplayFormat('yyyy-MM-dd')
+        date_layout.addWidget(self.export_date_check)
+        date_layout.addWidget(self.export_date_from)
+        date_layout.addWidget(QLabel('至'))
+        date_layout.addWidget(self.export_date_to)
+        export_layout.addLayout(date_layout)
+        
+        filter_layout = QHBoxLayout()
+        self.export_name_edit = QLineEdit()
+        self.export_name_edit.setPlaceholderText('姓名（留空为全部）')
+        self.export_status_combo = QComboBox()
+        self.export_status_combo.addItems(['全部', '正常', '迟到'])
+        filter_layout.addWidget(self.export_name_edit)
+        filter_layout.addWidget(self.export_status_combo)
+        export_layout.addLayout(filter_layout)
+        layout.addLayout(export_layout)
+        
         # 功能按钮
         self.export_btn = QPushButton('导出数据到CSV')
         self.export_btn.clicked.connect(self.export_to_csv)
@@ -145,6 +268,10 @@ class ServerGUI(QMainWindow):
         self.refresh_btn.clicked.connect(self.load_history_data)
         layout.addWidget(self.refresh_btn)
         
+        self.report_btn = QPushButton('今日考勤统计')
+        self.report_btn.clicked.connect(self.show_daily_report)
+        layout.addWidget(self.report_btn)
+        
         # 连接客户端信息
         clients_layout = QVBoxLayout()
         clients_layout.addWidget(QLabel('连接客户端:'))
@@ -161,8 +288,11 @@ class ServerGUI(QMainWindow):
         self.current_data_list.currentRowChanged.connect(self.on_current_data_selected)
         self.data_tabs.addTab(self.current_data_list, "当前数据")
         
-        self.history_data_list = QListWidget()
-        self.history_data_list.currentRowChanged.connect(self.on_history_data_selected)
+        self.history_data_list = QListView()
+        self.history_data_list.setUniformItemSizes(True)
+        self.history_data_list.setModel(self.history_model)
+        self.history_data_list.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.on_history_data_selected(current.row()))
         self.data_tabs.addTab(self.history_data_list, "历史数据")
         
         data_list_layout.addWidget(self.data_tabs)
@@ -195,6 +325,10 @@ class ServerGUI(QMainWindow):
         self.image_scroll.setWidget(self.image_label)
         self.image_scroll.setWidgetResizable(True)
         image_layout.addWidget(self.image_scroll)
+        self.full_image_btn = QPushButton('查看原图')
+        self.full_image_btn.clicked.connect(self.show_full_image)
+        self.full_image_btn.setEnabled(False)
+        image_layout.addWidget(self.full_image_btn)
         layout.addLayout(image_layout)
         
         return right_widget
@@ -202,9 +336,9 @@ class ServerGUI(QMainWindow):
     def start_server(self):
         """启动服务器"""
         try:
-            self.server_thread = ServerThread()
-            self.server_thread.text_received.connect(self.on_text_data_received)
-            self.server_thread.file_received.connect(self.on_file_data_received)
+            self.server_thread = ServerThread(photo_callback=self.thumbnail_worker.submit)
+            self.server_thread.record_saved.connect(self.record_batcher.add)
+            self.session_images = self.server_thread.server.enable_session_images()
             self.server_thread.client_connected.connect(self.on_client_connected)
             self.server_thread.client_disconnected.connect(self.on_client_disconnected)
             self.server_thread.start()
@@ -215,6 +349,7 @@ class ServerGUI(QMainWindow):
             
             self.data_manager.clear_current_data()
             self.current_data_list.clear()
+            self.pixmap_cache.clear()
             
             QMessageBox.information(self, '成功', '服务器启动成功！')
             
@@ -227,6 +362,8 @@ class ServerGUI(QMainWindow):
             self.server_thread.stop()
             self.server_thread.wait()
             self.server_thread = None
+            # 显示停止前已入库但尚未刷新的记录
+            self.record_batcher.flush()
             
             self.start_btn.setEnabled(True)
             self.stop_btn.setEnabled(False)
@@ -234,32 +371,42 @@ class ServerGUI(QMainWindow):
             
             QMessageBox.information(self, '成功', '服务器已停止！')
     
-    def on_text_data_received(self, text, client_address):
-        """处理接收到的文本数据"""
-        try:
-            data_entry = self.data_manager.parse_text_data(text, client_address)
-            if data_entry:
-                display_text = self.data_manager.get_current_data_display(data_entry)
-                self.current_data_list.addItem(display_text)
-                self.current_data_list.setCurrentRow(self.current_data_list.count() - 1)
-                self.show_data_detail(data_entry)
-                self.statusBar().showMessage(f'收到来自 {client_address} 的文本数据')
-                
-        except Exception as e:
-            self.statusBar().showMessage(f'处理文本数据时出错: {str(e)}')
-    
-    def on_file_data_received(self, filename, file_data, client_address):
-        """处理接收到的文件数据"""
-        try:
-            timestamp = self.data_manager.add_image_data(filename, file_data, client_address)
-            if timestamp:
-                self.display_image(file_data)
-                self.statusBar().showMessage(f'收到来自 {client_address} 的图片: {filename}')
+    def apply_saved_records(self, records):
+        """
+        处理一批服务器已入库的记录
+        
+        新记录一次性加入列表，只选中并显示最后一条，因此每批最多解码一张照片。
+        """
+        new_entries = []
+        updated_entries = []
+        for record in records:
+            try:
+                data_entry, is_new = self.data_manager.add_session_record(record)
+            except Exception as e:
+                self.statusBar().showMessage(f'处理考勤记录时出错: {str(e)}')
+                continue
+            if is_new:
+                new_entries.append(data_entry)
             else:
-                self.statusBar().showMessage(f'收到来自 {client_address} 的文件: {filename}')
-                
-        except Exception as e:
-            self.statusBar().showMessage(f'处理文件数据时出错: {str(e)}')
+                # 旧协议照片晚于文本到达，补充到已有的记录
+                updated_entries.append(data_entry)
+        
+        if new_entries:
+            self.current_data_list.addItems(
+                [self.data_manager.get_current_data_display(entry) for entry in new_entries])
+            # 选中最后一条，由 on_current_data_selected 显示详情和照片
+            self.current_data_list.setCurrentRow(self.current_data_list.count() - 1)
+            if len(new_entries) == 1:
+                self.statusBar().showMessage(f'收到来自 {new_entries[0]["client_address"]} 的考勤记录')
+            else:
+                self.statusBar().showMessage(
+                    f'收到 {len(new_entries)} 条考勤记录，最近一条来自 {new_entries[-1]["client_address"]}')
+        elif updated_entries:
+            current_row = self.current_data_list.currentRow()
+            current_data = self.data_manager.current_data
+            if 0 <= current_row < len(current_data) and \
+                    any(entry is current_data[current_row] for entry in updated_entries):
+                self.display_session_photo(current_data[current_row])
     
     def on_client_connected(self, client_address):
         """处理客户端连接"""
@@ -285,69 +432,135 @@ class ServerGUI(QMainWindow):
         if 0 <= row < len(current_data):
             data_entry = current_data[row]
             self.show_data_detail(data_entry)
-            image_data = self.data_manager.get_image_for_timestamp(data_entry['timestamp'])
-            if image_data:
-                self.display_image(image_data)
-            else:
-                self.image_label.setText("该记录无对应图片")
-                self.image_label.setPixmap(QPixmap())
+            self.display_session_photo(data_entry)
     
     def on_history_data_selected(self, row):
         """历史数据项被选中"""
-        if 0 <= row < len(self.history_entries):
-            entry = self.history_entries[row]
+        entry = self.history_model.entry(row)
+        if entry:
             try:
-                data_entry = self.data_manager.load_history_entry_detail(entry['file_path'])
+                data_entry = self.data_manager.load_history_entry_detail(entry['record_id'])
                 if data_entry:
                     self.show_data_detail(data_entry)
-                    image_data = self.data_manager.load_history_image(entry['file_path'])
-                    if image_data:
-                        self.display_image(image_data)
+                    photo_path = self.data_manager.get_history_photo_path(entry['record_id'])
+                    if photo_path:
+                        self.display_photo_file(photo_path)
                     else:
-                        self.image_label.setText("该记录无对应图片")
-                        self.image_label.setPixmap(QPixmap())
+                        self.clear_image("该记录无对应图片")
             except Exception as e:
-                self.data_detail.setText(f"读取历史数据文件失败: {str(e)}")
-                self.image_label.setText("加载历史图片失败")
+                self.data_detail.setText(f"读取历史数据失败: {str(e)}")
+                self.clear_image("加载历史图片失败")
     
     def show_data_detail(self, data_entry):
         """显示数据详情"""
         detail_text = self.data_manager.get_data_detail_text(data_entry)
         self.data_detail.setText(detail_text)
     
-    def display_image(self, image_data):
-        """显示图片"""
+    def display_session_photo(self, data_entry):
+        """
+        显示当前会话记录的照片: 优先使用已缓存的图片和内存中的照片数据，
+        已从内存淘汰的照片与历史记录相同，只解码磁盘缩略图
+        """
+        if not data_entry.get('photo_path'):
+            self.clear_image("该记录无对应图片")
+            return
+        
+        photo_path = os.path.join(self.data_manager.data_dir, data_entry['photo_path'])
+        cache_key = ('current', data_entry['record_id'])
+        pixmap = self.pixmap_cache.get(cache_key)
+        if pixmap is not None:
+            self.show_pixmap(pixmap, photo_path)
+            return
+        
+        image_data = self.session_images.get(data_entry['record_id']) if self.session_images else None
+        if image_data is not None:
+            self.display_image(image_data, cache_key, photo_path)
+        else:
+            self.display_photo_file(photo_path)
+    
+    def display_image(self, image_data, cache_key=None, full_image_source=None):
+        """
+        显示内存中的图片（当前会话），缩小后的图片按cache_key缓存
+        
+        Args:
+            image_data: 图片二进制数据
+            cache_key: 缓存键，None表示不缓存
+            full_image_source: 原图的文件路径，默认为image_data本身
+        """
         try:
-            image = QImage()
-            image.loadFromData(image_data)
-            if not image.isNull():
+            pixmap = self.pixmap_cache.get(cache_key) if cache_key else None
+            if pixmap is None:
+                image = QImage()
+                image.loadFromData(image_data)
+                if image.isNull():
+                    self.clear_image("图片加载失败")
+                    return
+                if image.width() > self.thumbnails.max_width or image.height() > self.thumbnails.max_height:
+                    image = image.scaled(self.thumbnails.max_width, self.thumbnails.max_height,
+                                         Qt.KeepAspectRatio, Qt.SmoothTransformation)
                 pixmap = QPixmap.fromImage(image)
-                scaled_pixmap = pixmap.scaled(
-                    self.image_label.width(), 
-                    self.image_label.height(),
-                    Qt.KeepAspectRatio,
-                    Qt.SmoothTransformation
-                )
-                self.image_label.setPixmap(scaled_pixmap)
-            else:
-                self.image_label.setText("图片加载失败")
+                if cache_key:
+                    self.pixmap_cache.put(cache_key, pixmap)
+            self.show_pixmap(pixmap, full_image_source or image_data)
         except Exception as e:
-            self.image_label.setText(f"显示图片时出错: {str(e)}")
+            self.clear_image(f"显示图片时出错: {str(e)}")
     
-    def load_history_data(self):
-        """加载历史数据"""
+    def display_photo_file(self, photo_path):
+        """显示磁盘上的照片: 只解码缩略图，缺少缩略图时先生成"""
         try:
-            self.history_entries = self.data_manager.load_history_data()
-            self.history_data_list.clear()
-            
-            for entry in self.history_entries:
-                item = self.history_data_list.addItem(entry['display_text'])
-                self.history_data_list.item(self.history_data_list.count() - 1).setData(Qt.UserRole, entry['file_path'])
-            
-            self.statusBar().showMessage(f'已加载 {len(self.history_entries)} 条历史记录')
-            
+            thumbnail_path = self.thumbnails.get_or_generate(photo_path)
+            pixmap = self.pixmap_cache.load_file(thumbnail_path) if thumbnail_path else None
+            if pixmap is None:
+                self.clear_image("图片加载失败")
+                return
+            self.show_pixmap(pixmap, photo_path)
         except Exception as e:
-            QMessageBox.warning(self, '警告', f'加载历史数据失败: {str(e)}')
+            self.clear_image(f"显示图片时出错: {str(e)}")
+    
+    def show_pixmap(self, pixmap, full_image_source):
+        """显示已解码的图片，并记录原图以便按需查看"""
+        self.image_label.setPixmap(pixmap)
+        self.full_image_source = full_image_source
+        self.full_image_btn.setEnabled(True)
+    
+    def clear_image(self, message):
+        """清空图片区域并显示提示文字"""
+        self.image_label.setPixmap(QPixmap())
+        self.image_label.setText(message)
+        self.full_image_source = None
+        self.full_image_btn.setEnabled(False)
+    
+    def show_full_image(self):
+        """按需解码并显示原图（可滚动查看）"""
+        source = self.full_image_source
+        if source is None:
+            return
+        if isinstance(source, str):
+            pixmap = QPixmap(source)
+        else:
+            pixmap = QPixmap()
+            pixmap.loadFromData(source)
+        if pixmap.isNull():
+            self.image_label.setText("原图加载失败")
+            return
+        self.image_label.setPixmap(pixmap)
+    
+    def load_history_data(self):
+        """重新加载历史数据（第一页与总数在后台查询）"""
+        self.history_model.reload()
+        self.statusBar().showMessage('正在加载历史记录...')
+    
+    def on_history_total_changed(self, total):
+        """历史记录总数统计完成"""
+        self.statusBar().showMessage(f'共 {total} 条历史记录')
+    
+    def on_legacy_indexed(self, added):
+        """旧数据索引建立完成"""
+        self.load_history_data()
+    
+    def on_history_load_failed(self, message):
+        """历史记录分页加载失败"""
+        QMessageBox.warning(self, '警告', f'加载历史数据失败: {message}')
     
     def set_attendance_time(self):
         """设置考勤截止时间"""
@@ -362,23 +575,75 @@ class ServerGUI(QMainWindow):
         
         QMessageBox.information(self, '成功', f'考勤截止时间已设置为 {hour:02d}:{minute:02d}')
 
-    def export_to_csv(self):
-        """导出数据到CSV文件"""
+    def show_daily_report(self):
+        """显示今日考勤统计（读取汇总表）"""
         try:
-            file_path, _ = QFileDialog.getSaveFileName(
-                self, 
-                '导出CSV文件', 
-                f'考勤数据_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
-                'CSV文件 (*.csv)'
-            )
-            
-            if file_path:
-                success = self.data_manager.export_to_csv(self.history_entries, file_path)
-                if success:
-                    QMessageBox.information(self, '成功', f'数据已导出到: {file_path}')
-                
+            self.data_detail.setText(self.data_manager.get_daily_report_text(datetime.now().strftime("%Y-%m-%d")))
+            self.clear_image("暂无图片")
         except Exception as e:
-            QMessageBox.critical(self, '错误', f'导出CSV文件失败: {str(e)}')
+            QMessageBox.warning(self, '警告', f'读取考勤统计失败: {str(e)}')
+    
+    def export_to_csv(self):
+        """按筛选条件在后台导出数据到CSV文件"""
+        if self.export_thread and self.export_thread.isRunning():
+            return
+        
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, 
+            '导出CSV文件', 
+            f'考勤数据_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
+            'CSV文件 (*.csv)'
+        )
+        if not file_path:
+            return
+        
+        filters = {}
+        if self.export_date_check.isChecked():
+            filters['date_from'] = self.export_date_from.date().toString('yyyy-MM-dd')
+            filters['date_to'] = self.export_date_to.date().toString('yyyy-MM-dd')
+        if self.export_name_edit.text().strip():
+            filters['name'] = self.export_name_edit.text().strip()
+        if self.export_status_combo.currentText() != '全部':
+            filters['status'] = self.export_status_combo.currentText()
+        
+        self.export_progress = QProgressDialog('正在导出...', '取消', 0, 0, self)
+        self.export_progress.setWindowTitle('导出CSV文件')
+        self.export_progress.setMinimumDuration(500)
+        
+        self.export_thread = ExportThread(self.data_manager, file_path, filters)
+        self.export_thread.progress.connect(self.on_export_progress)
+        self.export_thread.finished_export.connect(
+            lambda count: self.on_export_finished(count, file_path))
+        self.export_thread.failed.connect(self.on_export_failed)
+        self.export_progress.canceled.connect(self.export_thread.cancel)
+        self.export_btn.setEnabled(False)
+        self.export_thread.start()
+    
+    def on_export_progress(self, done, total):
+        """更新导出进度"""
+        if self.export_progress:
+            self.export_progress.setMaximum(total)
+            self.export_progress.setValue(done)
+    
+    def on_export_finished(self, count, file_path):
+        """导出完成或已取消"""
+        self._close_export_progress()
+        if count is None:
+            self.statusBar().showMessage('导出已取消')
+        else:
+            QMessageBox.information(self, '成功', f'已导出 {count} 条记录到: {file_path}')
+    
+    def on_export_failed(self, message):
+        """导出失败"""
+        self._close_export_progress()
+        QMessageBox.critical(self, '错误', f'导出CSV文件失败: {message}')
+    
+    def _close_export_progress(self):
+        self.export_btn.setEnabled(True)
+        if self.export_progress:
+            self.export_progress.canceled.disconnect()
+            self.export_progress.close()
+            self.export_progress = None
     
     def closeEvent(self, event):
         """关闭应用程序事件"""
@@ -391,16 +656,21 @@ class ServerGUI(QMainWindow):
             )
             if reply == QMessageBox.Yes:
                 self.stop_server()
+                self.history_model.shutdown()
+                self.thumbnail_worker.close()
                 event.accept()
             else:
                 event.ignore()
         else:
+            self.history_model.shutdown()
+            self.thumbnail_worker.close()
             event.accept()
 
 def main():
     app = QApplication(sys.argv)
     app.setStyle('Fusion')
-    window = ServerGUI()
+    # --attach: 查看模式，服务器由 daemon.py 在后台运行
+    window = ServerGUI(attach='--attach' in app.arguments()[1:])
     window.show()
     sys.exit(app.exec_())
 
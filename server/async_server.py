@@ -0,0 +1,338 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+import protocol
+from tcp_server import TCPServerModule, GALLERY_REQUEST_TYPES
+
+
+class AsyncTCPServerModule(TCPServerModule):
+    """
+    基于asyncio的TCP服务器模块
+
+    所有连接在同一个事件循环线程中处理，不再为每个连接创建线程；
+    回调和写盘等阻塞操作交给一个小线程池执行。
+    对外接口（start_server/stop_server/set_callbacks等）与TCPServerModule相同。
+    """
+
+    def __init__(self, host='192.168.137.96', port=8888, data_dir="received_data",
+                 backlog=1024, worker_count=4, max_file_size=32 * 1024 * 1024,
+                 connection_buffer_size=256 * 1024, max_frame_size=8 * 1024 * 1024):
+        """
+        初始化asyncio TCP服务器模块
+
+        Args:
+            host: 服务器IP地址
+            port: 服务器端口
+            data_dir: 数据存储目录
+            backlog: 监听队列长度
+            worker_count: 处理回调与写盘的线程数
+            max_file_size: 旧协议FILE允许的最大文件大小
+            connection_buffer_size: 每个连接的读缓冲区上限，FILE数据按此大小分块写入临时文件
+            max_frame_size: 二进制帧允许的最大负载
+        """
+        super().__init__(host, port, data_dir, max_file_size, connection_buffer_size, max_frame_size)
+        self.backlog = backlog
+        self.worker_count = worker_count
+        self.loop = None
+        self.server = None
+        self.executor = None
+        self.start_error = None
+
+    def start_server(self):
+        """
+        启动TCP服务器
+
+        Returns:
+            bool: 启动成功返回True，失败返回False
+        """
+        if self.running:
+            print("服务器已经在运行中")
+            return True
+
+        self.writer.start()
+        self.executor = ThreadPoolExecutor(max_workers=self.worker_count,
+                                           thread_name_prefix="ingest")
+        started = threading.Event()
+        self.start_error = None
+
+        self.server_thread = threading.Thread(target=self._run_loop, args=(started,))
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        started.wait()
+
+        if self.start_error:
+            print(f"启动服务器失败: {self.start_error}")
+            self.executor.shutdown(wait=False)
+            self.writer.stop()
+            return False
+
+        print(f"TCP服务器(asyncio)已启动在 {self.host}:{self.port}")
+        return True
+
+    def _run_loop(self, started):
+        """事件循环线程"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(asyncio.start_server(
+                self._handle_connection, self.host, self.port,
+                backlog=self.backlog, reuse_address=True, limit=self.connection_buffer_size))
+            self.socket = self.server.sockets[0]
+            self.running = True
+            self.accepting = True
+        except Exception as e:
+            self.start_error = e
+            started.set()
+            self.loop.close()
+            return
+
+        started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    async def _handle_connection(self, reader, writer):
+        """处理一个客户端连接"""
+        client_address = writer.get_extra_info('peername')[:2]
+        client = {'socket': writer, 'address': client_address, 'thread': None}
+        self.clients.append(client)
+        self.connections_total.inc()
+
+        if self.on_client_connected:
+            await self._run_blocking(self.on_client_connected, client_address)
+
+        # 帧协议连接状态: 会话标识、待发送的累计确认，以及该连接上是否有消息持久化失败
+        conn_state = {'session_id': None, 'ack_id': None, 'pending': [], 'failed': False}
+        try:
+            while self.running:
+                # 接收数据类型标识
+                data_type = await reader.readexactly(4)
+
+                # 二进制帧协议
+                if data_type == protocol.MAGIC:
+                    if not await self._receive_frame_async(reader, writer, client_address, conn_state):
+                        break
+                    continue
+
+                # 旧协议: ASCII类型标识
+                data_type = data_type.decode('utf-8').strip()
+
+                if data_type == 'TEXT':
+                    data_length = self._parse_text_length(await reader.readexactly(8), client_address)
+                    if data_length is None:
+                        break
+                    text_data = (await reader.readexactly(data_length)).decode('utf-8')
+                    received_at = time.perf_counter()
+                    result = await self._run_blocking(self._process_text, text_data, client_address)
+                    status = await self._wait_status_async(result)
+                    if status == protocol.STATUS_OK:
+                        writer.write("TEXT_RECEIVED".encode('utf-8'))
+                    else:
+                        writer.write("TEXT_ERROR".encode('utf-8'))
+                    self._observe_ack(client_address, 'legacy', status, received_at)
+
+                elif data_type == 'FILE':
+                    if not await self._receive_file_async(reader, writer, client_address):
+                        break
+
+                elif data_type == 'EXIT':
+                    print(f"客户端 {client_address} 断开连接")
+                    break
+
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # 客户端未发送EXIT直接断开（如连接状态检测）
+            pass
+        except protocol.ProtocolError as e:
+            print(f"客户端 {client_address} 帧格式错误: {e}")
+            self.client_errors.inc(client_address[0], 'protocol')
+        except Exception as e:
+            print(f"处理客户端 {client_address} 时出错: {e}")
+            self.client_errors.inc(client_address[0], 'exception')
+        finally:
+            if client in self.clients:
+                self.clients.remove(client)
+            writer.close()
+
+            if self.on_client_disconnected:
+                await self._run_blocking(self.on_client_disconnected, client_address)
+
+    async def _receive_file_async(self, reader, writer, client_address):
+        """
+        接收旧协议文件: 分块写入临时文件（写文件在线程池中进行），完成后原子重命名
+
+        Returns:
+            bool: 连接应继续返回True，需要断开返回False
+        """
+        file_info = self._check_file_info(await reader.readexactly(256), client_address)
+        if file_info is None:
+            writer.write("FILE_ERROR".encode('utf-8'))
+            await writer.drain()
+            return False
+        filename, filesize = file_info
+        print(f"开始接收文件: {filename}, 大小: {filesize} 字节")
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        temp_file, temp_path = await self._run_blocking(self._open_incoming, timestamp)
+        try:
+            remaining = filesize
+            while remaining:
+                chunk = await reader.read(min(remaining, self.connection_buffer_size))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b'', remaining)
+                await self._run_blocking(temp_file.write, chunk)
+                remaining -= len(chunk)
+            filepath = await self._run_blocking(
+                self._commit_incoming, temp_file, temp_path, filename, client_address)
+        except BaseException:
+            await self._run_blocking(self._discard_incoming, temp_file, temp_path)
+            raise
+        received_at = time.perf_counter()
+
+        result = await self._run_blocking(
+            self._process_file, filename, filepath, filesize, client_address, timestamp)
+        status = await self._wait_status_async(result)
+        if status == protocol.STATUS_OK:
+            writer.write("FILE_RECEIVED".encode('utf-8'))
+        else:
+            writer.write("FILE_ERROR".encode('utf-8'))
+        self._observe_ack(client_address, 'legacy', status, received_at)
+        return True
+
+    async def _receive_frame_async(self, reader, writer, client_address, conn_state):
+        """
+        接收并处理一个二进制帧（帧头标识已读取）
+
+        与线程版相同，读缓冲区中还有后续数据时只分发不等待，
+        缓冲区读空时再等待这些消息写入WAL并回复一个累计确认，失败的消息立即确认。
+
+        Returns:
+            bool: 连接应继续返回True，需要断开返回False
+        """
+        header = await reader.readexactly(protocol.HEADER.size - len(protocol.MAGIC))
+        _, msg_type, _, msg_id, payload_len = protocol.unpack_header(protocol.MAGIC + header)
+        if payload_len > self.max_frame_size:
+            await self._send_pending_ack_async(writer, conn_state, client_address)
+            writer.write(self._oversize_frame(msg_type, msg_id, payload_len, client_address))
+            await writer.drain()
+            return False
+        payload = await reader.readexactly(payload_len) if payload_len else b''
+        received_at = time.perf_counter()
+
+        if msg_type == protocol.MSG_RECOGNIZE:
+            # 识别请求不参与累计确认: 先发出已有的确认；识别在进程池中进行，不占用事件循环
+            await self._send_pending_ack_async(writer, conn_state, client_address)
+            result = self._recognize_frame(payload, client_address)
+            if isinstance(result, Future):
+                try:
+                    await asyncio.wrap_future(result)
+                except Exception:
+                    pass
+            writer.write(self._result_frame(msg_id, result, received_at))
+            await writer.drain()
+            return True
+
+        if msg_type in GALLERY_REQUEST_TYPES:
+            await self._send_pending_ack_async(writer, conn_state, client_address)
+            writer.write(await self._run_blocking(
+                self._gallery_frame, msg_type, msg_id, payload, client_address))
+            await writer.drain()
+            return True
+
+        ack_id, status, immediate = await self._run_blocking(
+            self._dispatch_frame, msg_type, msg_id, payload, client_address, conn_state)
+        if ack_id is None:
+            await self._send_pending_ack_async(writer, conn_state, client_address)
+            return False
+
+        # status可能是写入器返回的Future，发送确认前再等待其完成
+        conn_state['ack_id'] = ack_id
+        conn_state['pending'].append((msg_id, status, received_at))
+        if immediate or not self._has_buffered_data(reader):
+            await self._send_pending_ack_async(writer, conn_state, client_address)
+        return True
+
+    def _has_buffered_data(self, reader):
+        """StreamReader的读缓冲区中是否还有未处理的数据（StreamReader没有公开的接口）"""
+        return bool(reader._buffer)
+
+    async def _send_pending_ack_async(self, writer, conn_state, client_address):
+        """等待已分发消息写入WAL后发送累计确认"""
+        if conn_state['ack_id'] is None:
+            return
+        status = protocol.STATUS_OK
+        results = []
+        for msg_id, result, received_at in conn_state['pending']:
+            result_status = await self._wait_status_async(result)
+            self._record_delivery(conn_state, msg_id, result_status)
+            results.append((result_status, received_at))
+            if result_status != protocol.STATUS_OK:
+                status = result_status
+        ack = protocol.pack_frame(protocol.MSG_ACK, conn_state['ack_id'], protocol.encode_ack(status))
+        conn_state['ack_id'] = None
+        conn_state['pending'] = []
+        writer.write(ack)
+        await writer.drain()
+        for result_status, received_at in results:
+            self._observe_ack(client_address, 'frame', result_status, received_at)
+
+    async def _wait_status_async(self, result):
+        """等待写入器完成WAL写入，不占用线程池线程"""
+        if isinstance(result, Future):
+            try:
+                await asyncio.wrap_future(result)
+            except Exception:
+                pass
+        return self._wait_status(result)
+
+    async def _run_blocking(self, func, *args):
+        """在线程池中执行回调、写盘等阻塞操作"""
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    def stop_accepting(self):
+        """停止接受新连接，已建立的连接继续处理（用于停止前排空）"""
+        if not self.accepting:
+            return
+        self.accepting = False
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.server.close)
+
+    def stop_server(self):
+        """停止服务器"""
+        if not self.running:
+            return
+        self.running = False
+        self.accepting = False
+
+        if self.loop and self.loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+            try:
+                future.result(timeout=5)
+            except Exception as e:
+                print(f"关闭服务器时出错: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+        if self.server_thread:
+            self.server_thread.join(timeout=5)
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        self.writer.stop()
+        self.stop_metrics()
+        self.stop_recognition()
+
+        self.socket = None
+        self.clients.clear()
+        print("TCP服务器已停止")
+
+    async def _shutdown(self):
+        """关闭监听socket和所有客户端连接"""
+        self.server.close()
+        for client in list(self.clients):
+            client['socket'].close()
+        await self.server.wait_closed()
\ No newline at end of file
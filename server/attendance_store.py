@@ -0,0 +1,486 @@
+# attendance_store.py
+import os
+import sqlite3
+import threading
+
+
+def parse_minutes(time_str):
+    """
+    将打卡时间 "HH:MM" 或 "HH:MM:SS" 转换为当天的分钟数
+
+    Returns:
+        int: 分钟数，格式无效返回None
+    """
+    try:
+        parts = time_str.split(':')
+        hour, minute = int(parts[0]), int(parts[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+    if 0 <= hour < 24 and 0 <= minute < 60:
+        return hour * 60 + minute
+    return None
+
+
+def classify(check_minutes, deadline_minutes):
+    """按截止时间判断考勤状态，只比较到分钟"""
+    if check_minutes is None:
+        return "错误"
+    return "迟到" if check_minutes > deadline_minutes else "正常"
+
+
+class AttendanceStore:
+    """
+    考勤记录存储（SQLite，WAL模式）
+
+    每条考勤记录是records表中的一行，按接收时间、日期、姓名、客户端和考勤状态建立索引，
+    历史记录、详情和导出都通过索引查询完成，不再扫描和解析文本文件。
+    source列唯一标识记录来源（客户端会话与消息编号、WAL序号或旧文本文件中的行），
+    重复写入会被忽略，因此WAL重放、客户端重发和旧数据导入都可以安全地重复执行。
+
+    打卡时间另存为整数分钟(check_minutes)。每人每天以最早一次打卡判断是否迟到，
+    结果保存在daily_person中，并在写入记录时增量维护按天(daily_summary)和
+    按人(person_summary)的正常/迟到计数；缺勤数由出现过的人员数推算。
+    修改截止时间时用几条集合化的UPDATE/INSERT...SELECT重新分类，不逐条处理。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL UNIQUE,
+            received_at TEXT NOT NULL,
+            date TEXT,
+            time TEXT,
+            name TEXT,
+            client_ip TEXT,
+            client_port INTEGER,
+            raw_text TEXT,
+            status TEXT,
+            photo_path TEXT,
+            check_minutes INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_records_received ON records(received_at, id);
+        CREATE INDEX IF NOT EXISTS idx_records_date_name ON records(date, name);
+        CREATE INDEX IF NOT EXISTS idx_records_name ON records(name);
+        CREATE INDEX IF NOT EXISTS idx_records_client ON records(client_ip, client_port);
+        CREATE INDEX IF NOT EXISTS idx_records_status ON records(status);
+        CREATE INDEX IF NOT EXISTS idx_records_photo ON records(photo_path);
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS daily_person (
+            date TEXT NOT NULL,
+            name TEXT NOT NULL,
+            first_minutes INTEGER NOT NULL,
+            late INTEGER NOT NULL,
+            record_count INTEGER NOT NULL,
+            PRIMARY KEY (date, name)
+        );
+        CREATE INDEX IF NOT EXISTS idx_daily_person_name ON daily_person(name);
+        CREATE TABLE IF NOT EXISTS daily_summary (
+            date TEXT PRIMARY KEY,
+            on_time INTEGER NOT NULL,
+            late INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS person_summary (
+            name TEXT PRIMARY KEY,
+            on_time INTEGER NOT NULL,
+            late INTEGER NOT NULL
+        );
+    """
+
+    SCHEMA_VERSION = 2
+
+    STATUS_SQL = """
+        CASE WHEN check_minutes IS NULL THEN '错误'
+             WHEN check_minutes > ? THEN '迟到' ELSE '正常' END
+    """
+
+    DEFAULT_DEADLINE = "09:00"
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        # 写盘线程与界面线程各自持有一个实例；同一实例内的访问由锁串行化
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # 接收端的WAL检查点在写入数据库后推进，数据库提交必须真正落盘
+        self.conn.execute("PRAGMA synchronous=FULL")
+        with self.conn:
+            self.conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """升级旧版本数据库: 补充整数分钟列并从已有记录建立汇总表"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        with self.conn:
+            columns = [row['name'] for row in self.conn.execute("PRAGMA table_info(records)")]
+            if 'check_minutes' not in columns:
+                self.conn.execute("ALTER TABLE records ADD COLUMN check_minutes INTEGER")
+            self.conn.execute(
+                "UPDATE records SET check_minutes = "
+                "CAST(substr(time, 1, 2) AS INTEGER) * 60 + CAST(substr(time, 4, 2) AS INTEGER) "
+                "WHERE check_minutes IS NULL AND time GLOB '[0-2][0-9]:[0-5][0-9]*' "
+                "AND substr(time, 1, 2) < '24'")
+            self.conn.execute("DELETE FROM daily_person")
+            self.conn.execute(
+                "INSERT INTO daily_person (date, name, first_minutes, late, record_count) "
+                "SELECT date, name, min(check_minutes), 0, count(*) FROM records "
+                "WHERE check_minutes IS NOT NULL AND date IS NOT NULL AND name IS NOT NULL "
+                "GROUP BY date, name")
+            self._reclassify(self._get_deadline_minutes())
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def add_records(self, records):
+        """
+        在一个事务中批量写入考勤记录，并增量更新汇总计数
+
+        Args:
+            records: 字典列表，键为 source, received_at, date, time, name,
+                     client_ip, client_port, raw_text, photo_path
+
+        Returns:
+            int: 实际新增的记录数（已存在的source被忽略）
+        """
+        if not records:
+            return 0
+        added = 0
+        with self.lock, self.conn:
+            deadline_minutes = self._get_deadline_minutes()
+            for r in records:
+                check_minutes = parse_minutes(r.get('time'))
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO records (source, received_at, date, time, name, "
+                    "client_ip, client_port, raw_text, photo_path, check_minutes, status) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (r['source'], r['received_at'], r.get('date'), r.get('time'), r.get('name'),
+                     r.get('client_ip'), r.get('client_port'), r.get('raw_text'), r.get('photo_path'),
+                     check_minutes, classify(check_minutes, deadline_minutes)))
+                if not cursor.rowcount:
+                    continue
+                added += 1
+                if check_minutes is not None and r.get('date') and r.get('name'):
+                    self._update_aggregates(r['date'], r['name'], check_minutes, deadline_minutes)
+        return added
+
+    def _update_aggregates(self, date, name, check_minutes, deadline_minutes):
+        """新增一条有效记录后更新该人当天的最早打卡时间及按天、按人的计数"""
+        late = 1 if check_minutes > deadline_minutes else 0
+        row = self.conn.execute(
+            "SELECT first_minutes, late FROM daily_person WHERE date = ? AND name = ?",
+            (date, name)).fetchone()
+
+        if row is None:
+            self.conn.execute(
+                "INSERT INTO daily_person (date, name, first_minutes, late, record_count) "
+                "VALUES (?, ?, ?, ?, 1)", (date, name, check_minutes, late))
+            self._add_counts(date, name, 1 - late, late)
+        elif check_minutes < row['first_minutes']:
+            # 更早的打卡改变了当天的考勤结果
+            self.conn.execute(
+                "UPDATE daily_person SET first_minutes = ?, late = ?, record_count = record_count + 1 "
+                "WHERE date = ? AND name = ?", (check_minutes, late, date, name))
+            if late != row['late']:
+                self._add_counts(date, name, row['late'] - late, late - row['late'])
+        else:
+            self.conn.execute(
+                "UPDATE daily_person SET record_count = record_count + 1 WHERE date = ? AND name = ?",
+                (date, name))
+
+    def _add_counts(self, date, name, on_time_delta, late_delta):
+        self.conn.execute(
+            "INSERT INTO daily_summary (date, on_time, late) VALUES (?, ?, ?) "
+            "ON CONFLICT(date) DO UPDATE SET on_time = on_time + excluded.on_time, "
+            "late = late + excluded.late", (date, on_time_delta, late_delta))
+        self.conn.execute(
+            "INSERT INTO person_summary (name, on_time, late) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET on_time = on_time + excluded.on_time, "
+            "late = late + excluded.late", (name, on_time_delta, late_delta))
+
+    def attach_photo(self, client_ip, client_port, photo_path):
+        """
+        将照片关联到该客户端最近一条没有照片的记录（旧协议文本与照片分开发送）
+
+        照片路径已关联过时不再处理，从WAL重放时不会把同一张照片关联到另一条记录。
+
+        Returns:
+            dict: 关联了照片的记录，没有可关联的记录或已关联过返回None
+        """
+        with self.lock, self.conn:
+            if self.conn.execute("SELECT 1 FROM records WHERE photo_path = ?", (photo_path,)).fetchone():
+                return None
+            row = self.conn.execute(
+                "SELECT max(id) FROM records WHERE client_ip = ? AND client_port = ? "
+                "AND photo_path IS NULL", (client_ip, client_port)).fetchone()
+            if row[0] is None:
+                return None
+            self.conn.execute("UPDATE records SET photo_path = ? WHERE id = ?", (photo_path, row[0]))
+            return dict(self.conn.execute("SELECT * FROM records WHERE id = ?", (row[0],)).fetchone())
+
+    def count(self):
+        """记录总数"""
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM records").fetchone()[0]
+
+    def query_records(self, offset=0, limit=None, newest_first=True):
+        """
+        按接收时间顺序查询记录
+
+        Args:
+            offset: 跳过的记录数
+            limit: 最多返回的记录数，None表示全部
+            newest_first: 是否最新的在前
+
+        Returns:
+            list: 记录字典列表
+        """
+        order = "DESC" if newest_first else "ASC"
+        with self.lock:
+            cursor = self.conn.execute(
+                f"SELECT * FROM records ORDER BY received_at {order}, id {order} LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset))
+            return [dict(row) for row in cursor]
+
+    def query_page(self, before=None, limit=200):
+        """
+        按接收时间从新到旧分页查询（键集分页，翻页代价与页码无关）
+
+        Args:
+            before: 上一页最后一条记录的 (received_at, id)，None表示第一页
+            limit: 每页记录数
+
+        Returns:
+            list: 记录字典列表
+        """
+        with self.lock:
+            if before is None:
+                cursor = self.conn.execute(
+                    "SELECT * FROM records ORDER BY received_at DESC, id DESC LIMIT ?", (limit,))
+            else:
+                cursor = self.conn.execute(
+                    "SELECT * FROM records WHERE (received_at, id) < (?, ?) "
+                    "ORDER BY received_at DESC, id DESC LIMIT ?", (before[0], before[1], limit))
+            return [dict(row) for row in cursor]
+
+    def _filter_clause(self, date_from=None, date_to=None, name=None, status=None):
+        """构造筛选条件，日期为 YYYY-MM-DD 字符串（含两端）"""
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date <= ?")
+            params.append(date_to)
+        if name:
+            conditions.append("name = ?")
+            params.append(name)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        # 无法解析的记录没有日期和姓名，不参与筛选结果
+        conditions.append("name IS NOT NULL")
+        return " WHERE " + " AND ".join(conditions), params
+
+    def count_filtered(self, date_from=None, date_to=None, name=None, status=None):
+        """符合筛选条件的记录数"""
+        where, params = self._filter_clause(date_from, date_to, name, status)
+        with self.lock:
+            return self.conn.execute(f"SELECT count(*) FROM records{where}", params).fetchone()[0]
+
+    def iter_filtered(self, date_from=None, date_to=None, name=None, status=None, batch_size=1000):
+        """
+        按日期、时间顺序流式读取符合条件的记录
+
+        使用单独的只读连接逐批读取（WAL模式下不阻塞写入），
+        不会把全部结果加载到内存，也不占用本实例的锁。
+
+        Yields:
+            sqlite3.Row: 记录行
+        """
+        where, params = self._filter_clause(date_from, date_to, name, status)
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            cursor = conn.execute(
+                f"SELECT date, time, name, status, client_ip, client_port FROM records{where} "
+                "ORDER BY date, time, id", params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def get_record(self, record_id):
+        """按id查询一条记录，不存在返回None"""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM records WHERE id = ?", (record_id,)).fetchone()
+        return dict(row) if row else None
+
+    def max_record_id(self):
+        """当前最大的记录id，没有记录返回0"""
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM records").fetchone()[0]
+
+    def records_after(self, last_id, limit=500):
+        """
+        id大于last_id的记录（按id递增），用于跟踪其他进程新写入的记录
+
+        Returns:
+            list: 记录字典列表
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT * FROM records WHERE id > ? ORDER BY id LIMIT ?", (last_id, limit))
+            return [dict(row) for row in cursor]
+
+    def existing_sources(self, sources):
+        """
+        查询已入库的source
+
+        Returns:
+            set: sources中已存在的部分
+        """
+        found = set()
+        with self.lock:
+            # 分段查询，避免超过SQLite的参数个数上限
+            for start in range(0, len(sources), 500):
+                chunk = sources[start:start + 500]
+                cursor = self.conn.execute(
+                    f"SELECT source FROM records WHERE source IN ({','.join('?' * len(chunk))})", chunk)
+                found.update(row[0] for row in cursor)
+        return found
+
+    def legacy_records_without_photo(self):
+        """旧文本导入的、尚未确定照片的记录 [(id, source), ...]"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT id, source FROM records WHERE source LIKE 'legacy:%' AND photo_path IS NULL").fetchall()
+
+    def set_photo_paths(self, updates):
+        """批量写入照片路径 [(photo_path, id), ...]"""
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE records SET photo_path = ? WHERE id = ?", updates)
+
+    def get_setting(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    def set_deadline(self, hour, minute, date_from=None, date_to=None):
+        """
+        保存考勤截止时间，并重新判断指定日期范围（默认全部）的考勤状态
+
+        Args:
+            hour: 截止时间的小时
+            minute: 截止时间的分钟
+            date_from: 重新分类的起始日期 YYYY-MM-DD（含），None表示不限
+            date_to: 重新分类的结束日期 YYYY-MM-DD（含），None表示不限
+        """
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('deadline', ?)",
+                              (f"{hour:02d}:{minute:02d}",))
+            self._reclassify(hour * 60 + minute, date_from, date_to)
+
+    def _reclassify(self, deadline_minutes, date_from=None, date_to=None):
+        """按整数分钟集合化地重新分类记录，并由daily_person重建汇总计数"""
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date <= ?")
+            params.append(date_to)
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+
+        self.conn.execute(f"UPDATE records SET status = {self.STATUS_SQL}{where}",
+                          [deadline_minutes] + params)
+        self.conn.execute(f"UPDATE daily_person SET late = (first_minutes > ?){where}",
+                          [deadline_minutes] + params)
+        self.conn.execute(f"DELETE FROM daily_summary{where}", params)
+        self.conn.execute(
+            f"INSERT INTO daily_summary (date, on_time, late) "
+            f"SELECT date, sum(1 - late), sum(late) FROM daily_person{where} GROUP BY date", params)
+        self.conn.execute("DELETE FROM person_summary")
+        self.conn.execute(
+            "INSERT INTO person_summary (name, on_time, late) "
+            "SELECT name, sum(1 - late), sum(late) FROM daily_person GROUP BY name")
+
+    def _get_deadline_minutes(self):
+        row = self.conn.execute("SELECT value FROM settings WHERE key = 'deadline'").fetchone()
+        return parse_minutes(row[0] if row else self.DEFAULT_DEADLINE)
+
+    def day_summaries(self, date_from=None, date_to=None):
+        """
+        按天的考勤汇总（按日期排序）
+
+        Returns:
+            list: [{'date', 'on_time', 'late', 'absent'}, ...]，缺勤数 = 出现过的人数 - 当天出勤人数
+        """
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date <= ?")
+            params.append(date_to)
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+        with self.lock:
+            roster_size = self.conn.execute("SELECT count(*) FROM person_summary").fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT date, on_time, late FROM daily_summary{where} ORDER BY date", params).fetchall()
+        return [{'date': row['date'], 'on_time': row['on_time'], 'late': row['late'],
+                 'absent': roster_size - row['on_time'] - row['late']} for row in rows]
+
+    def person_summaries(self):
+        """
+        按人的考勤汇总（按姓名排序）
+
+        Returns:
+            list: [{'name', 'on_time', 'late', 'absent'}, ...]，缺勤天数 = 有考勤的天数 - 出勤天数
+        """
+        with self.lock:
+            total_days = self.conn.execute("SELECT count(*) FROM daily_summary").fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT name, on_time, late FROM person_summary ORDER BY name").fetchall()
+        return [{'name': row['name'], 'on_time': row['on_time'], 'late': row['late'],
+                 'absent': total_days - row['on_time'] - row['late']} for row in rows]
+
+    def daily_report(self, date):
+        """
+        某天的考勤明细
+
+        Returns:
+            dict: {'date', 'present': [(姓名, 最早打卡分钟数, 是否迟到), ...], 'absent': [姓名, ...]}
+        """
+        with self.lock:
+            present = [(row['name'], row['first_minutes'], bool(row['late'])) for row in self.conn.execute(
+                "SELECT name, first_minutes, late FROM daily_person WHERE date = ? "
+                "ORDER BY first_minutes, name", (date,))]
+            absent = [row['name'] for row in self.conn.execute(
+                "SELECT name FROM person_summary WHERE name NOT IN "
+                "(SELECT name FROM daily_person WHERE date = ?) ORDER BY name", (date,))]
+        return {'date': date, 'present': present, 'absent': absent}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
\ No newline at end of file
@@ -0,0 +1,119 @@
+# bench_ingest.py
+# 服务器接收吞吐量测试：向本地TCPServerModule发送不同大小的FILE负载，统计MB/s
+#
+# 用法: python bench_ingest.py [--sizes 4K,64K,1M,8M,32M] [--total-mb 64] [--baseline]
+#   服务器把FILE数据分块写入临时文件后重命名，测得的是包含写盘在内的接收吞吐量
+#   --baseline  额外测量原先 received_data += chunk 的接收方式作为对比
+import os
+import sys
+import time
+import shutil
+import socket
+import contextlib
+import argparse
+import tempfile
+import threading
+
+import tcp_server
+
+
+def parse_size(text):
+    units = {'K': 1024, 'M': 1024 * 1024}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def send_files(host, port, payload, count):
+    """按旧协议连续发送count个文件，返回耗时"""
+    sock = socket.create_connection((host, port))
+    # 帧头与负载分两次发送，关闭Nagle避免与延迟确认叠加产生40ms停顿
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    header = f"bench.jpg|{len(payload)}".encode('utf-8').ljust(256)
+    start = time.perf_counter()
+    for _ in range(count):
+        sock.sendall(b"FILE" + header)
+        sock.sendall(payload)
+        if sock.recv(1024) != b"FILE_RECEIVED":
+            raise RuntimeError("服务器确认错误")
+    elapsed = time.perf_counter() - start
+    sock.sendall(b"EXIT")
+    sock.close()
+    return elapsed
+
+
+def start_baseline_server():
+    """原实现的接收循环: 4KB分块recv并用 += 拼接"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def recv_exact(conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def serve():
+        while True:
+            conn, _ = listener.accept()
+            with conn:
+                while True:
+                    data_type = recv_exact(conn, 4)
+                    if not data_type or data_type == b'EXIT':
+                        break
+                    filesize = int(recv_exact(conn, 256).decode('utf-8').strip().split('|')[1])
+                    received_data = b''
+                    while len(received_data) < filesize:
+                        chunk = conn.recv(min(4096, filesize - len(received_data)))
+                        if not chunk:
+                            break
+                        received_data += chunk
+                    conn.send(b"FILE_RECEIVED")
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务器接收吞吐量测试")
+    parser.add_argument('--sizes', default='4K,64K,1M,8M,32M', help="负载大小列表")
+    parser.add_argument('--total-mb', type=float, default=64, help="每种大小发送的总数据量(MB)")
+    parser.add_argument('--baseline', action='store_true', help="对比原先的拼接接收方式")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='bench_ingest_')
+    server = tcp_server.TCPServerModule('127.0.0.1', 0, data_dir)
+    server.set_callbacks()
+    if not server.start_server():
+        return 1
+    host, port = server.socket.getsockname()
+
+    targets = [('stream', (host, port))]
+    if args.baseline:
+        targets.append(('baseline', start_baseline_server()))
+
+    print(f"{'大小':>8} {'次数':>6} " + " ".join(f"{name + ' MB/s':>16}" for name, _ in targets))
+    for size_text in args.sizes.split(','):
+        size = parse_size(size_text)
+        count = max(1, int(args.total_mb * 1024 * 1024 // size))
+        payload = b'\xff' * size
+        results = []
+        for _, (target_host, target_port) in targets:
+            # 屏蔽服务器每个文件的接收/保存日志
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                elapsed = send_files(target_host, target_port, payload, count)
+            results.append(size * count / (1024 * 1024) / elapsed)
+        print(f"{size_text:>8} {count:>6} " + " ".join(f"{r:16.1f}" for r in results))
+
+    server.stop_server()
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
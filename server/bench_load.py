@@ -0,0 +1,396 @@
+# bench_load.py
+# 服务器负载测试：模拟N个考勤板同时打卡，统计吞吐量、确认延迟分位数、错误率，
+# 以及服务器进程的内存和线程增长，结果保存为JSON便于不同版本之间对比
+#
+# 用法: python bench_load.py [--clients 50] [--rate 2] [--duration 30] [--photo-size 64K]
+#                            [--protocol legacy|frame] [--engine asyncio|threaded]
+#                            [--output bench_results/load.json]
+#   --rate 0       每个客户端收到确认后立即发送下一条（测最大吞吐）
+#   --photo-size 0 只发送文本
+#
+# 服务器在子进程中运行，内存和线程数只统计服务器本身（Linux读取/proc，其他平台读取指标服务）
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime
+
+import protocol
+
+
+def parse_size(text):
+    units = {'K': 1024, 'M': 1024 * 1024}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def percentile(sorted_values, fraction):
+    """最近秩法分位数，sorted_values需已排序"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_server(engine, data_dir):
+    """子进程: 启动服务器和指标服务，输出端口后等待父进程关闭stdin"""
+    import tcp_server
+    import async_server
+
+    ready_output = sys.stdout
+    # 屏蔽服务器每条记录的接收/保存日志
+    sys.stdout = open(os.devnull, 'w')
+    if engine == "asyncio":
+        server = async_server.AsyncTCPServerModule('127.0.0.1', 0, data_dir)
+    else:
+        server = tcp_server.TCPServerModule('127.0.0.1', 0, data_dir)
+    server.set_callbacks()
+    if not server.start_server():
+        return 1
+    server.start_metrics(0)
+    port = server.socket.getsockname()[1]
+    ready_output.write(f"READY {port} {server.metrics_server.port}\n")
+    ready_output.flush()
+
+    sys.stdin.read()
+    server.stop_server()
+    server.store.close()
+    return 0
+
+
+class ServerProcess:
+    """以子进程运行的被测服务器"""
+
+    def __init__(self, engine, data_dir):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', '--engine', engine, '--data-dir', data_dir],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        line = self.process.stdout.readline().split()
+        if not line or line[0] != 'READY':
+            self.process.kill()
+            raise RuntimeError("服务器子进程启动失败")
+        self.port = int(line[1])
+        self.metrics_port = int(line[2])
+
+    def metrics(self):
+        """读取服务器指标，返回 {指标名(含标签): 值}"""
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{self.metrics_port}/metrics", timeout=2) as response:
+                body = response.read().decode('utf-8')
+        except OSError:
+            return {}
+        values = {}
+        for line in body.splitlines():
+            if line and not line.startswith('#'):
+                name, _, value = line.rpartition(' ')
+                values[name] = float(value)
+        return values
+
+    def usage(self):
+        """
+        服务器进程的内存和线程数
+
+        Returns:
+            dict: {'rss_kb', 'threads'}，无法获取的项为None
+        """
+        usage = {'rss_kb': None, 'threads': None}
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        usage['rss_kb'] = int(line.split()[1])
+                    elif line.startswith('Threads:'):
+                        usage['threads'] = int(line.split()[1])
+        except OSError:
+            threads = self.metrics().get('attendance_threads')
+            usage['threads'] = int(threads) if threads is not None else None
+        return usage
+
+    def stop(self):
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class UsageSampler:
+    """定期采样服务器进程的内存和线程数"""
+
+    def __init__(self, server, interval=0.2):
+        self.server = server
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self.samples.append(self.server.usage())
+        self.thread.start()
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.samples.append(self.server.usage())
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.samples.append(self.server.usage())
+
+    def summary(self):
+        def series(key):
+            values = [sample[key] for sample in self.samples if sample[key] is not None]
+            if not values:
+                return {'start': None, 'peak': None, 'end': None, 'growth': None}
+            return {'start': values[0], 'peak': max(values), 'end': values[-1],
+                    'growth': values[-1] - values[0]}
+        return {'rss_kb': series('rss_kb'), 'threads': series('threads')}
+
+
+class LoadClient:
+    """一个模拟考勤板: 按固定速率发送考勤记录（可附带照片），每条等待确认"""
+
+    def __init__(self, index, host, port, protocol_name, rate, photo_data):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.protocol_name = protocol_name
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.photo_data = photo_data
+        self.sock = None
+        self.msg_id = 0
+
+        # 结果
+        self.records = 0
+        self.messages = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.latencies = []
+        self.error_messages = []
+
+    def run(self, start_at, deadline, offset=0.0):
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=30)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            self.errors += 1
+            self.error_messages.append(f"连接失败: {e}")
+            return
+
+        # offset: 各客户端错开的发送时刻（秒）
+        next_send = start_at + offset
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                if next_send > now:
+                    time.sleep(min(next_send - now, deadline - now))
+                    continue
+                self._send_record()
+                next_send += self.interval
+            self._send_exit()
+        except OSError as e:
+            self.errors += 1
+            self.error_messages.append(f"连接中断: {e}")
+        finally:
+            self.sock.close()
+
+    def _send_record(self):
+        text = f"{datetime.now().strftime('%Y-%m-%d,%H:%M:%S')},board{self.index:03d}"
+        filename = f"board{self.index:03d}.jpg" if self.photo_data else None
+        if self.protocol_name == "frame":
+            self.msg_id += 1
+            frame = protocol.pack_frame(protocol.MSG_RECORD, self.msg_id,
+                                        protocol.encode_record(text, filename, self.photo_data))
+            self._request(frame, self._recv_frame_ack)
+        else:
+            text_data = text.encode('utf-8')
+            self._request(b"TEXT" + str(len(text_data)).ljust(8).encode('utf-8') + text_data,
+                          lambda: self._recv_legacy_ack(b"TEXT_RECEIVED"))
+            if self.photo_data:
+                header = f"{filename}|{len(self.photo_data)}".encode('utf-8').ljust(256)
+                self._request([b"FILE" + header, self.photo_data],
+                              lambda: self._recv_legacy_ack(b"FILE_RECEIVED"))
+        self.records += 1
+
+    def _request(self, data, recv_ack):
+        """发送一条消息并等待确认，记录确认延迟"""
+        parts = data if isinstance(data, list) else [data]
+        start = time.perf_counter()
+        for part in parts:
+            self.sock.sendall(part)
+        ok = recv_ack()
+        self.latencies.append(time.perf_counter() - start)
+        self.messages += 1
+        self.bytes_sent += sum(len(part) for part in parts)
+        if not ok:
+            self.errors += 1
+
+    def _recv_legacy_ack(self, expected):
+        response = self.sock.recv(64)
+        if not response:
+            raise ConnectionError("服务器关闭了连接")
+        return response == expected
+
+    def _recv_frame_ack(self):
+        header = protocol.recv_exact(self.sock, protocol.HEADER.size)
+        if header is None:
+            raise ConnectionError("服务器关闭了连接")
+        _, _, _, _, payload_len = protocol.unpack_header(header)
+        payload = protocol.recv_exact(self.sock, payload_len) if payload_len else b''
+        return protocol.decode_ack(payload) == protocol.STATUS_OK
+
+    def _send_exit(self):
+        if self.protocol_name == "frame":
+            self.sock.sendall(protocol.pack_frame(protocol.MSG_EXIT, 0))
+        else:
+            self.sock.sendall(b"EXIT")
+
+
+def run_load(args):
+    """执行一次负载测试，返回结果字典"""
+    photo_size = parse_size(args.photo_size)
+    photo_data = os.urandom(photo_size) if photo_size else None
+    data_dir = tempfile.mkdtemp(prefix='bench_load_')
+
+    server = ServerProcess(args.engine, data_dir)
+    sampler = UsageSampler(server)
+    sampler.start()
+    try:
+        clients = [LoadClient(i, '127.0.0.1', server.port, args.protocol, args.rate, photo_data)
+                   for i in range(args.clients)]
+        start_at = time.perf_counter()
+        deadline = start_at + args.duration
+        # 各客户端在第一个发送间隔内均匀错开，避免所有请求落在同一瞬间
+        interval = 1.0 / args.rate if args.rate > 0 else 0
+        threads = [threading.Thread(target=client.run,
+                                    args=(start_at, deadline, interval * client.index / args.clients),
+                                    daemon=True)
+                   for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start_at
+        server_metrics = server.metrics()
+    finally:
+        sampler.stop()
+        server.stop()
+        if not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    records = sum(client.records for client in clients)
+    messages = sum(client.messages for client in clients)
+    errors = sum(client.errors for client in clients)
+    bytes_sent = sum(client.bytes_sent for client in clients)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'benchmark': 'load',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'clients': args.clients,
+            'rate_per_client': args.rate,
+            'duration_s': args.duration,
+            'photo_size': photo_size,
+            'protocol': args.protocol,
+            'engine': args.engine,
+        },
+        'results': {
+            'elapsed_s': round(elapsed, 3),
+            'records': records,
+            'messages': messages,
+            'errors': errors,
+            'error_rate': round(errors / max(messages, 1), 6),
+            'records_per_s': round(records / elapsed, 2),
+            'messages_per_s': round(messages / elapsed, 2),
+            'mb_per_s': round(bytes_sent / (1024 * 1024) / elapsed, 3),
+            'ack_latency_ms': {
+                'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+                'p50': ms(percentile(latencies, 0.50)),
+                'p90': ms(percentile(latencies, 0.90)),
+                'p99': ms(percentile(latencies, 0.99)),
+                'max': ms(latencies[-1] if latencies else None),
+            },
+            'client_errors': [message for client in clients for message in client.error_messages][:20],
+        },
+        'server': dict(sampler.summary(), metrics={
+            name: value for name, value in server_metrics.items()
+            if not name.endswith('_bucket') and not name.startswith('attendance_ack_latency')}),
+    }
+
+
+def print_summary(result):
+    config = result['config']
+    results = result['results']
+    latency = results['ack_latency_ms']
+    server = result['server']
+    rate = f"每个 {config['rate_per_client']} 条/秒" if config['rate_per_client'] > 0 else "不限速"
+    print(f"{config['clients']} 个客户端, {rate}, "
+          f"照片 {config['photo_size']} 字节, 协议 {config['protocol']}, 服务器 {config['engine']}")
+    print(f"记录 {results['records']} 条, 消息 {results['messages']} 条, 耗时 {results['elapsed_s']} 秒")
+    print(f"吞吐量: {results['records_per_s']} 条/秒, {results['messages_per_s']} 消息/秒, {results['mb_per_s']} MB/s")
+    print(f"确认延迟(ms): 平均 {latency['mean']}  p50 {latency['p50']}  p90 {latency['p90']}  "
+          f"p99 {latency['p99']}  最大 {latency['max']}")
+    print(f"错误: {results['errors']} (错误率 {results['error_rate']:.4%})")
+    rss = server['rss_kb']
+    threads = server['threads']
+    if rss['start'] is not None:
+        print(f"服务器内存(KB): 开始 {rss['start']}  峰值 {rss['peak']}  结束 {rss['end']}  增长 {rss['growth']}")
+    if threads['start'] is not None:
+        print(f"服务器线程数: 开始 {threads['start']}  峰值 {threads['peak']}  结束 {threads['end']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务器负载测试")
+    parser.add_argument('--clients', type=int, default=50, help="并发客户端数")
+    parser.add_argument('--rate', type=float, default=1.0, help="每个客户端每秒发送的记录数，0表示不限速")
+    parser.add_argument('--duration', type=float, default=10, help="测试时长(秒)")
+    parser.add_argument('--photo-size', default='64K', help="每条记录附带的照片大小，0表示不带照片")
+    parser.add_argument('--protocol', choices=['legacy', 'frame'], default='legacy',
+                        help="legacy: TEXT/FILE旧协议; frame: 二进制帧协议")
+    parser.add_argument('--engine', choices=['asyncio', 'threaded'], default='asyncio', help="服务器实现")
+    parser.add_argument('--output', help="结果JSON路径，默认 bench_results/load_时间.json")
+    parser.add_argument('--keep-data', action='store_true', help="保留服务器数据目录")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return run_server(args.engine, args.data_dir)
+
+    result = run_load(args)
+    print_summary(result)
+
+    output = args.output or os.path.join(
+        "bench_results", f"load_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
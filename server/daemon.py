@@ -0,0 +1,240 @@
+# daemon.py
+# 无界面服务器守护进程：不导入PyQt，运行TCP服务器（WAL与数据库持久化）、指标服务和滚动日志
+#
+# 用法: python daemon.py [--host 0.0.0.0] [--port 8888] [--data-dir received_data]
+#                        [--engine asyncio|threaded] [--metrics-port 9108] [--metrics-snapshot 60]
+#                        [--log-file received_data/logs/server.log] [--console]
+#                        [--recognition-workers 2] [--gallery received_data/gallery.db]
+#
+# 信号:
+#   SIGTERM/SIGINT  停止接受新连接，等待已有连接空闲（最多 --drain-timeout 秒），
+#                   处理完写入队列后退出；排空期间再次收到则立即停止
+#   SIGHUP          立即滚动日志文件
+#
+# 界面可以作为查看器打开同一数据目录（不启动服务器，只跟踪新记录）: python main.py --attach
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import threading
+from logging.handlers import RotatingFileHandler
+
+import tcp_server
+import async_server
+
+
+class LogStream:
+    """
+    把print输出按行写入日志，替换sys.stdout/sys.stderr，使现有模块的日志进入滚动日志文件
+
+    一次print会分几次write（各参数、分隔符和换行），每个线程使用自己的行缓冲，
+    只有完整的行才写入日志，多个线程同时print时不会拼接出混杂的行。
+    """
+
+    def __init__(self, logger, level):
+        self.logger = logger
+        self.level = level
+        self.local = threading.local()
+
+    def write(self, text):
+        lines = (getattr(self.local, 'buffer', "") + text).split('\n')
+        self.local.buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.logger.log(self.level, line.rstrip())
+        return len(text)
+
+    def flush(self):
+        line = getattr(self.local, 'buffer', "")
+        self.local.buffer = ""
+        if line.strip():
+            self.logger.log(self.level, line.rstrip())
+
+    def isatty(self):
+        return False
+
+
+def setup_logging(log_file, max_bytes, backup_count, console=False):
+    """
+    配置滚动日志，并把标准输出和标准错误重定向到日志
+
+    Returns:
+        RotatingFileHandler: 日志文件处理器（SIGHUP时用于手动滚动）
+    """
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    logger = logging.getLogger("attendance")
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s")
+
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                       encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    if console:
+        console_handler = logging.StreamHandler(sys.__stderr__)
+        console_handler.setFormatter(formatter)
+        logger.addHandler(console_handler)
+
+    sys.stdout = LogStream(logger, logging.INFO)
+    sys.stderr = LogStream(logger, logging.ERROR)
+
+    def log_thread_exception(exc_args):
+        logger.error(f"线程 {exc_args.thread.name if exc_args.thread else '?'} 未处理的异常",
+                     exc_info=(exc_args.exc_type, exc_args.exc_value, exc_args.exc_traceback))
+    threading.excepthook = log_thread_exception
+    return file_handler
+
+
+class ServerDaemon:
+    """无界面服务器: 启动、等待信号、排空后停止"""
+
+    def __init__(self, args, log_handler=None):
+        self.args = args
+        self.log_handler = log_handler
+        self.stop_event = threading.Event()
+        self.draining = False
+        # 信号处理函数只设置以下标志，日志输出和滚动在主循环中进行
+        self.stop_signal = None
+        self.forced_stop = False
+        self.rotate_requested = False
+        if args.engine == "asyncio":
+            self.server = async_server.AsyncTCPServerModule(args.host, args.port, args.data_dir)
+        else:
+            self.server = tcp_server.TCPServerModule(args.host, args.port, args.data_dir)
+        self.server.set_callbacks(connect_callback=self.on_client_connected,
+                                  disconnect_callback=self.on_client_disconnected)
+
+    def on_client_connected(self, client_address):
+        print(f"客户端连接: {client_address[0]}:{client_address[1]}")
+
+    def on_client_disconnected(self, client_address):
+        print(f"客户端断开: {client_address[0]}:{client_address[1]}")
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._on_rotate_signal)
+
+    def _on_stop_signal(self, signum, frame):
+        # 信号处理函数可能打断主线程中正在进行的日志写入，这里不输出日志
+        if self.stop_event.is_set():
+            # 排空期间再次收到停止信号: 不再等待连接空闲
+            self.forced_stop = True
+            self.draining = False
+            return
+        self.stop_signal = signum
+        self.stop_event.set()
+
+    def _on_rotate_signal(self, signum, frame):
+        self.rotate_requested = True
+
+    def _rotate_log(self):
+        """在主循环中执行SIGHUP请求的日志滚动，持有处理器的锁，不会关闭其他线程正在写入的文件"""
+        if not self.rotate_requested:
+            return
+        self.rotate_requested = False
+        if self.log_handler:
+            self.log_handler.acquire()
+            try:
+                self.log_handler.doRollover()
+            finally:
+                self.log_handler.release()
+            print("日志文件已滚动")
+
+    def run(self):
+        """
+        运行直到收到停止信号
+
+        Returns:
+            int: 进程退出码
+        """
+        if not self.server.start_server():
+            return 1
+        if self.args.metrics_port is not None:
+            snapshot_path = None
+            if self.args.metrics_snapshot:
+                snapshot_path = os.path.join(self.args.data_dir, "metrics.prom")
+            self.server.start_metrics(self.args.metrics_port, snapshot_path=snapshot_path,
+                                      snapshot_interval=self.args.metrics_snapshot or 60)
+        if self.args.recognition_workers > 0:
+            self.server.enable_recognition(self.args.recognition_workers, self.args.gallery)
+
+        print(f"守护进程已启动 (pid {os.getpid()}, 数据目录 {os.path.abspath(self.args.data_dir)})")
+        # 带超时等待，信号处理函数可以在主线程中及时执行
+        while not self.stop_event.wait(1):
+            self._rotate_log()
+        print(f"收到信号 {signal.Signals(self.stop_signal).name}，开始停止")
+
+        self.drain()
+        self.server.stop_server()
+        self.server.store.close()
+        print("守护进程已退出")
+        return 0
+
+    def drain(self):
+        """
+        停止接受新连接后等待已有连接空闲
+
+        客户端的连接是长连接，因此以一段时间内不再收到数据作为空闲的判断；
+        未确认的消息客户端会在重连后重发，超时后直接停止也不会丢失已确认的记录。
+        """
+        self.server.stop_accepting()
+        self.draining = True
+        deadline = time.monotonic() + self.args.drain_timeout
+        last_bytes = self.server.bytes_received.value()
+        idle_since = time.monotonic()
+        while self.draining and self.server.get_connected_clients() and time.monotonic() < deadline:
+            time.sleep(0.2)
+            self._rotate_log()
+            received = self.server.bytes_received.value()
+            if received != last_bytes:
+                last_bytes = received
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= self.args.drain_idle:
+                break
+        if self.forced_stop:
+            print("再次收到停止信号，立即停止")
+        self.draining = False
+        print(f"排空完成，剩余连接 {self.server.get_connected_clients()} 个，写入队列 "
+              f"{self.server.writer.queue.qsize()} 条待处理")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="考勤服务器无界面守护进程")
+    parser.add_argument('--host', default='0.0.0.0', help="监听地址")
+    parser.add_argument('--port', type=int, default=8888, help="监听端口")
+    parser.add_argument('--data-dir', default="received_data", help="数据目录")
+    parser.add_argument('--engine', choices=['asyncio', 'threaded'], default='asyncio', help="服务器实现")
+    parser.add_argument('--metrics-port', type=int, default=9108, help="指标服务端口（仅本机访问）")
+    parser.add_argument('--no-metrics', action='store_true', help="不启动指标服务")
+    parser.add_argument('--metrics-snapshot', type=float, default=0,
+                        help="指标快照间隔(秒)，写入 数据目录/metrics.prom，0表示不写")
+    parser.add_argument('--log-file', help="日志文件，默认 数据目录/logs/server.log")
+    parser.add_argument('--log-max-mb', type=float, default=10, help="单个日志文件最大大小(MB)")
+    parser.add_argument('--log-backups', type=int, default=5, help="保留的旧日志文件数")
+    parser.add_argument('--console', action='store_true', help="同时输出日志到终端")
+    parser.add_argument('--drain-timeout', type=float, default=10, help="停止时等待连接空闲的最长时间(秒)")
+    parser.add_argument('--drain-idle', type=float, default=1, help="连接多久没有数据视为空闲(秒)")
+    parser.add_argument('--recognition-workers', type=int, default=0,
+                        help="服务器端识别进程数，0表示不启用（开发板本地识别）")
+    parser.add_argument('--gallery', help="服务器端识别使用的人脸库，默认 数据目录/gallery.db")
+    args = parser.parse_args()
+    if args.no_metrics:
+        args.metrics_port = None
+
+    log_file = args.log_file or os.path.join(args.data_dir, "logs", "server.log")
+    log_handler = setup_logging(log_file, int(args.log_max_mb * 1024 * 1024), args.log_backups, args.console)
+
+    daemon = ServerDaemon(args, log_handler)
+    daemon.install_signal_handlers()
+    return daemon.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -1,50 +1,67 @@
 import os
 import csv
 import glob
+import threading
 from datetime import datetime
 
+from attendance_store import AttendanceStore, parse_minutes, classify
+
 class DataManager:
     """数据管理类，负责数据的解析、存储和加载"""
     
     def __init__(self, data_dir="received_data"):
         self.data_dir = data_dir
-        self.current_data = []  # 当前会话数据（未保存）
-        self.current_images = {}  # 当前会话图片 {timestamp: image_data}
+        self.current_data = []  # 当前会话数据（已由服务器入库）
+        self.current_index = {}  # 记录唯一标识 -> 当前会话数据条目
 
         self.deadline_hour = 9 # 考勤截止时间（默认9:00）
         self.deadline_minute = 0
         
+        # 历史记录数据库（由服务器写入），旧版本的文本文件由 start_legacy_indexing 在后台导入
+        self.store = AttendanceStore(os.path.join(data_dir, "attendance.db"))
+        deadline = self.store.get_setting('deadline', AttendanceStore.DEFAULT_DEADLINE)
+        self.deadline_hour, self.deadline_minute = (int(part) for part in deadline.split(':'))
+        self.indexing_thread = None
     
-    def parse_text_data(self, text, client_address):
-        """解析文本数据 (格式: "日期,时间,姓名")"""
+    def add_session_record(self, record):
+        """
+        将服务器入库的记录加入当前会话
+        
+        Args:
+            record: 服务器回调的记录字典，source为唯一标识，photo_path为照片引用
+        
+        Returns:
+            tuple: (数据条目, 是否为新记录)；已有记录补充照片时返回原条目
+        """
         try:
-            parts = text.split(',')
-            if len(parts) >= 3:
-                date = parts[0].strip()
-                time = parts[1].strip()
-                name = parts[2].strip()
-                
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # 判断是否迟到
-                is_late = self.is_late(time)
-                
-                data_entry = {
-                    'timestamp': timestamp,
-                    'date': date,
-                    'time': time,
-                    'name': name,
-                    'client_address': client_address,
-                    'raw_text': text,
-                    'is_late': is_late
-                }
-                
-                # 添加到当前数据
-                self.current_data.append(data_entry)
-                return data_entry
-            return None
+            record_id = record['source']
+            data_entry = self.current_index.get(record_id)
+            if data_entry is not None:
+                data_entry['photo_path'] = record.get('photo_path')
+                return data_entry, False
+            
+            client_address = (record['client_ip'], record['client_port']) if record.get('client_ip') else ('未知', '未知')
+            data_entry = {
+                'record_id': record_id,
+                'timestamp': record['received_at'],
+                'date': record.get('date') or '未知',
+                'time': record.get('time') or '未知',
+                'name': record.get('name') or record.get('raw_text', ''),
+                'client_address': client_address,
+                'raw_text': record.get('raw_text'),
+                'check_minutes': parse_minutes(record.get('time')),
+                'photo_path': record.get('photo_path')
+            }
+            
+            data_entry['is_late'] = classify(data_entry['check_minutes'],
+                                             self.deadline_hour * 60 + self.deadline_minute)
+            
+            # 添加到当前数据
+            self.current_data.append(data_entry)
+            self.current_index[record_id] = data_entry
+            return data_entry, True
         except Exception as e:
-            raise Exception(f"解析文本数据失败: {str(e)}")
+            raise Exception(f"添加当前记录失败: {str(e)}")
 
     def is_late(self, check_time_str):
         """
@@ -54,42 +71,56 @@ class DataManager:
             check_time_str: 打卡时间字符串，格式如 "08:30" 或 "08:30:15"
         
         Returns:
-            bool: 是否迟到
+            str: "迟到"、"正常"，格式无效返回"错误"
         """
-        try:
-            # 解析打卡时间（处理可能包含秒的情况）
-            time_parts = check_time_str.split(':')
-            check_hour = int(time_parts[0])
-            check_minute = int(time_parts[1])
-            
-            # 比较时间
-            if check_hour > self.deadline_hour:
-                return "迟到"
-            elif check_hour == self.deadline_hour:
-                if check_minute > self.deadline_minute:
-                    return "迟到"
-            return "正常"
-            
-        except Exception as e:
-            return "错误"
+        return classify(parse_minutes(check_time_str), self.deadline_hour * 60 + self.deadline_minute)
 
-    def set_deadline_time(self, hour, minute):
-        """设置考勤截止时间"""
+    def set_deadline_time(self, hour, minute, date_from=None, date_to=None):
+        """
+        设置考勤截止时间，并重新判断已有记录的考勤状态
+        
+        Args:
+            hour: 小时
+            minute: 分钟
+            date_from: 重新判断的起始日期 YYYY-MM-DD，None表示不限
+            date_to: 重新判断的结束日期 YYYY-MM-DD，None表示不限
+        """
         self.deadline_hour = hour
         self.deadline_minute = minute
+        # 历史记录在数据库中集合化地重新分类，当前会话的条目使用已解析的分钟数
+        self.store.set_deadline(hour, minute, date_from, date_to)
+        deadline_minutes = hour * 60 + minute
+        for data_entry in self.current_data:
+            if (date_from is None or data_entry['date'] >= date_from) and \
+                    (date_to is None or data_entry['date'] <= date_to):
+                data_entry['is_late'] = classify(data_entry['check_minutes'], deadline_minutes)
         print(f"考勤截止时间设置为: {hour:02d}:{minute:02d}")
 
-    def add_image_data(self, filename, file_data, client_address):
-        """添加图片数据到当前会话"""
-        try:
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp')):
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.current_images[timestamp] = file_data
-                return timestamp
-            return None
-        except Exception as e:
-            raise Exception(f"添加图片数据失败: {str(e)}")
-    
+    def get_day_summaries(self, date_from=None, date_to=None):
+        """按天的正常/迟到/缺勤人数（读取增量维护的汇总表）"""
+        return self.store.day_summaries(date_from, date_to)
+
+    def get_person_summaries(self):
+        """按人的正常/迟到/缺勤天数（读取增量维护的汇总表）"""
+        return self.store.person_summaries()
+
+    def get_daily_report_text(self, date):
+        """获取某天的考勤统计文本"""
+        report = self.store.daily_report(date)
+        late_names = [name for name, _, late in report['present'] if late]
+        lines = [
+            f"日期: {date}",
+            f"出勤: {len(report['present'])} 人（正常 {len(report['present']) - len(late_names)}，迟到 {len(late_names)}）",
+            f"缺勤: {len(report['absent'])} 人",
+            ""
+        ]
+        for name, first_minutes, late in report['present']:
+            lines.append(f"{first_minutes // 60:02d}:{first_minutes % 60:02d}  {name}  {'迟到' if late else '正常'}")
+        if report['absent']:
+            lines.append("")
+            lines.append("缺勤: " + "、".join(report['absent']))
+        return "\n".join(lines)
+
     def get_current_data_display(self, data_entry):
         """获取当前数据的显示文本"""
         return f"{data_entry['timestamp']} - {data_entry['name']} ({data_entry['client_address'][0]})"
@@ -105,176 +136,283 @@ class DataManager:
         """
         return detail_text.strip()
     
-    def get_image_for_timestamp(self, timestamp):
-        """根据时间戳获取图片数据"""
-        return self.current_images.get(timestamp)
-    
     def clear_current_data(self):
         """清空当前数据"""
         self.current_data.clear()
-        self.current_images.clear()
+        self.current_index.clear()
+    
+    def _parse_text_file(self, file_path):
+        """
+        解析服务器保存的文本文件
+        
+        Returns:
+            tuple: (时间, 客户端地址字符串, 记录行列表)，批量文件包含多条记录行
+        """
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        
+        timestamp = ""
+        client_info = ""
+        record_lines = []
+        for line in content.split('\n'):
+            if line.startswith('时间:'):
+                timestamp = line.replace('时间:', '').strip()
+            elif line.startswith('客户端:'):
+                client_info = line.replace('客户端:', '').strip()
+            elif line.startswith('数据长度:') or line.startswith('-' * 50):
+                continue
+            elif line.strip():
+                record_lines.append(line.strip())
+        return timestamp, client_info, record_lines
+    
+    def start_legacy_indexing(self, callback=None):
+        """
+        在后台线程中为旧版本的数据目录建立索引（只执行一次）
+        
+        导入 texts/*.txt 中的记录，并扫描一次 images 目录为这些记录确定照片路径，
+        之后查找照片只需按记录读取photo_path。
+        
+        Args:
+            callback: 完成后的回调函数 function(added_count)，在后台线程中调用
+        
+        Returns:
+            bool: 启动了后台线程返回True，已建立过索引返回False
+        """
+        if self.store.get_setting('legacy_photos_indexed') or self.indexing_thread:
+            return False
+        
+        def run():
+            added = 0
+            try:
+                added = self._import_legacy_texts()
+                self._index_legacy_photos()
+            except Exception as e:
+                print(f"建立旧数据索引失败: {e}")
+            if callback:
+                callback(added)
+        
+        self.indexing_thread = threading.Thread(target=run, name="legacy-index", daemon=True)
+        self.indexing_thread.start()
+        return True
+    
+    def _import_legacy_texts(self):
+        """将旧版本保存的 texts/*.txt 导入数据库（可重复执行），返回新增记录数"""
+        if self.store.get_setting('legacy_texts_imported'):
+            return 0
+        
+        texts_dir = os.path.join(self.data_dir, "texts")
+        records = []
+        for file_path in glob.glob(os.path.join(texts_dir, "*.txt")):
+            try:
+                timestamp, client_info, record_lines = self._parse_text_file(file_path)
+                if not timestamp:
+                    timestamp = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%d %H:%M:%S")
+                client_ip, client_port = None, None
+                if ':' in client_info:
+                    client_ip, port = client_info.split(':')
+                    client_port = int(port)
+                
+                relative_path = os.path.relpath(file_path, self.data_dir)
+                for line_index, raw_text in enumerate(record_lines):
+                    parts = [part.strip() for part in raw_text.split(',')]
+                    records.append({
+                        'source': f"legacy:{relative_path}:{line_index}",
+                        'received_at': timestamp,
+                        'date': parts[0] if len(parts) >= 3 else None,
+                        'time': parts[1] if len(parts) >= 3 else None,
+                        'name': parts[2] if len(parts) >= 3 else None,
+                        'client_ip': client_ip,
+                        'client_port': client_port,
+                        'raw_text': raw_text
+                    })
+            except Exception as e:
+                print(f"导入历史文件 {file_path} 失败: {e}")
+        
+        added = self.store.add_records(records)
+        self.store.set_setting('legacy_texts_imported', '1')
+        if added:
+            print(f"已将 {added} 条旧文本记录导入数据库")
+        return added
     
-    def load_history_data(self):
-        """从文件系统加载历史数据"""
+    def _index_legacy_photos(self):
+        """扫描一次 images 目录，按旧文件命名规则为导入的记录写入照片路径"""
+        images_by_timestamp = {}
+        images_dir = os.path.join(self.data_dir, "images")
+        if os.path.exists(images_dir):
+            with os.scandir(images_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp')):
+                        # 旧文件名以 YYYYmmdd_HHMMSS 开头
+                        images_by_timestamp.setdefault(entry.name[:15], []).append(entry.name)
+        
+        updates = []
+        for record_id, source in self.store.legacy_records_without_photo():
+            text_path, line_index = source[len('legacy:'):].rsplit(':', 1)
+            image_name = self._match_legacy_image(os.path.basename(text_path), int(line_index),
+                                                  images_by_timestamp)
+            if image_name:
+                updates.append((os.path.join("images", image_name), record_id))
+        
+        self.store.set_photo_paths(updates)
+        self.store.set_setting('legacy_photos_indexed', '1')
+        if updates:
+            print(f"已为 {len(updates)} 条旧记录建立照片索引")
+    
+    def _match_legacy_image(self, text_filename, line_index, images_by_timestamp):
+        """
+        按旧版本的命名规则匹配照片文件名
+        
+        单条记录: text_{core}.txt 对应 {core}_{原文件名}
+        批量记录: text_{core}.txt 第i行对应 {core}_{i:04d}_{原文件名}
+        
+        Returns:
+            str: 照片文件名，找不到或无法唯一确定返回None
+        """
+        if not (text_filename.startswith("text_") and text_filename.endswith(".txt")):
+            return None
+        core_name = text_filename[5:-4]
+        candidates = sorted(images_by_timestamp.get(core_name[:15], []))
+        
+        if core_name.endswith("_batch"):
+            prefix = f"{core_name}_{line_index:04d}_"
+            matches = [name for name in candidates if name.startswith(prefix)]
+            return matches[0] if matches else None
+        
+        single_candidates = [name for name in candidates if "_batch_" not in name]
+        matches = [name for name in single_candidates if name.startswith(core_name + "_")]
+        if matches:
+            return matches[0]
+        # 文本与照片的时间戳可能不同步，同一秒内只有一张照片时才认为对应
+        if len(single_candidates) == 1:
+            return single_candidates[0]
+        return None
+    
+    def _record_to_entry(self, record):
+        """数据库记录转换为详情显示用的字典"""
+        data_entry = {
+            'record_id': record['id'],
+            'timestamp': record['received_at'],
+            'raw_text': record['raw_text'],
+            'is_late': record['status']
+        }
+        if record['client_ip']:
+            data_entry['client_address'] = (record['client_ip'], record['client_port'])
+        if record['name'] is not None:
+            data_entry['date'] = record['date']
+            data_entry['time'] = record['time']
+            data_entry['name'] = record['name']
+        return data_entry
+    
+    def count_history(self):
+        """历史记录总数"""
+        return self.store.count()
+    
+    def latest_record_id(self):
+        """数据库中最新记录的id，没有记录返回0"""
+        return self.store.max_record_id()
+    
+    def load_records_after(self, last_id, limit=500):
+        """
+        读取其他进程（如无界面守护进程）在last_id之后写入的记录
+        
+        Returns:
+            list: 记录字典列表（按id递增），格式与服务器入库回调的记录相同
+        """
+        return self.store.records_after(last_id, limit)
+    
+    def load_history_page(self, before=None, limit=200):
+        """
+        分页加载历史数据（最新的在前）
+        
+        Args:
+            before: 上一页最后一个条目的 'cursor'，None表示第一页
+            limit: 每页条目数
+        
+        Returns:
+            list: 条目字典 {'display_text', 'record_id', 'cursor'}
+        """
         try:
             history_entries = []
-            texts_dir = os.path.join(self.data_dir, "texts")
-            
-            if not os.path.exists(texts_dir):
-                return history_entries
-            
-            # 获取所有文本文件并按时间排序
-            text_files = glob.glob(os.path.join(texts_dir, "*.txt"))
-            text_files.sort(key=os.path.getmtime, reverse=True)
-            
-            for file_path in text_files:
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    # 解析文件内容
-                    lines = content.split('\n')
-                    display_info = ""
-                    timestamp = ""
-                    client_info = ""
-                    
-                    for line in lines:
-                        if line.startswith('时间:'):
-                            timestamp = line.replace('时间:', '').strip()
-                        elif line.startswith('客户端:'):
-                            client_info = line.replace('客户端:', '').strip()
-                        elif line.strip() and not line.startswith('数据长度:') and not line.startswith('-' * 50):
-                            raw_data = line.strip()
-                            parts = raw_data.split(',')
-                            if len(parts) >= 3:
-                                name = parts[2].strip()
-                                display_info = f"{timestamp} - {name} ({client_info})"
-                                break
-                    
-                    if not display_info:
-                        display_info = f"{os.path.basename(file_path)}"
-                    
-                    history_entries.append({
-                        'display_text': display_info,
-                        'file_path': file_path
-                    })
-                    
-                except Exception as e:
-                    print(f"读取历史文件 {file_path} 失败: {e}")
-            
+            for record in self.store.query_page(before, limit):
+                client_info = f"{record['client_ip']}:{record['client_port']}" if record['client_ip'] else "未知"
+                label = record['name'] if record['name'] is not None else record['raw_text']
+                history_entries.append({
+                    'display_text': f"{record['received_at']} - {label} ({client_info})",
+                    'record_id': record['id'],
+                    'cursor': (record['received_at'], record['id'])
+                })
             return history_entries
             
         except Exception as e:
             raise Exception(f"加载历史数据失败: {str(e)}")
     
-    def load_history_entry_detail(self, file_path):
+    def load_history_entry_detail(self, record_id):
         """加载历史数据条目的详细信息"""
         try:
-            if not os.path.exists(file_path):
-                return None
-            
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            lines = content.split('\n')
-            data_entry = {}
-            
-            for line in lines:
-                if line.startswith('时间:'):
-                    data_entry['timestamp'] = line.replace('时间:', '').strip()
-                elif line.startswith('客户端:'):
-                    client_str = line.replace('客户端:', '').strip()
-                    if ':' in client_str:
-                        ip, port = client_str.split(':')
-                        data_entry['client_address'] = (ip, int(port))
-                elif line.startswith('数据长度:'):
-                    continue
-                elif line.startswith('-' * 50):
-                    continue
-                elif line.strip() and 'raw_text' not in data_entry:
-                    data_entry['raw_text'] = line.strip()
-                    parts = line.strip().split(',')
-                    if len(parts) >= 3:
-                        data_entry['date'] = parts[0].strip()
-                        data_entry['time'] = parts[1].strip()
-                        data_entry['name'] = parts[2].strip()
-            
-            return data_entry
+            record = self.store.get_record(record_id)
+            return self._record_to_entry(record) if record else None
             
         except Exception as e:
             raise Exception(f"加载历史条目详情失败: {str(e)}")
     
-    def load_history_image(self, text_file_path):
-        """加载历史图片"""
+    def get_history_photo_path(self, record_id):
+        """
+        获取历史记录对应的照片路径
+        
+        Returns:
+            str: 照片文件路径，没有照片返回None
+        """
         try:
-            base_data_dir = os.path.dirname(os.path.dirname(text_file_path))
-            images_dir = os.path.join(base_data_dir, "images")
-            
-            if not os.path.exists(images_dir):
+            record = self.store.get_record(record_id)
+            if not record or not record['photo_path']:
                 return None
-            
-            text_filename = os.path.basename(text_file_path)
-            
-            if text_filename.startswith("text_") and text_filename.endswith(".txt"):
-                core_name = text_filename[5:-4]
-                
-                found_images = []
-                
-                # 精确匹配
-                exact_pattern = os.path.join(images_dir, f"{core_name}*")
-                exact_matches = glob.glob(exact_pattern)
-                found_images.extend([f for f in exact_matches if f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp'))])
-                
-                # 时间戳匹配
-                if not found_images:
-                    timestamp_part = core_name[:15]
-                    timestamp_pattern = os.path.join(images_dir, f"{timestamp_part}*")
-                    timestamp_matches = glob.glob(timestamp_pattern)
-                    found_images.extend([f for f in timestamp_matches if f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp'))])
-                
-                if found_images:
-                    found_images.sort(key=os.path.getmtime, reverse=True)
-                    with open(found_images[0], 'rb') as f:
-                        return f.read()
-            
-            return None
+            return os.path.join(self.data_dir, record['photo_path'])
             
         except Exception as e:
             raise Exception(f"加载历史图片失败: {str(e)}")
     
-    def export_to_csv(self, history_entries, output_path):
-        """导出数据到CSV文件"""
+    def export_to_csv(self, output_path, date_from=None, date_to=None, name=None, status=None,
+                      progress_callback=None):
+        """
+        按条件流式导出考勤记录到CSV文件（按日期、时间顺序）
+        
+        Args:
+            output_path: 输出文件路径
+            date_from: 起始日期 YYYY-MM-DD（含），None表示不限
+            date_to: 结束日期 YYYY-MM-DD（含），None表示不限
+            name: 姓名，None表示全部
+            status: 考勤状态（"正常"/"迟到"），None表示全部
+            progress_callback: 进度回调 function(done, total)，返回False时取消导出
+        
+        Returns:
+            int: 导出的记录数，取消时返回None
+        """
         try:
-            with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['日期', '时间', '姓名']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                
-                writer.writeheader()
-                
-                # 导出当前数据
-                for data in self.current_data:
-                    writer.writerow({
-                        '日期': data['date'],
-                        '时间': data['time'],
-                        '姓名': data['name']
-                    })
+            total = self.store.count_filtered(date_from, date_to, name, status)
+            temp_path = output_path + ".tmp"
+            done = 0
+            cancelled = False
+            
+            with open(temp_path, 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(['日期', '时间', '姓名', '考勤状态', '客户端'])
                 
-                # 导出历史数据
-                for entry in history_entries:
-                    file_path = entry['file_path']
-                    if os.path.exists(file_path):
-                        try:
-                            data_entry = self.load_history_entry_detail(file_path)
-                            if data_entry:
-                                writer.writerow({
-                                    '日期': data_entry.get('date', ''),
-                                    '打卡时间': data_entry.get('time', ''),
-                                    '姓名': data_entry.get('name', '')
-                                })
-                        except Exception as e:
-                            print(f"导出历史数据失败 {file_path}: {e}")
+                for record in self.store.iter_filtered(date_from, date_to, name, status):
+                    client_info = f"{record['client_ip']}:{record['client_port']}" if record['client_ip'] else ''
+                    writer.writerow([record['date'], record['time'], record['name'], record['status'], client_info])
+                    done += 1
+                    if progress_callback and done % 1000 == 0 and progress_callback(done, total) is False:
+                        cancelled = True
+                        break
+            
+            if cancelled:
+                os.remove(temp_path)
+                return None
             
-            return True
+            os.replace(temp_path, output_path)
+            if progress_callback:
+                progress_callback(done, total)
+            return done
             
         except Exception as e:
             raise Exception(f"导出CSV文件失败: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,219 @@
+# gallery.py
+# 服务器保存的权威人脸库，各开发板按版本号增量同步
+#
+# 命令行管理: python gallery.py [--db received_data/gallery.db] list
+#             python gallery.py remove 姓名
+#             python gallery.py import face_data.pkl   （导入开发板原有的人脸数据）
+import os
+import sys
+import pickle
+import sqlite3
+import argparse
+import threading
+
+
+class GalleryStore:
+    """
+    人脸库（SQLite，WAL模式）
+
+    每次注册、更新或删除都把该人脸的version设为新的版本号（当前最大版本号+1），
+    删除只清空特征并标记removed（保留为墓碑），因此MAX(version)单调递增，
+    "version大于v的行"就是版本v之后的全部变化，开发板只需拉取这些增量。
+    同名的有效人脸只有一个，重复注册视为更新特征。
+    特征为128维float64（小端）的原始字节，服务器不需要解析。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS faces (
+            face_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            encoding BLOB,
+            version INTEGER NOT NULL,
+            removed INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_faces_version ON faces(version);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_faces_live_name ON faces(name) WHERE removed = 0;
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        # 服务器、识别进程和命令行工具可能同时打开；同一实例内的访问由锁串行化
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def version(self):
+        """当前版本号，空库为0"""
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM faces").fetchone()[0]
+
+    def enroll(self, name, encoding):
+        """
+        注册人脸，同名的有效人脸更新特征（保留face_id）
+
+        Returns:
+            tuple: (face_id, 新版本号)
+        """
+        with self.lock:
+            # 立即获取写锁，版本号的读取和写入之间不会插入其他进程的修改
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self.conn.execute(
+                    "SELECT COALESCE(MAX(version), 0) FROM faces").fetchone()[0] + 1
+                row = self.conn.execute(
+                    "SELECT face_id FROM faces WHERE name = ? AND removed = 0", (name,)).fetchone()
+                if row:
+                    face_id = row[0]
+                    self.conn.execute("UPDATE faces SET encoding = ?, version = ? WHERE face_id = ?",
+                                      (encoding, version, face_id))
+                else:
+                    face_id = self.conn.execute(
+                        "INSERT INTO faces (name, encoding, version) VALUES (?, ?, ?)",
+                        (name, encoding, version)).lastrowid
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return face_id, version
+
+    def remove(self, name):
+        """
+        删除人脸（保留墓碑，开发板同步时删除本地特征）
+
+        Returns:
+            int: 新版本号，该姓名未注册返回None
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self.conn.execute(
+                    "SELECT COALESCE(MAX(version), 0) FROM faces").fetchone()[0] + 1
+                cursor = self.conn.execute(
+                    "UPDATE faces SET encoding = NULL, removed = 1, version = ? "
+                    "WHERE name = ? AND removed = 0", (version, name))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return version if cursor.rowcount else None
+
+    def changes_since(self, version, limit=1000):
+        """
+        版本version之后的变化（按版本递增）
+
+        Args:
+            version: 开发板已同步到的版本号
+            limit: 最多返回的条数，变化较多时开发板分多次拉取
+
+        Returns:
+            tuple: (reached, latest, changes)
+                reached为本次返回的变化同步后达到的版本号，latest为当前最新版本号；
+                changes为 [(face_id, name, encoding), ...]，已删除的人脸encoding为None
+        """
+        with self.lock:
+            # 两次查询在同一个读事务中，看到的是同一个版本的数据
+            self.conn.execute("BEGIN")
+            try:
+                latest = self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM faces").fetchone()[0]
+                rows = self.conn.execute(
+                    "SELECT face_id, name, encoding, removed, version FROM faces "
+                    "WHERE version > ? ORDER BY version LIMIT ?", (version, limit)).fetchall()
+            finally:
+                self.conn.execute("COMMIT")
+        if len(rows) < limit:
+            reached = latest
+        else:
+            reached = rows[-1][4]
+        changes = [(face_id, name, None if removed else encoding)
+                   for face_id, name, encoding, removed, _ in rows]
+        return max(reached, version), latest, changes
+
+    def snapshot(self):
+        """
+        全部有效人脸
+
+        Returns:
+            tuple: (version, [(face_id, name, encoding), ...])
+        """
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                version = self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM faces").fetchone()[0]
+                rows = self.conn.execute(
+                    "SELECT face_id, name, encoding FROM faces WHERE removed = 0 ORDER BY face_id").fetchall()
+            finally:
+                self.conn.execute("COMMIT")
+        return version, rows
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def import_face_data(store, pkl_path):
+    """
+    导入开发板的face_data.pkl（{'encodings': [...], 'names': [...]}，
+    量化保存的为 {'quantized': {'format', 'data', 'scale'}, 'names': [...]}，还原后导入）
+
+    Returns:
+        int: 导入的人数
+    """
+    with open(pkl_path, 'rb') as f:
+        data = pickle.load(f)
+    if 'quantized' in data:
+        quantized = data['quantized']
+        encodings = quantized['data'].astype('<f8')
+        if quantized.get('scale') is not None:
+            encodings = encodings * quantized['scale']
+    else:
+        encodings = data['encodings']
+    for name, encoding in zip(data['names'], encodings):
+        # numpy数组按float64小端转换为字节，与开发板同步时的格式相同
+        store.enroll(name, encoding.astype('<f8').tobytes())
+    return len(data['names'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务器人脸库管理")
+    parser.add_argument('--db', default=os.path.join("received_data", "gallery.db"), help="人脸库文件")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="列出已注册的人脸")
+    remove_parser = commands.add_parser('remove', help="删除人脸")
+    remove_parser.add_argument('name')
+    import_parser = commands.add_parser('import', help="导入开发板的face_data.pkl")
+    import_parser.add_argument('pkl_path')
+    args = parser.parse_args()
+
+    store = GalleryStore(args.db)
+    try:
+        if args.command == 'list':
+            version, faces = store.snapshot()
+            print(f"人脸库版本 {version}，共 {len(faces)} 人")
+            for face_id, name, _ in faces:
+                print(f"  {face_id}: {name}")
+        elif args.command == 'remove':
+            version = store.remove(args.name)
+            if version is None:
+                print(f"未注册: {args.name}")
+                return 1
+            print(f"已删除 {args.name}，人脸库版本 {version}")
+        elif args.command == 'import':
+            count = import_face_data(store, args.pkl_path)
+            print(f"已导入 {count} 人，人脸库版本 {store.version()}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,387 @@
+import os
+import json
+import queue
+import struct
+import time
+import zlib
+import threading
+from concurrent.futures import Future
+
+
+class GroupCommitWriter:
+    """
+    分组提交写入器
+
+    接收线程把消息放入有界队列后即可等待确认，写盘线程每次取出一批消息，
+    顺序追加到预写日志(WAL)并只做一次fsync，随后统一完成这一批的Future，
+    服务器据此回复确认。已确认的序号区间交给单独的落盘线程写入正式存储（apply），
+    落盘耗时不会阻塞下一批的写入和确认；落盘线程积压时合并多批一起落盘。
+
+    落盘失败时检查点停在最后一次成功的位置，之后每隔apply_retry_interval秒
+    从WAL中读取检查点之后的全部记录重试，成功后继续推进检查点。
+    WAL只在全部记录落盘后由写盘线程截断。
+
+    WAL记录格式: seq(8) header_len(4) data_len(4) crc32(4) + JSON头 + 二进制数据
+    """
+
+    RECORD_HEADER = struct.Struct('!QIII')
+
+    def __init__(self, wal_dir, apply_func, max_queue=1024, max_batch=256,
+                 max_batch_bytes=8 * 1024 * 1024, max_wal_size=64 * 1024 * 1024, metrics=None,
+                 apply_retry_interval=5.0):
+        """
+        Args:
+            wal_dir: WAL文件目录
+            apply_func: 落盘函数 function(entries)，entries为 [(seq, header, blobs), ...]
+            max_queue: 队列最大长度，队列满时submit阻塞，形成背压
+            max_batch: 每批最多提交的消息数
+            max_batch_bytes: 每批最多提交的数据字节数
+            max_wal_size: WAL超过该大小且全部落盘后截断
+            metrics: 指标注册表(metrics.Registry)，None表示不采集
+            apply_retry_interval: 落盘失败后重试的间隔（秒）
+        """
+        self.wal_dir = wal_dir
+        self.apply_func = apply_func
+        self.max_batch = max_batch
+        self.max_batch_bytes = max_batch_bytes
+        self.max_wal_size = max_wal_size
+        self.apply_retry_interval = apply_retry_interval
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        # 已写入WAL、等待落盘的记录，有界以便落盘过慢时向写盘线程施加背压
+        self.apply_queue = queue.Queue(maxsize=max_queue)
+        self.wal_path = os.path.join(wal_dir, "ingest.wal")
+        self.checkpoint_path = os.path.join(wal_dir, "ingest.checkpoint")
+        self.wal_file = None
+        self.next_seq = 1
+        self.thread = None
+        self.apply_thread = None
+        self.running = False
+        self.durable_seq = 0      # 已写入WAL并fsync的最大序号
+        self.applied_seq = 0      # 已落盘（检查点）的最大序号
+        self.apply_failed = False
+        self.apply_retry_at = 0
+        self.apply_cond = threading.Condition()
+
+        # 统计信息
+        self.batches_committed = 0
+        self.entries_committed = 0
+        self.metrics = None
+        if metrics is not None:
+            self._init_metrics(metrics)
+
+        if not os.path.exists(self.wal_dir):
+            os.makedirs(self.wal_dir)
+
+    def _init_metrics(self, registry):
+        self.metrics = {
+            'queue_depth': registry.gauge(
+                'attendance_ingest_queue_depth', '等待写入WAL的消息数', func=self.queue.qsize),
+            'batch_size': registry.histogram(
+                'attendance_commit_batch_size', '每次分组提交的消息数',
+                buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)),
+            'fsync_seconds': registry.histogram(
+                'attendance_wal_fsync_seconds', 'WAL写入并fsync的耗时'),
+            'apply_seconds': registry.histogram(
+                'attendance_apply_seconds', '一批消息落盘到数据库和照片文件的耗时'),
+            'entries': registry.counter(
+                'attendance_wal_entries_total', '已写入WAL的消息数'),
+            'failures': registry.counter(
+                'attendance_wal_failures_total', '写入WAL或落盘失败次数', labels=('stage',)),
+            'apply_backlog': registry.gauge(
+                'attendance_apply_backlog', '已确认但尚未落盘的消息数（落盘失败时增长）',
+                func=self.apply_backlog),
+        }
+
+    def start(self):
+        """恢复未落盘的WAL记录并启动写盘线程和落盘线程"""
+        if self.running:
+            return
+        self._recover()
+        self.wal_file = open(self.wal_path, 'ab')
+        self.running = True
+        self.thread = threading.Thread(target=self._writer_loop, name="group-commit", daemon=True)
+        self.apply_thread = threading.Thread(target=self._apply_loop, name="group-apply", daemon=True)
+        self.thread.start()
+        self.apply_thread.start()
+
+    def submit(self, header, blobs=()):
+        """
+        提交一条消息
+
+        Args:
+            header: 可JSON序列化的字典，描述消息内容
+            blobs: 二进制数据列表（如照片）
+
+        Returns:
+            Future: 消息写入WAL并fsync后结果为True，失败时设置异常
+        """
+        future = Future()
+        if not self.running:
+            future.set_exception(RuntimeError("写入器未启动"))
+            return future
+        self.queue.put((header, list(blobs), future))
+        return future
+
+    def apply_backlog(self):
+        """已写入WAL但尚未落盘的消息数，持续大于0说明落盘失败"""
+        return self.durable_seq - self.applied_seq
+
+    def stop(self):
+        """处理完队列中的消息并落盘后停止"""
+        if not self.running:
+            return
+        self.running = False
+        self.queue.put(None)
+        self.thread.join()
+        self.apply_queue.put(None)
+        self.apply_thread.join()
+        self.wal_file.close()
+        self.wal_file = None
+
+    def _writer_loop(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            # 取出当前已排队的消息组成一批
+            batch = [item]
+            batch_bytes = sum(len(blob) for blob in item[1])
+            while len(batch) < self.max_batch and batch_bytes < self.max_batch_bytes:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                batch_bytes += sum(len(blob) for blob in item[1])
+
+            self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        """写入一批消息，fsync一次后完成确认，再交给落盘线程"""
+        self._maybe_truncate()
+        first_seq = self.next_seq
+        start_pos = self.wal_file.tell()
+        started = time.perf_counter()
+        try:
+            for header, blobs, _ in batch:
+                self._append_record(self.next_seq, header, blobs)
+                self.next_seq += 1
+            self.wal_file.flush()
+            os.fsync(self.wal_file.fileno())
+        except Exception as e:
+            print(f"写入WAL失败: {e}")
+            # 丢弃写了一半的记录，避免影响后续记录的恢复
+            try:
+                self.wal_file.seek(start_pos)
+                self.wal_file.truncate()
+            except Exception:
+                pass
+            self.next_seq = first_seq
+            for _, _, future in batch:
+                future.set_exception(e)
+            if self.metrics:
+                self.metrics['failures'].inc('wal')
+            return
+
+        self.durable_seq = self.next_seq - 1
+        self.batches_committed += 1
+        self.entries_committed += len(batch)
+        if self.metrics:
+            self.metrics['fsync_seconds'].observe(time.perf_counter() - started)
+            self.metrics['batch_size'].observe(len(batch))
+            self.metrics['entries'].inc(amount=len(batch))
+        for _, _, future in batch:
+            future.set_result(True)
+
+        self.apply_queue.put([(first_seq + i, header, blobs) for i, (header, blobs, _) in enumerate(batch)])
+
+    def _maybe_truncate(self):
+        """WAL过大时等待落盘线程追上，全部落盘后截断（落盘失败时保留WAL等待重试）"""
+        if self.wal_file.tell() < self.max_wal_size:
+            return
+        with self.apply_cond:
+            self.apply_cond.wait_for(lambda: self.applied_seq == self.durable_seq or self.apply_failed)
+            if self.applied_seq != self.durable_seq:
+                return
+        self._sync_applied()
+        self.wal_file.close()
+        self.wal_file = open(self.wal_path, 'wb')
+
+    def _apply_loop(self):
+        stopping = False
+        while not stopping:
+            if self.apply_failed:
+                # 有落盘失败的记录时，空闲期间也按间隔重试
+                try:
+                    item = self.apply_queue.get(timeout=max(0, self.apply_retry_at - time.monotonic()))
+                except queue.Empty:
+                    self._retry_apply()
+                    continue
+            else:
+                item = self.apply_queue.get()
+            if item is None:
+                break
+
+            # 合并已排队的区间一起落盘
+            entries = list(item)
+            while len(entries) < self.max_batch:
+                try:
+                    item = self.apply_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                entries.extend(item)
+
+            # 重试时已从WAL补写过的记录跳过
+            entries = [entry for entry in entries if entry[0] > self.applied_seq]
+            if not entries:
+                continue
+            if not self.apply_failed:
+                self._apply(entries)
+            elif time.monotonic() >= self.apply_retry_at:
+                # 之前有落盘失败的记录，连同这些记录一起从WAL重试
+                self._retry_apply()
+
+    def _apply(self, entries):
+        """
+        落盘一组连续的记录（从检查点之后开始），成功后推进检查点
+
+        Returns:
+            bool: 是否成功
+        """
+        started = time.perf_counter()
+        try:
+            self.apply_func(entries)
+            self._write_checkpoint(entries[-1][0])
+        except Exception as e:
+            # 检查点停在失败之前，这些记录在重试或下次启动时重放
+            with self.apply_cond:
+                self.apply_failed = True
+                self.apply_retry_at = time.monotonic() + self.apply_retry_interval
+                self.apply_cond.notify_all()
+            print(f"落盘失败，记录 {entries[0][0]} 起将在 {self.apply_retry_interval} 秒后重试: {e}")
+            if self.metrics:
+                self.metrics['failures'].inc('apply')
+            return False
+        finally:
+            if self.metrics:
+                self.metrics['apply_seconds'].observe(time.perf_counter() - started)
+
+        with self.apply_cond:
+            self.applied_seq = entries[-1][0]
+            self.apply_failed = False
+            self.apply_cond.notify_all()
+        return True
+
+    def _retry_apply(self):
+        """从WAL读取检查点之后已确认的记录重新落盘（落盘函数对重放的记录结果相同）"""
+        durable_seq = self.durable_seq
+        entries, _ = self._read_wal()
+        entries = [entry for entry in entries if self.applied_seq < entry[0] <= durable_seq]
+        if entries and self._apply(entries):
+            print(f"落盘已恢复，补写 {len(entries)} 条记录")
+
+    def _append_record(self, seq, header, blobs):
+        header = dict(header, blob_sizes=[len(blob) for blob in blobs])
+        header_data = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        data = b''.join(blobs)
+        crc = zlib.crc32(data, zlib.crc32(header_data))
+        self.wal_file.write(self.RECORD_HEADER.pack(seq, len(header_data), len(data), crc))
+        self.wal_file.write(header_data)
+        self.wal_file.write(data)
+
+    def _write_checkpoint(self, applied_seq):
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.write(str(applied_seq))
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _sync_applied(self):
+        """截断WAL前确保已落盘的数据写入磁盘"""
+        if hasattr(os, 'sync'):
+            os.sync()
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _read_wal(self):
+        """
+        读取WAL中的完整记录，遇到不完整或校验失败的尾部记录即停止
+
+        Returns:
+            tuple: (entries, valid_size)，valid_size为完整记录结束的位置
+        """
+        entries = []
+        valid_size = 0
+        if not os.path.exists(self.wal_path):
+            return entries, valid_size
+        with open(self.wal_path, 'rb') as f:
+            while True:
+                record_header = f.read(self.RECORD_HEADER.size)
+                if len(record_header) < self.RECORD_HEADER.size:
+                    break
+                seq, header_len, data_len, crc = self.RECORD_HEADER.unpack(record_header)
+                header_data = f.read(header_len)
+                data = f.read(data_len)
+                if len(header_data) < header_len or len(data) < data_len:
+                    break
+                if zlib.crc32(data, zlib.crc32(header_data)) != crc:
+                    break
+
+                header = json.loads(header_data.decode('utf-8'))
+                blobs = []
+                offset = 0
+                for size in header.pop('blob_sizes', []):
+                    blobs.append(data[offset:offset + size])
+                    offset += size
+                entries.append((seq, header, blobs))
+                valid_size = f.tell()
+        return entries, valid_size
+
+    def _recover(self):
+        """
+        重放上次未落盘的记录，然后清空WAL
+
+        重放失败时保留WAL（去掉不完整的尾部记录）并照常启动，
+        由落盘线程按间隔重试，不影响接收新消息。
+        """
+        applied_seq = self._read_checkpoint()
+        entries, valid_size = self._read_wal()
+        pending = [entry for entry in entries if entry[0] > applied_seq]
+        last_seq = max([applied_seq] + [seq for seq, _, _ in entries])
+        self.next_seq = last_seq + 1
+        self.durable_seq = last_seq
+
+        if pending:
+            print(f"从WAL恢复 {len(pending)} 条未落盘记录")
+            try:
+                self.apply_func(pending)
+            except Exception as e:
+                print(f"恢复落盘失败，将在 {self.apply_retry_interval} 秒后重试: {e}")
+                if self.metrics:
+                    self.metrics['failures'].inc('apply')
+                self.applied_seq = applied_seq
+                self.apply_failed = True
+                self.apply_retry_at = time.monotonic() + self.apply_retry_interval
+                # 新记录追加在完整记录之后，否则重试时读不到
+                with open(self.wal_path, 'r+b') as f:
+                    f.truncate(valid_size)
+                return
+
+        self.applied_seq = last_seq
+        self._write_checkpoint(last_seq)
+        if entries:
+            self._sync_applied()
+            open(self.wal_path, 'wb').close()
\ No newline at end of file
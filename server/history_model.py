@@ -0,0 +1,129 @@
+# history_model.py
+from PyQt5.QtCore import (Qt, QAbstractListModel, QModelIndex, QObject, QThread,
+                          pyqtSignal, pyqtSlot)
+
+
+class HistoryPageLoader(QObject):
+    """在后台线程中查询历史记录分页"""
+    page_loaded = pyqtSignal(int, list, int)  # 代次, 条目列表, 总数(-1表示未统计)
+    load_failed = pyqtSignal(int, str)
+
+    def __init__(self, data_manager):
+        super().__init__()
+        self.data_manager = data_manager
+
+    @pyqtSlot(int, object, int, bool)
+    def load(self, generation, before, limit, with_count):
+        try:
+            entries = self.data_manager.load_history_page(before, limit)
+            total = self.data_manager.count_history() if with_count else -1
+            self.page_loaded.emit(generation, entries, total)
+        except Exception as e:
+            self.load_failed.emit(generation, str(e))
+
+
+class HistoryListModel(QAbstractListModel):
+    """
+    历史数据列表模型
+
+    只保存已加载的条目，视图滚动到底部时通过 canFetchMore/fetchMore
+    请求下一页，查询在后台线程执行，结果返回界面线程后再插入行。
+    """
+    load_request = pyqtSignal(int, object, int, bool)
+    total_changed = pyqtSignal(int)
+    load_failed = pyqtSignal(str)
+
+    def __init__(self, data_manager, page_size=200, parent=None):
+        """
+        Args:
+            data_manager: 数据管理器，提供 load_history_page/count_history
+            page_size: 每页条目数
+            parent: 父对象
+        """
+        super().__init__(parent)
+        self.page_size = page_size
+        self.entries = []
+        self.total = 0
+        self.has_more = True
+        self.loading = False
+        # 刷新后旧的分页结果作废
+        self.generation = 0
+
+        self.loader_thread = QThread()
+        self.loader = HistoryPageLoader(data_manager)
+        self.loader.moveToThread(self.loader_thread)
+        self.load_request.connect(self.loader.load)
+        self.loader.page_loaded.connect(self._on_page_loaded)
+        self.loader.load_failed.connect(self._on_load_failed)
+        self.loader_thread.start()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.entries):
+            return None
+        entry = self.entries[index.row()]
+        if role == Qt.DisplayRole:
+            return entry['display_text']
+        if role == Qt.UserRole:
+            return entry['record_id']
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.has_more and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.canFetchMore():
+            return
+        before = self.entries[-1]['cursor'] if self.entries else None
+        self._request_page(before, with_count=False)
+
+    def entry(self, row):
+        """获取已加载的条目，行号无效返回None"""
+        if 0 <= row < len(self.entries):
+            return self.entries[row]
+        return None
+
+    def reload(self):
+        """清空已加载的条目，从第一页重新加载并统计总数"""
+        self.generation += 1
+        self.beginResetModel()
+        self.entries = []
+        self.has_more = True
+        self.endResetModel()
+        self._request_page(None, with_count=True)
+
+    def shutdown(self):
+        """停止后台查询线程"""
+        self.loader_thread.quit()
+        self.loader_thread.wait()
+
+    def _request_page(self, before, with_count):
+        self.loading = True
+        self.load_request.emit(self.generation, before, self.page_size, with_count)
+
+    def _on_page_loaded(self, generation, entries, total):
+        if generation != self.generation:
+            return
+        self.loading = False
+        self.has_more = len(entries) == self.page_size
+        if entries:
+            start = len(self.entries)
+            self.beginInsertRows(QModelIndex(), start, start + len(entries) - 1)
+            self.entries.extend(entries)
+            self.endInsertRows()
+        if total >= 0:
+            self.total = total
+            self.total_changed.emit(total)
+
+    def _on_load_failed(self, generation, message):
+        if generation != self.generation:
+            return
+        self.loading = False
+        self.has_more = False
+        self.load_failed.emit(message)
\ No newline at end of file
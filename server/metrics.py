@@ -0,0 +1,278 @@
+# metrics.py
+import os
+import time
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value != value:
+        return "NaN"
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """指标基类: 按标签值保存各条时间序列"""
+    TYPE = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.label_names}")
+        return tuple(str(value) for value in label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.TYPE}"]
+        with self.lock:
+            items = sorted(self.series.items())
+        for label_values, value in items:
+            lines.extend(self._render_series(label_values, value))
+        return lines
+
+    def _render_series(self, label_values, value):
+        return [f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    TYPE = "counter"
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, *label_values):
+        with self.lock:
+            return self.series.get(self._key(label_values), 0)
+
+
+class Gauge(_Metric):
+    """可增可减的当前值；也可以用函数在采集时取值"""
+    TYPE = "gauge"
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        super().__init__(name, help_text, labels)
+        self.func = func
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.series[self._key(label_values)] = value
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self):
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception:
+                # 采集函数出错（如停止过程中）时输出NaN，不影响其他指标
+                value = float('nan')
+            self.set(value)
+        return super().render()
+
+
+class Histogram(_Metric):
+    """累积分桶直方图（如延迟、批大小）"""
+    TYPE = "histogram"
+
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        key = self._key(label_values)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.series.get(key)
+            if state is None:
+                state = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *label_values):
+        """上下文管理器: 记录代码块的耗时（秒）"""
+        return _Timer(self, label_values)
+
+    def _render_series(self, label_values, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.label_names, label_values, ('le', _format_value(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, label_values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def render(self):
+        # 取状态副本后再渲染，避免与observe并发修改
+        with self.lock:
+            snapshot = {key: [list(state[0]), state[1], state[2]] for key, state in self.series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.TYPE}"]
+        for label_values, state in sorted(snapshot.items()):
+            lines.extend(self._render_series(label_values, state))
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+class Registry:
+    """指标注册表，输出Prometheus文本格式"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), func=None):
+        return self._register(Gauge(name, help_text, labels, func))
+
+    def histogram(self, name, help_text, labels=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        """
+        Returns:
+            str: Prometheus文本格式（text/plain; version=0.0.4）
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    本地HTTP指标服务
+
+    GET /metrics 返回Prometheus文本格式；可选地按固定间隔把同样的内容写入快照文件。
+    """
+
+    def __init__(self, registry, host='127.0.0.1', port=9108, snapshot_path=None, snapshot_interval=60):
+        """
+        Args:
+            registry: 指标注册表
+            host: 监听地址，默认只监听本机
+            port: 监听端口，0表示自动分配
+            snapshot_path: 快照文件路径，None表示不写快照
+            snapshot_interval: 快照间隔（秒）
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.httpd = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True)]
+        if self.snapshot_path:
+            self.threads.append(threading.Thread(target=self._snapshot_loop, name="metrics-snapshot", daemon=True))
+        for thread in self.threads:
+            thread.start()
+        print(f"指标服务已启动: http://{self.host}:{self.port}/metrics")
+
+    def write_snapshot(self):
+        """写入一次快照（先写临时文件再替换）"""
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(f"# snapshot_time {time.time():.3f}\n")
+            f.write(self.registry.render())
+        os.replace(temp_path, self.snapshot_path)
+
+    def _snapshot_loop(self):
+        while not self.stop_event.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                print(f"写入指标快照失败: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+        if self.snapshot_path:
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                print(f"写入指标快照失败: {e}")
\ No newline at end of file
@@ -0,0 +1,360 @@
+# protocol.py
+# 二进制帧协议，客户端与服务器两侧保持一致
+#
+# 帧格式: 16字节帧头 + 负载
+#   帧头: magic(4) version(1) msg_type(1) flags(2) msg_id(4) payload_len(4)，网络字节序
+#   负载: 若干字段，每个字段为 tag(1) length(4) value(length)
+#
+# magic首字节不是ASCII字符，服务器据此与旧协议的 TEXT/FILE/EXIT 标识区分
+import struct
+
+MAGIC = b'\xa5LBM'
+VERSION = 1
+
+HEADER = struct.Struct('!4sBBHII')
+FIELD_HEADER = struct.Struct('!BI')
+LOCATION = struct.Struct('!4I')
+DISTANCE = struct.Struct('!f')
+VERSION_VALUE = struct.Struct('!Q')
+FACE_ID = struct.Struct('!I')
+
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+
+# 消息类型
+MSG_RECORD = 1      # 考勤记录，可附带照片
+MSG_ACK = 2         # 确认
+MSG_EXIT = 3        # 断开连接
+MSG_HELLO = 4       # 连接建立后声明客户端会话，服务器以累计确认回复
+MSG_BATCH = 5       # 批量考勤记录，msg_id为其中最后一条记录的编号
+MSG_RECOGNIZE = 6   # 识别请求（缩小的帧），不参与累计确认，msg_id为客户端的请求编号
+MSG_RESULT = 7      # 识别结果，msg_id与识别请求相同
+MSG_GALLERY_SYNC = 8  # 拉取人脸库增量，不参与累计确认
+MSG_ENROLL = 9      # 开发板注册的人脸上传到服务器人脸库，不参与累计确认
+MSG_GALLERY = 10    # 人脸库增量，回复MSG_GALLERY_SYNC和MSG_ENROLL，msg_id与请求相同
+
+# 字段类型
+FIELD_TEXT = 1
+FIELD_FILENAME = 2
+FIELD_FILEDATA = 3
+FIELD_STATUS = 4
+FIELD_SESSION = 5
+FIELD_RECORD = 6    # 批量消息中的一条记录，值为encode_record的结果
+FIELD_IMAGE = 7     # 识别请求的图像（JPEG）
+FIELD_LOCATION = 8  # 人脸位置 top,right,bottom,left（图像坐标）
+FIELD_MATCH = 9     # 识别结果中的一张人脸，值为嵌套字段
+FIELD_NAME = 10
+FIELD_DISTANCE = 11
+FIELD_VERSION = 12  # 人脸库版本号
+FIELD_LATEST = 13   # 服务器人脸库的最新版本号
+FIELD_FACE = 14     # 人脸库增量中的一张人脸，值为嵌套字段
+FIELD_FACE_ID = 15
+FIELD_ENCODING = 16  # 人脸特征，128维float64（小端）
+
+# 确认状态
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_UNSUPPORTED = 2
+
+
+class ProtocolError(Exception):
+    """帧格式错误"""
+    pass
+
+
+def pack_header(msg_type, msg_id, payload_len, flags=0):
+    """打包帧头"""
+    return HEADER.pack(MAGIC, VERSION, msg_type, flags, msg_id, payload_len)
+
+
+def unpack_header(data):
+    """
+    解析帧头
+
+    Returns:
+        tuple: (version, msg_type, flags, msg_id, payload_len)
+    """
+    if len(data) != HEADER.size:
+        raise ProtocolError(f"帧头长度错误: {len(data)}")
+
+    magic, version, msg_type, flags, msg_id, payload_len = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError("帧头标识错误")
+    if version > VERSION:
+        raise ProtocolError(f"不支持的协议版本: {version}")
+    if payload_len > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"负载过大: {payload_len}")
+    return version, msg_type, flags, msg_id, payload_len
+
+
+def pack_frame(msg_type, msg_id, payload=b'', flags=0):
+    """打包完整的帧"""
+    return pack_header(msg_type, msg_id, len(payload), flags) + payload
+
+
+def encode_fields(fields):
+    """将 [(tag, bytes), ...] 编码为负载"""
+    parts = []
+    for tag, value in fields:
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        parts.append(FIELD_HEADER.pack(tag, len(value)))
+        parts.append(value)
+    return b''.join(parts)
+
+
+def decode_fields(payload):
+    """将负载解码为 [(tag, bytes), ...]，保留重复字段"""
+    fields = []
+    view = memoryview(payload)
+    offset = 0
+    while offset < len(view):
+        if offset + FIELD_HEADER.size > len(view):
+            raise ProtocolError("字段头不完整")
+        tag, length = FIELD_HEADER.unpack_from(view, offset)
+        offset += FIELD_HEADER.size
+        if offset + length > len(view):
+            raise ProtocolError("字段数据不完整")
+        fields.append((tag, bytes(view[offset:offset + length])))
+        offset += length
+    return fields
+
+
+def get_field(fields, tag, default=None):
+    """取第一个指定类型的字段"""
+    for field_tag, value in fields:
+        if field_tag == tag:
+            return value
+    return default
+
+
+def encode_record(text, filename=None, file_data=None):
+    """编码考勤记录负载"""
+    fields = [(FIELD_TEXT, text)]
+    if filename and file_data is not None:
+        fields.append((FIELD_FILENAME, filename))
+        fields.append((FIELD_FILEDATA, file_data))
+    return encode_fields(fields)
+
+
+def decode_record(payload):
+    """
+    解码考勤记录负载
+
+    Returns:
+        tuple: (text, filename, file_data)，无照片时后两项为None
+    """
+    fields = decode_fields(payload)
+    text = get_field(fields, FIELD_TEXT)
+    if text is None:
+        raise ProtocolError("考勤记录缺少文本字段")
+    filename = get_field(fields, FIELD_FILENAME)
+    file_data = get_field(fields, FIELD_FILEDATA)
+    return (text.decode('utf-8'),
+            filename.decode('utf-8') if filename is not None else None,
+            file_data)
+
+
+def encode_batch(record_payloads):
+    """将多条已编码的记录负载打包为批量负载"""
+    return encode_fields([(FIELD_RECORD, payload) for payload in record_payloads])
+
+
+def decode_batch(payload):
+    """
+    解码批量负载
+
+    Returns:
+        list: [(text, filename, file_data), ...]
+    """
+    return [decode_record(value) for tag, value in decode_fields(payload) if tag == FIELD_RECORD]
+
+
+def encode_ack(status=STATUS_OK):
+    return encode_fields([(FIELD_STATUS, bytes([status]))])
+
+
+def decode_ack(payload):
+    status = get_field(decode_fields(payload), FIELD_STATUS, bytes([STATUS_OK]))
+    return status[0]
+
+
+def encode_hello(session_id):
+    return encode_fields([(FIELD_SESSION, session_id)])
+
+
+def decode_hello(payload):
+    session_id = get_field(decode_fields(payload), FIELD_SESSION)
+    if not session_id:
+        raise ProtocolError("HELLO缺少会话标识")
+    return session_id
+
+
+def encode_recognize(image_data, locations=None):
+    """
+    编码识别请求负载
+
+    Args:
+        image_data: JPEG编码的图像
+        locations: 客户端已检测的人脸位置列表，None表示由服务器检测
+    """
+    fields = [(FIELD_IMAGE, image_data)]
+    for location in locations or ():
+        fields.append((FIELD_LOCATION, LOCATION.pack(*location)))
+    return encode_fields(fields)
+
+
+def decode_recognize(payload):
+    """
+    解码识别请求负载
+
+    Returns:
+        tuple: (image_data, locations)，未附带人脸位置时locations为空列表
+    """
+    fields = decode_fields(payload)
+    image_data = get_field(fields, FIELD_IMAGE)
+    if not image_data:
+        raise ProtocolError("识别请求缺少图像")
+    locations = [LOCATION.unpack(value) for tag, value in fields
+                 if tag == FIELD_LOCATION and len(value) == LOCATION.size]
+    return image_data, locations
+
+
+def encode_result(status, matches=()):
+    """
+    编码识别结果负载
+
+    Args:
+        status: 状态码
+        matches: [(name, distance, location), ...]，未匹配时name为None，人脸库为空时distance为None
+    """
+    fields = [(FIELD_STATUS, bytes([status]))]
+    for name, distance, location in matches:
+        match = [(FIELD_LOCATION, LOCATION.pack(*location))]
+        if name is not None:
+            match.append((FIELD_NAME, name))
+        if distance is not None:
+            match.append((FIELD_DISTANCE, DISTANCE.pack(distance)))
+        fields.append((FIELD_MATCH, encode_fields(match)))
+    return encode_fields(fields)
+
+
+def decode_result(payload):
+    """
+    解码识别结果负载
+
+    Returns:
+        tuple: (status, [(name, distance, location), ...])
+    """
+    fields = decode_fields(payload)
+    status = get_field(fields, FIELD_STATUS, bytes([STATUS_OK]))[0]
+    matches = []
+    for tag, value in fields:
+        if tag != FIELD_MATCH:
+            continue
+        match = decode_fields(value)
+        location = get_field(match, FIELD_LOCATION)
+        if location is None or len(location) != LOCATION.size:
+            raise ProtocolError("识别结果缺少人脸位置")
+        name = get_field(match, FIELD_NAME)
+        distance = get_field(match, FIELD_DISTANCE)
+        matches.append((name.decode('utf-8') if name is not None else None,
+                        DISTANCE.unpack(distance)[0] if distance is not None else None,
+                        LOCATION.unpack(location)))
+    return status, matches
+
+
+def encode_gallery_sync(version):
+    """编码人脸库同步请求，version为开发板已同步到的版本号"""
+    return encode_fields([(FIELD_VERSION, VERSION_VALUE.pack(version))])
+
+
+def decode_gallery_sync(payload):
+    version = get_field(decode_fields(payload), FIELD_VERSION)
+    if version is None or len(version) != VERSION_VALUE.size:
+        raise ProtocolError("同步请求缺少版本号")
+    return VERSION_VALUE.unpack(version)[0]
+
+
+def encode_enroll(version, name, encoding):
+    """
+    编码人脸注册请求
+
+    Args:
+        version: 开发板已同步到的版本号，服务器回复此后的增量（包含本次注册）
+        name: 姓名
+        encoding: 人脸特征字节
+    """
+    return encode_fields([(FIELD_VERSION, VERSION_VALUE.pack(version)),
+                          (FIELD_NAME, name), (FIELD_ENCODING, encoding)])
+
+
+def decode_enroll(payload):
+    """
+    Returns:
+        tuple: (version, name, encoding)
+    """
+    fields = decode_fields(payload)
+    name = get_field(fields, FIELD_NAME)
+    encoding = get_field(fields, FIELD_ENCODING)
+    if not name or not encoding:
+        raise ProtocolError("注册请求缺少姓名或特征")
+    return decode_gallery_sync(payload), name.decode('utf-8'), encoding
+
+
+def encode_gallery(status, reached=0, latest=0, changes=()):
+    """
+    编码人脸库增量
+
+    Args:
+        status: 状态码
+        reached: 应用本次增量后达到的版本号
+        latest: 服务器最新版本号，reached小于它时开发板继续拉取
+        changes: [(face_id, name, encoding), ...]，已删除的人脸encoding为None
+    """
+    fields = [(FIELD_STATUS, bytes([status])),
+              (FIELD_VERSION, VERSION_VALUE.pack(reached)),
+              (FIELD_LATEST, VERSION_VALUE.pack(latest))]
+    for face_id, name, encoding in changes:
+        face = [(FIELD_FACE_ID, FACE_ID.pack(face_id)), (FIELD_NAME, name)]
+        if encoding is not None:
+            face.append((FIELD_ENCODING, encoding))
+        fields.append((FIELD_FACE, encode_fields(face)))
+    return encode_fields(fields)
+
+
+def decode_gallery(payload):
+    """
+    解码人脸库增量
+
+    Returns:
+        tuple: (status, reached, latest, [(face_id, name, encoding), ...])
+    """
+    fields = decode_fields(payload)
+    status = get_field(fields, FIELD_STATUS, bytes([STATUS_OK]))[0]
+    reached = VERSION_VALUE.unpack(get_field(fields, FIELD_VERSION, bytes(VERSION_VALUE.size)))[0]
+    latest = VERSION_VALUE.unpack(get_field(fields, FIELD_LATEST, bytes(VERSION_VALUE.size)))[0]
+    changes = []
+    for tag, value in fields:
+        if tag != FIELD_FACE:
+            continue
+        face = decode_fields(value)
+        face_id = get_field(face, FIELD_FACE_ID)
+        name = get_field(face, FIELD_NAME)
+        if face_id is None or len(face_id) != FACE_ID.size or name is None:
+            raise ProtocolError("人脸库增量格式错误")
+        changes.append((FACE_ID.unpack(face_id)[0], name.decode('utf-8'),
+                        get_field(face, FIELD_ENCODING)))
+    return status, reached, latest, changes
+
+
+def recv_exact(sock, size):
+    """从socket读取恰好size字节，连接关闭返回None"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            return None
+        received += count
+    return bytes(buffer)
\ No newline at end of file
@@ -0,0 +1,99 @@
+# recognition.py
+# 服务器端识别: 开发板只上传缩小的帧（可附带已检测的人脸位置），
+# 特征提取和人脸库匹配在服务器的进程池中进行，结果通过同一连接返回
+import io
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from gallery import GalleryStore
+
+# 以下在工作进程中由 _init_worker 设置
+face_recognition = None
+np = None
+_gallery_store = None
+_gallery = {'version': None, 'encodings': None, 'names': []}
+
+
+def models_available():
+    """服务器是否安装了face_recognition（识别依赖dlib模型，未安装时不启用服务器识别）"""
+    return importlib.util.find_spec('face_recognition') is not None
+
+
+def _init_worker(gallery_path):
+    """工作进程初始化: 加载模型并打开人脸库，人脸数据在首次识别时加载"""
+    global face_recognition, np, _gallery_store
+    import face_recognition as face_module
+    import numpy as numpy_module
+    face_recognition = face_module
+    np = numpy_module
+    _gallery_store = GalleryStore(gallery_path)
+
+
+def _load_gallery():
+    """人脸库版本号变化（注册或删除）后重新加载"""
+    if _gallery_store.version() != _gallery['version']:
+        version, faces = _gallery_store.snapshot()
+        encodings = [np.frombuffer(encoding, dtype='<f8') for _, _, encoding in faces]
+        _gallery.update(version=version, names=[name for _, name, _ in faces],
+                        encodings=np.array(encodings) if encodings else None)
+    return _gallery
+
+
+def _recognize(image_data, locations, tolerance):
+    """
+    在工作进程中识别一张图像
+
+    Returns:
+        list: [(name, distance, location), ...]，未匹配时name为None，人脸库为空时distance为None
+    """
+    image = face_recognition.load_image_file(io.BytesIO(image_data))
+    if not locations:
+        locations = face_recognition.face_locations(image)
+    encodings = face_recognition.face_encodings(image, locations)
+
+    gallery = _load_gallery()
+    matches = []
+    for location, encoding in zip(locations, encodings):
+        location = tuple(int(v) for v in location)
+        if gallery['encodings'] is None:
+            matches.append((None, None, location))
+            continue
+        distances = face_recognition.face_distance(gallery['encodings'], encoding)
+        best_match_index = int(np.argmin(distances))
+        distance = float(distances[best_match_index])
+        name = gallery['names'][best_match_index] if distance < tolerance else None
+        matches.append((name, distance, location))
+    return matches
+
+
+class RecognitionService:
+    """识别进程池，submit可在任意线程中调用"""
+
+    def __init__(self, gallery_path, workers=2, tolerance=0.6):
+        """
+        Args:
+            gallery_path: 人脸库数据库路径，版本号变化后工作进程自动重新加载
+            workers: 工作进程数
+            tolerance: 匹配阈值，与开发板本地识别相同
+        """
+        self.gallery_path = gallery_path
+        self.workers = workers
+        self.tolerance = tolerance
+        # 服务器进程中有多个线程，使用spawn启动工作进程，避免fork时复制锁的状态
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(gallery_path,))
+
+    def submit(self, image_data, locations=None):
+        """
+        提交识别任务
+
+        Returns:
+            Future: 结果为 [(name, distance, location), ...]
+        """
+        return self.executor.submit(_recognize, image_data, locations or [], self.tolerance)
+
+    def close(self):
+        """停止进程池，等待进行中的识别完成"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
\ No newline at end of file
@@ -0,0 +1,57 @@
+# session_images.py
+import threading
+from collections import OrderedDict
+
+
+class SessionImageStore:
+    """
+    当前会话照片的有界存储
+
+    以记录的唯一标识为键，只在内存中保留最近的照片（按字节数限制）。
+    被淘汰的照片不在这里保留任何信息，界面按记录中的照片路径显示磁盘缩略图。
+    写盘线程写入，界面线程读取。
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.images = OrderedDict()  # record_id -> 照片数据
+        self.total_bytes = 0
+
+    def put(self, record_id, image_data):
+        """
+        添加一张照片
+
+        Args:
+            record_id: 记录唯一标识
+            image_data: 照片数据，None表示只有文件（如流式写入磁盘的照片），不保存
+        """
+        with self.lock:
+            old = self.images.pop(record_id, None)
+            if old is not None:
+                self.total_bytes -= len(old)
+            if image_data is None or len(image_data) > self.max_bytes:
+                return
+            self.images[record_id] = image_data
+            self.total_bytes += len(image_data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.images.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def get(self, record_id):
+        """
+        获取内存中的照片数据，不读取文件
+
+        Returns:
+            bytes: 照片数据，已被淘汰或没有该记录的照片返回None
+        """
+        with self.lock:
+            image_data = self.images.get(record_id)
+            if image_data is not None:
+                self.images.move_to_end(record_id)
+            return image_data
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.total_bytes = 0
\ No newline at end of file
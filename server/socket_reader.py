@@ -0,0 +1,118 @@
+# socket_reader.py
+import socket
+
+
+class SocketReader:
+    """
+    带缓冲的socket读取器
+
+    小的帧头从内部缓冲区按精确长度读取，避免recv(4)/recv(256)返回不足；
+    大的负载通过memoryview + recv_into直接写入bytearray，避免反复拼接；
+    文件负载经内部缓冲区分块写入文件，占用的内存不超过缓冲区大小。
+    """
+
+    def __init__(self, sock, buffer_size=256 * 1024, rcvbuf_size=1024 * 1024):
+        self.sock = sock
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+        if rcvbuf_size:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf_size)
+            except OSError:
+                pass
+
+    def buffered(self):
+        """缓冲区中尚未读取的字节数"""
+        return self.end - self.start
+
+    def _fill(self):
+        """向缓冲区读入更多数据，连接关闭返回False"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            # 剩余数据移到缓冲区开头
+            remaining = self.end - self.start
+            self.buffer[:remaining] = self.view[self.start:self.end]
+            self.start, self.end = 0, remaining
+
+        count = self.sock.recv_into(self.view[self.end:])
+        if not count:
+            return False
+        self.end += count
+        return True
+
+    def read_exact(self, size):
+        """
+        读取恰好size字节（用于帧头等小数据）
+
+        Returns:
+            bytes: 数据，连接在读满前关闭返回None
+        """
+        if size > len(self.buffer):
+            data = self.read_into(size)
+            return bytes(data) if data is not None else None
+
+        while self.end - self.start < size:
+            if not self._fill():
+                return None
+        data = bytes(self.view[self.start:self.start + size])
+        self.start += size
+        return data
+
+    def read_into(self, size):
+        """
+        读取size字节到bytearray中（用于大负载）
+
+        不按声明的长度一次分配: 目标内存随已到达的数据倍增，
+        声明很大但不发送数据的连接只占用内部缓冲区大小的内存。
+
+        Returns:
+            bytearray: 数据，连接在读满前关闭返回None
+        """
+        data = bytearray(min(size, len(self.buffer)))
+
+        # 先取出缓冲区中已有的数据
+        received = min(size, self.end - self.start)
+        if received:
+            data[:received] = self.view[self.start:self.start + received]
+            self.start += received
+
+        # 剩余部分直接由内核写入目标内存
+        while received < size:
+            if received == len(data):
+                data.extend(bytes(min(len(data), size - len(data))))
+            with memoryview(data) as target:
+                count = self.sock.recv_into(target[received:], len(data) - received)
+            if not count:
+                return None
+            received += count
+        return data
+
+    def read_to_file(self, size, file):
+        """
+        读取size字节并分块写入文件，只使用内部缓冲区
+
+        Returns:
+            bool: 读满返回True，连接在读满前关闭返回False
+        """
+        remaining = size
+        buffered = min(remaining, self.end - self.start)
+        if buffered:
+            file.write(self.view[self.start:self.start + buffered])
+            self.start += buffered
+            remaining -= buffered
+        if not remaining:
+            return True
+
+        # 缓冲区已读空，直接作为分块缓冲使用
+        self.start = self.end = 0
+        while remaining:
+            count = self.sock.recv_into(self.view, min(remaining, len(self.buffer)))
+            if not count:
+                return False
+            file.write(self.view[:count])
+            remaining -= count
+        return True
\ No newline at end of file
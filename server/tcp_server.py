@@ -1,12 +1,43 @@
 import socket
 import threading
+import select
 import os
 import time
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime
 import json
+import protocol
+from socket_reader import SocketReader
+from group_commit import GroupCommitWriter
+from attendance_store import AttendanceStore
+from session_images import SessionImageStore
+from metrics import Registry, MetricsServer
+from recognition import RecognitionService, models_available
+from gallery import GalleryStore
+
+# 指标中使用的帧消息类型名称
+FRAME_TYPE_NAMES = {
+    protocol.MSG_RECORD: 'record',
+    protocol.MSG_BATCH: 'batch',
+    protocol.MSG_HELLO: 'hello',
+    protocol.MSG_EXIT: 'exit',
+    protocol.MSG_RECOGNIZE: 'recognize',
+    protocol.MSG_GALLERY_SYNC: 'gallery_sync',
+    protocol.MSG_ENROLL: 'enroll',
+}
+
+# 请求-应答类消息: 不参与累计确认，每个请求回复一帧（msg_id与请求相同）
+GALLERY_REQUEST_TYPES = (protocol.MSG_GALLERY_SYNC, protocol.MSG_ENROLL)
+
+# 旧协议文本的最大长度，长度字段异常时直接断开，不按声明的长度分配内存
+MAX_TEXT_SIZE = 64 * 1024
 
 class TCPServerModule:
-    def __init__(self, host='192.168.137.96', port=8888, data_dir="received_data"):
+    def __init__(self, host='192.168.137.96', port=8888, data_dir="received_data",
+                 max_file_size=32 * 1024 * 1024, connection_buffer_size=256 * 1024,
+                 max_frame_size=8 * 1024 * 1024):
         """
         初始化TCP服务器模块
         
@@ -14,36 +45,260 @@ class TCPServerModule:
             host: 服务器IP地址
             port: 服务器端口
             data_dir: 数据存储目录
+            max_file_size: 旧协议FILE允许的最大文件大小，超过时回复FILE_ERROR并断开
+            connection_buffer_size: 每个连接的接收缓冲区大小，FILE数据经它分块写入临时文件
+            max_frame_size: 二进制帧允许的最大负载，超过时回复错误并断开，不读取负载
         """
         self.host = host
         self.port = port
         self.data_dir = data_dir
+        self.incoming_dir = os.path.join(data_dir, "incoming")
+        self.max_file_size = max_file_size
+        self.connection_buffer_size = connection_buffer_size
+        self.max_frame_size = max_frame_size
         self.socket = None
         self.running = False
+        self.accepting = False
         self.server_thread = None
         self.clients = []
         
+        # 帧协议会话: session_id -> 已处理的最大消息编号，用于重连后的累计确认与去重；
+        # 服务器重启后该表为空，重发的消息由记录的source（会话+消息编号）在入库时去重
+        self.sessions = OrderedDict()
+        self.sessions_lock = threading.Lock()
+        self.max_sessions = 1024
+        
         # 回调函数
         self.on_text_received = None
         self.on_file_received = None
         self.on_client_connected = None
         self.on_client_disconnected = None
+        self.on_photo_saved = None
+        self.on_record_saved = None
         
         # 创建数据存储目录
         self._ensure_data_directories()
+        
+        # 考勤记录数据库，只由写盘线程写入
+        self.store = AttendanceStore(os.path.join(self.data_dir, "attendance.db"))
+        # 当前会话照片: 只在界面调用enable_session_images后保存，内存中只保留最近的一部分
+        self.session_images = None
+        # 权威人脸库，开发板按版本号拉取增量，注册的人脸上传到这里
+        self.gallery = GalleryStore(os.path.join(self.data_dir, "gallery.db"))
+        
+        # 运行指标，由 start_metrics 启动的本地HTTP服务以Prometheus文本格式提供
+        self.metrics = Registry()
+        self.metrics_server = None
+        self._init_metrics()
+        
+        # 服务器端识别进程池，由 enable_recognition 启动
+        self.recognizer = None
+        
+        # 写盘线程: 消息进入WAL并fsync后即可确认，随后再批量写入数据库并保存照片
+        self.writer = GroupCommitWriter(os.path.join(self.data_dir, "wal"), self._apply_entries,
+                                        metrics=self.metrics)
+    
+    def _init_metrics(self):
+        """注册接收路径上的计数器和延迟直方图"""
+        self.messages_received = self.metrics.counter(
+            'attendance_messages_received_total', '收到的消息数', labels=('type',))
+        self.records_received = self.metrics.counter(
+            'attendance_records_received_total', '收到的考勤记录数（批量消息按条计）')
+        self.bytes_received = self.metrics.counter(
+            'attendance_bytes_received_total', '收到的消息数据字节数')
+        self.ack_latency = self.metrics.histogram(
+            'attendance_ack_latency_seconds', '消息接收完成到发送确认的耗时', labels=('protocol',))
+        self.client_errors = self.metrics.counter(
+            'attendance_client_errors_total', '各客户端的错误数', labels=('client', 'kind'))
+        self.connections_total = self.metrics.counter(
+            'attendance_connections_total', '累计客户端连接数')
+        self.metrics.gauge('attendance_connected_clients', '当前连接的客户端数',
+                           func=lambda: len(self.clients))
+        self.metrics.gauge('attendance_threads', '服务器进程的线程数', func=threading.active_count)
+        self.recognition_latency = self.metrics.histogram(
+            'attendance_recognition_seconds', '识别请求接收完成到回复结果的耗时')
+        self.recognition_requests = self.metrics.counter(
+            'attendance_recognition_requests_total', '识别请求数', labels=('result',))
+        self.metrics.gauge('attendance_gallery_version', '服务器人脸库版本号',
+                           func=lambda: self.gallery.version())
+    
+    def start_metrics(self, port=9108, host='127.0.0.1', snapshot_path=None, snapshot_interval=60):
+        """
+        启动指标HTTP服务（GET /metrics），可选地定期写入快照文件
+        
+        Args:
+            port: 监听端口，0表示自动分配
+            host: 监听地址，默认只允许本机访问
+            snapshot_path: 快照文件路径，None表示不写快照
+            snapshot_interval: 快照间隔（秒）
+            
+        Returns:
+            bool: 启动成功返回True，失败返回False
+        """
+        if self.metrics_server:
+            return True
+        try:
+            self.metrics_server = MetricsServer(self.metrics, host, port, snapshot_path, snapshot_interval)
+            self.metrics_server.start()
+            return True
+        except Exception as e:
+            print(f"启动指标服务失败: {e}")
+            self.metrics_server = None
+            return False
+    
+    def stop_metrics(self):
+        """停止指标服务（写快照时会写入最后一次）"""
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+    
+    def enable_recognition(self, workers=2, gallery_path=None, tolerance=0.6):
+        """
+        启用服务器端识别: 开发板上传缩小的帧，在进程池中提取特征并匹配人脸库
+        
+        Args:
+            workers: 识别进程数
+            gallery_path: 人脸库数据库，默认为服务器的权威人脸库 数据目录/gallery.db
+            tolerance: 匹配阈值
+            
+        Returns:
+            bool: 启用成功返回True；未安装face_recognition时返回False，开发板退回本地识别
+        """
+        if self.recognizer:
+            return True
+        if not models_available():
+            print("未安装face_recognition，不启用服务器端识别")
+            return False
+        gallery_path = gallery_path or self.gallery.db_path
+        self.recognizer = RecognitionService(gallery_path, workers, tolerance)
+        print(f"服务器端识别已启用 ({workers} 个进程，人脸库 {gallery_path})")
+        return True
+    
+    def stop_recognition(self):
+        """停止识别进程池"""
+        if self.recognizer:
+            self.recognizer.close()
+            self.recognizer = None
+    
+    def enable_session_images(self, max_bytes=32 * 1024 * 1024):
+        """
+        保存当前会话照片供界面显示（守护进程和压测不需要，不启用时不占用内存）
+        
+        Returns:
+            SessionImageStore: 照片存储，写盘线程写入，界面线程读取
+        """
+        if self.session_images is None:
+            self.session_images = SessionImageStore(max_bytes)
+        return self.session_images
+    
+    def _recognize_frame(self, payload, client_address):
+        """
+        处理识别请求，提交进程池后立即返回，不等待识别完成
+        
+        Returns:
+            Future或int: 识别任务的Future，未启用或请求错误时返回状态码
+        """
+        self.messages_received.inc('recognize')
+        self.bytes_received.inc(amount=protocol.HEADER.size + len(payload))
+        if self.recognizer is None:
+            return protocol.STATUS_UNSUPPORTED
+        try:
+            image_data, locations = protocol.decode_recognize(payload)
+        except protocol.ProtocolError as e:
+            print(f"客户端 {client_address} 识别请求格式错误: {e}")
+            return protocol.STATUS_ERROR
+        return self.recognizer.submit(image_data, locations)
+    
+    def _result_frame(self, msg_id, result, received_at):
+        """等待识别完成并打包结果帧"""
+        matches = []
+        if isinstance(result, Future):
+            try:
+                matches = result.result()
+                status = protocol.STATUS_OK
+            except Exception as e:
+                print(f"识别失败: {e}")
+                status = protocol.STATUS_ERROR
+        else:
+            status = result
+        
+        if status != protocol.STATUS_OK:
+            outcome = 'unsupported' if status == protocol.STATUS_UNSUPPORTED else 'error'
+        elif any(name is not None for name, _, _ in matches):
+            outcome = 'match'
+        else:
+            outcome = 'unknown'
+        self.recognition_requests.inc(outcome)
+        self.recognition_latency.observe(time.perf_counter() - received_at)
+        return protocol.pack_frame(protocol.MSG_RESULT, msg_id, protocol.encode_result(status, matches))
+    
+    def _gallery_frame(self, msg_type, msg_id, payload, client_address):
+        """
+        处理人脸库同步或注册请求
+        
+        注册后回复的增量包含本次注册的人脸（带服务器分配的face_id），
+        开发板用它替换本地待上传的条目。
+        
+        Returns:
+            bytes: MSG_GALLERY回复帧
+        """
+        self.messages_received.inc(FRAME_TYPE_NAMES[msg_type])
+        self.bytes_received.inc(amount=protocol.HEADER.size + len(payload))
+        try:
+            if msg_type == protocol.MSG_ENROLL:
+                version, name, encoding = protocol.decode_enroll(payload)
+                face_id, _ = self.gallery.enroll(name, encoding)
+                print(f"客户端 {client_address} 注册人脸: {name} (face_id {face_id})")
+            else:
+                version = protocol.decode_gallery_sync(payload)
+            reached, latest, changes = self.gallery.changes_since(version)
+            reply = protocol.encode_gallery(protocol.STATUS_OK, reached, latest, changes)
+        except Exception as e:
+            print(f"处理客户端 {client_address} 的人脸库请求时出错: {e}")
+            self.client_errors.inc(client_address[0], 'exception')
+            reply = protocol.encode_gallery(protocol.STATUS_ERROR)
+        return protocol.pack_frame(protocol.MSG_GALLERY, msg_id, reply)
+    
+    def _oversize_frame(self, msg_type, msg_id, payload_len, client_address):
+        """
+        帧负载超过上限时的错误回复，按声明的长度判断，负载不读取，回复后断开
+        
+        Returns:
+            bytes: 与请求类型对应的回复帧（状态为STATUS_ERROR）
+        """
+        print(f"拒绝客户端 {client_address} 的帧: 负载 {payload_len} 字节超过上限 {self.max_frame_size} 字节")
+        self.client_errors.inc(client_address[0], 'oversize')
+        if msg_type == protocol.MSG_RECOGNIZE:
+            return protocol.pack_frame(protocol.MSG_RESULT, msg_id, protocol.encode_result(protocol.STATUS_ERROR))
+        if msg_type in GALLERY_REQUEST_TYPES:
+            return protocol.pack_frame(protocol.MSG_GALLERY, msg_id, protocol.encode_gallery(protocol.STATUS_ERROR))
+        return protocol.pack_frame(protocol.MSG_ACK, msg_id, protocol.encode_ack(protocol.STATUS_ERROR))
+    
+    def _observe_ack(self, client_address, protocol_name, status, received_at):
+        """记录确认延迟，失败的确认计入该客户端的错误数"""
+        self.ack_latency.observe(time.perf_counter() - received_at, protocol_name)
+        if status != protocol.STATUS_OK:
+            self.client_errors.inc(client_address[0], 'rejected')
     
     def _ensure_data_directories(self):
         """确保数据存储目录存在"""
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
         
-        text_dir = os.path.join(self.data_dir, "texts")
         image_dir = os.path.join(self.data_dir, "images")
         other_dir = os.path.join(self.data_dir, "other_files")
         
-        for directory in [text_dir, image_dir, other_dir]:
+        for directory in [image_dir, other_dir, self.incoming_dir]:
             if not os.path.exists(directory):
                 os.makedirs(directory)
+        
+        # 上次接收中断留下的临时文件（未确认，客户端会重发）
+        for name in os.listdir(self.incoming_dir):
+            if name.endswith(".part"):
+                try:
+                    os.remove(os.path.join(self.incoming_dir, name))
+                except OSError:
+                    pass
     
     def start_server(self):
         """
@@ -57,12 +312,15 @@ class TCPServerModule:
             return True
         
         try:
+            self.writer.start()
+            
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.socket.bind((self.host, self.port))
             self.socket.listen(5)
             self.socket.settimeout(1)  # 设置超时以便可以检查运行状态
             self.running = True
+            self.accepting = True
             
             # 启动服务器线程
             self.server_thread = threading.Thread(target=self._server_loop)
@@ -79,9 +337,10 @@ class TCPServerModule:
     
     def _server_loop(self):
         """服务器主循环"""
-        while self.running:
+        while self.running and self.accepting:
             try:
                 client_socket, client_address = self.socket.accept()
+                self.connections_total.inc()
                 
                 # 触发客户端连接回调
                 if self.on_client_connected:
@@ -110,20 +369,32 @@ class TCPServerModule:
     
     def _handle_client(self, client_socket, client_address):
         """处理客户端连接"""
+        # 帧协议连接状态: 会话标识、待发送的累计确认，以及该连接上是否有消息持久化失败
+        conn_state = {'session_id': None, 'ack_id': None, 'pending': [], 'failed': False}
+        reader = SocketReader(client_socket, self.connection_buffer_size)
         try:
             while self.running:
                 # 接收数据类型标识
-                data_type = client_socket.recv(4)
+                data_type = reader.read_exact(4)
                 if not data_type:
                     break
                 
+                # 二进制帧协议
+                if data_type == protocol.MAGIC:
+                    if not self._receive_frame(reader, client_address, conn_state):
+                        break
+                    continue
+                
+                # 旧协议: ASCII类型标识
                 data_type = data_type.decode('utf-8').strip()
                 
                 if data_type == 'TEXT':
-                    self._receive_text(client_socket, client_address)
+                    if not self._receive_text(reader, client_address):
+                        break
                     
                 elif data_type == 'FILE':
-                    self._receive_file(client_socket, client_address)
+                    if not self._receive_file(reader, client_address):
+                        break
 
                 elif data_type == 'EXIT':
                     print(f"客户端 {client_address} 断开连接")
@@ -131,6 +402,7 @@ class TCPServerModule:
                     
         except Exception as e:
             print(f"处理客户端 {client_address} 时出错: {e}")
+            self.client_errors.inc(client_address[0], 'exception')
         finally:
             # 清理客户端信息
             self._remove_client(client_socket)
@@ -144,110 +416,546 @@ class TCPServerModule:
         """移除客户端"""
         self.clients = [client for client in self.clients if client['socket'] != client_socket]
     
-    def _receive_text(self, client_socket, client_address):
-        """接收文本数据"""
+    def _receive_frame(self, reader, client_address, conn_state):
+        """
+        接收一个二进制帧（帧头标识已读取）
+        
+        客户端可连续发送多帧而不等待确认，服务器在接收缓冲区读空时
+        才回复一个累计确认（编号为已处理的最大消息编号），失败的消息立即确认。
+        
+        Returns:
+            bool: 连接应继续返回True，需要断开返回False
+        """
         try:
-            # 接收数据长度
-            length_data = client_socket.recv(8)
-            if not length_data:
-                return
+            header = reader.read_exact(protocol.HEADER.size - len(protocol.MAGIC))
+            if header is None:
+                return False
+            _, msg_type, _, msg_id, payload_len = protocol.unpack_header(protocol.MAGIC + header)
             
-            data_length = int(length_data.decode('utf-8').strip())
+            if payload_len > self.max_frame_size:
+                self._send_pending_ack(reader.sock, conn_state, client_address)
+                reader.sock.sendall(self._oversize_frame(msg_type, msg_id, payload_len, client_address))
+                return False
             
-            # 接收实际数据
-            received_data = b''
-            while len(received_data) < data_length:
-                chunk = client_socket.recv(min(4096, data_length - len(received_data)))
-                if not chunk:
-                    break
-                received_data += chunk
+            payload = reader.read_into(payload_len) if payload_len else b''
+            if payload is None:
+                return False
+            received_at = time.perf_counter()
             
-            text_data = received_data.decode('utf-8')
+            if msg_type == protocol.MSG_RECOGNIZE:
+                # 识别请求不参与累计确认: 先发出已有的确认，再回复识别结果
+                self._send_pending_ack(reader.sock, conn_state, client_address)
+                result = self._recognize_frame(payload, client_address)
+                reader.sock.sendall(self._result_frame(msg_id, result, received_at))
+                return True
+            
+            if msg_type in GALLERY_REQUEST_TYPES:
+                self._send_pending_ack(reader.sock, conn_state, client_address)
+                reader.sock.sendall(self._gallery_frame(msg_type, msg_id, payload, client_address))
+                return True
+            
+            ack_id, status, immediate = self._dispatch_frame(
+                msg_type, msg_id, payload, client_address, conn_state)
+            if ack_id is None:
+                return False
+            
+            # status可能是写入器返回的Future，发送确认前再等待其完成
+            conn_state['ack_id'] = ack_id
+            conn_state['pending'].append((msg_id, status, received_at))
+            if immediate or not self._has_pending_data(reader):
+                self._send_pending_ack(reader.sock, conn_state, client_address)
+            return True
+            
+        except protocol.ProtocolError as e:
+            # 帧边界已无法确定，只能断开
+            print(f"客户端 {client_address} 帧格式错误: {e}")
+            self.client_errors.inc(client_address[0], 'protocol')
+            return False
+    
+    def _dispatch_frame(self, msg_type, msg_id, payload, client_address, conn_state):
+        """
+        处理一个完整的帧，与具体的网络读写方式无关
+        
+        Returns:
+            tuple: (ack_id, status, immediate)
+                ack_id为None表示连接应断开；immediate表示确认需要立即发送
+        """
+        self.messages_received.inc(FRAME_TYPE_NAMES.get(msg_type, 'unknown'))
+        self.bytes_received.inc(amount=protocol.HEADER.size + len(payload))
+        
+        if msg_type == protocol.MSG_EXIT:
+            print(f"客户端 {client_address} 断开连接")
+            return None, None, False
+        
+        if msg_type == protocol.MSG_HELLO:
+            # 回复该会话已处理到的消息编号，客户端只重发其后的消息
+            session_id = protocol.decode_hello(payload)
+            conn_state['session_id'] = session_id
+            conn_state['failed'] = False
+            return self._get_session_last_id(session_id), protocol.STATUS_OK, True
+        
+        session_id = conn_state['session_id']
+        if session_id is not None and msg_id <= self._get_session_last_id(session_id):
+            # 重连后重发的已处理消息，只确认不重复入库
+            status = protocol.STATUS_OK
+        elif msg_type == protocol.MSG_RECORD:
+            status = self._handle_record(payload, client_address, self._delivery(session_id, msg_id))
+        elif msg_type == protocol.MSG_BATCH:
+            status = self._handle_batch(payload, client_address, self._delivery(session_id, msg_id))
+        else:
+            print(f"未知的消息类型 {msg_type} 来自 {client_address}")
+            status = protocol.STATUS_UNSUPPORTED
+        
+        # 写入器返回的Future在发送确认前等待，解析失败等错误立即确认
+        return msg_id, status, not isinstance(status, Future) and status != protocol.STATUS_OK
+    
+    def _has_pending_data(self, reader):
+        """读取缓冲区或socket接收缓冲区中是否还有未读数据"""
+        if reader.buffered():
+            return True
+        readable, _, _ = select.select([reader.sock], [], [], 0)
+        return bool(readable)
+    
+    def _send_pending_ack(self, client_socket, conn_state, client_address):
+        """等待已处理消息持久化后发送累计确认"""
+        if conn_state['ack_id'] is None:
+            return
+        status = protocol.STATUS_OK
+        results = []
+        for msg_id, result, received_at in conn_state['pending']:
+            result_status = self._wait_status(result)
+            self._record_delivery(conn_state, msg_id, result_status)
+            results.append((result_status, received_at))
+            if result_status != protocol.STATUS_OK:
+                status = result_status
+        ack = protocol.pack_frame(protocol.MSG_ACK, conn_state['ack_id'], protocol.encode_ack(status))
+        conn_state['ack_id'] = None
+        conn_state['pending'] = []
+        client_socket.sendall(ack)
+        for result_status, received_at in results:
+            self._observe_ack(client_address, 'frame', result_status, received_at)
+    
+    def _wait_status(self, result):
+        """将处理结果转换为确认状态，写入器的Future需等待其写入WAL"""
+        if isinstance(result, Future):
+            try:
+                result.result()
+                return protocol.STATUS_OK
+            except Exception as e:
+                print(f"消息持久化失败: {e}")
+                return protocol.STATUS_ERROR
+        return result
+    
+    def _record_delivery(self, conn_state, msg_id, status):
+        """
+        消息持久化成功后推进会话已处理的消息编号
+        
+        连接上有消息失败后不再推进（其后的消息可能已先写入），
+        客户端重连后从失败的消息开始重发，失败的消息重新入库，不会被当作已处理而只确认。
+        """
+        session_id = conn_state['session_id']
+        if session_id is None:
+            return
+        if status != protocol.STATUS_OK:
+            conn_state['failed'] = True
+        elif not conn_state['failed']:
+            self._set_session_last_id(session_id, msg_id)
+    
+    def _get_session_last_id(self, session_id):
+        with self.sessions_lock:
+            return self.sessions.get(session_id, 0)
+    
+    def _set_session_last_id(self, session_id, msg_id):
+        with self.sessions_lock:
+            self.sessions[session_id] = max(msg_id, self.sessions.get(session_id, 0))
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+    
+    def _delivery(self, session_id, msg_id):
+        """写入WAL头的会话与消息编号，入库时据此生成source去重；未握手的连接返回None"""
+        if session_id is None:
+            return None
+        return [session_id.hex(), msg_id]
+    
+    def _handle_record(self, payload, client_address, delivery=None):
+        """
+        处理考勤记录消息（文本与照片在同一帧中）
+        
+        Args:
+            delivery: 会话与消息编号 [session_hex, msg_id]，None表示未握手
+        
+        Returns:
+            Future或int: 提交写入器后返回Future，解析失败返回错误状态
+        """
+        try:
+            text_data, filename, file_data = protocol.decode_record(payload)
+            self.records_received.inc()
             
-            # 触发文本接收回调
             if self.on_text_received:
                 self.on_text_received(text_data, client_address)
             
-            # 保存文本
-            self.save_text(text_data, client_address)
+            has_photo = bool(filename) and file_data is not None
             
-            # 发送确认
-            client_socket.send("TEXT_RECEIVED".encode('utf-8'))
+            # 文本和照片使用同一时间戳保存，便于历史记录关联
+            header = {
+                'kind': 'record',
+                'text': text_data,
+                'filename': filename if has_photo else None,
+                'client': list(client_address),
+                'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S"),
+                'delivery': delivery
+            }
+            return self.writer.submit(header, [file_data] if has_photo else [])
             
         except Exception as e:
-            print(f"接收文本数据时出错: {e}")
+            print(f"处理考勤记录时出错: {e}")
+            return protocol.STATUS_ERROR
     
-    def _receive_file(self, client_socket, client_address):
-        """接收文件"""
+    def _handle_batch(self, payload, client_address, delivery=None):
+        """处理批量考勤记录消息，整批作为一条WAL记录提交并统一确认"""
         try:
-            # 1. 接收文件信息头（256字节）
-            # 客户端会先发送文件名和文件大小信息
-            file_info = client_socket.recv(256).decode('utf-8').strip()
+            records = protocol.decode_batch(payload)
+            if not records:
+                return protocol.STATUS_OK
+            self.records_received.inc(amount=len(records))
             
-            # 2. 解析文件信息
-            # 格式为 "文件名|文件大小"，例如 "photo.jpg|1024000"
-            filename, filesize_str = file_info.split('|')
-            filesize = int(filesize_str)  # 将字符串转换为整数
+            header_records = []
+            blobs = []
+            for text_data, filename, file_data in records:
+                has_photo = bool(filename) and file_data is not None
+                if self.on_text_received:
+                    self.on_text_received(text_data, client_address)
+                header_records.append({'text': text_data, 'filename': filename if has_photo else None})
+                if has_photo:
+                    blobs.append(file_data)
             
-            print(f"开始接收文件: {filename}, 大小: {filesize} 字节")
+            header = {
+                'kind': 'batch',
+                'records': header_records,
+                'client': list(client_address),
+                'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S"),
+                'delivery': delivery
+            }
+            print(f"批量接收 {len(records)} 条考勤记录，来自 {client_address}")
+            return self.writer.submit(header, blobs)
             
-            # 3. 接收文件的实际数据
-            received_data = b''  # 创建空字节串来存储文件数据
-            while len(received_data) < filesize:
-                # 每次最多接收4096字节，确保不会超过文件总大小
-                chunk_size = min(4096, filesize - len(received_data))
-                chunk = client_socket.recv(chunk_size)
-                
-                if not chunk:  # 如果没有收到数据，说明连接可能中断
-                    break
-                received_data += chunk  # 将收到的数据块添加到总数据中
+        except Exception as e:
+            print(f"处理批量考勤记录时出错: {e}")
+            return protocol.STATUS_ERROR
+    
+    def _apply_entries(self, entries):
+        """
+        写入器回调: 保存照片并将已写入WAL的记录批量写入数据库
+        
+        照片文件名由WAL序号决定，重放时结果相同；
+        旧协议FILE已在接收时写入磁盘，WAL中只保存其路径。
+        帧协议消息的source由会话和消息编号决定，服务器重启后客户端重发的消息
+        不会重复入库，也不再保存照片；没有会话的消息以WAL序号为source。
+        source同时作为记录的唯一标识，当前会话照片以它为键保存在session_images中。
+        
+        Args:
+            entries: [(seq, header, blobs), ...]
+        """
+        existing = self.store.existing_sources(
+            [self._record_source(seq, header, 0) for seq, header, _ in entries if header.get('delivery')])
+        records = []
+        for seq, header, blobs in entries:
+            client_address = tuple(header['client']) if header.get('client') else None
+            timestamp = header['timestamp']
             
-            # 4. 触发文件接收回调函数
-            if self.on_file_received:
-                self.on_file_received(filename, received_data, client_address)
+            if header['kind'] == 'file':
+                # 旧协议照片单独发送，关联到该客户端最近一条记录
+                if header.get('path'):
+                    filepath = os.path.join(self.data_dir, header['path'])
+                    photo_data = None
+                else:
+                    # 升级前写入WAL的照片数据
+                    photo_data = blobs[0]
+                    filepath = self.save_file(header['filename'], photo_data, client_address,
+                                              f"{timestamp}_{seq:08d}")
+                if filepath and client_address:
+                    self._add_records(records)
+                    records = []
+                    photo_path = os.path.relpath(filepath, self.data_dir)
+                    record = self.store.attach_photo(client_address[0], client_address[1], photo_path)
+                    self._notify_photo_saved(photo_path, header['filename'], client_address)
+                    if record:
+                        if self.session_images is not None and photo_data is not None:
+                            self.session_images.put(record['source'], photo_data)
+                        self._notify_record_saved(record)
+                continue
             
-            # 5. 保存文件到本地磁盘
-            self.save_file(filename, received_data, client_address)
+            if header['kind'] == 'batch':
+                items = [(record['text'], record['filename']) for record in header['records']]
+            else:
+                items = [(header['text'], header.get('filename'))]
             
-            # 6. 向客户端发送确认消息
-            client_socket.send("FILE_RECEIVED".encode('utf-8'))
+            if header.get('delivery'):
+                if self._record_source(seq, header, 0) in existing:
+                    continue
+                existing.add(self._record_source(seq, header, 0))
             
+            photos = iter(blobs)
+            for index, (text_data, filename) in enumerate(items):
+                source = self._record_source(seq, header, index)
+                photo_path = None
+                if filename:
+                    photo_data = next(photos)
+                    filepath = self.save_file(filename, photo_data, client_address,
+                                              f"{timestamp}_{seq:08d}_{index:04d}")
+                    if filepath:
+                        photo_path = os.path.relpath(filepath, self.data_dir)
+                        if self.session_images is not None:
+                            self.session_images.put(source, photo_data)
+                        self._notify_photo_saved(photo_path, filename, client_address)
+                records.append(self._make_record(source, text_data, client_address,
+                                                 timestamp, photo_path))
+        
+        self._add_records(records)
+    
+    def _record_source(self, seq, header, index):
+        """记录的唯一标识: 帧协议消息为 会话:消息编号:序号，其他为 wal:WAL序号:序号"""
+        if header.get('delivery'):
+            session_hex, msg_id = header['delivery']
+            return f"session:{session_hex}:{msg_id}:{index}"
+        return f"wal:{seq}:{index}"
+    
+    def _add_records(self, records):
+        """批量写入数据库后逐条通知"""
+        if not records:
+            return
+        self.store.add_records(records)
+        for record in records:
+            self._notify_record_saved(record)
+    
+    def _notify_photo_saved(self, photo_path, filename, client_address):
+        """通知照片已保存（如生成缩略图），回调出错不影响入库"""
+        try:
+            if self.on_photo_saved:
+                self.on_photo_saved(photo_path)
+            if self.on_file_received:
+                self.on_file_received(filename, os.path.join(self.data_dir, photo_path), client_address)
         except Exception as e:
-            print(f"接收文件时出错: {e}")
-            
-    def save_text(self, text_data, client_address=None):
+            print(f"照片保存回调出错: {e}")
+    
+    def _notify_record_saved(self, record):
+        """通知记录已入库，回调出错不影响入库"""
+        if self.on_record_saved:
+            try:
+                self.on_record_saved(record)
+            except Exception as e:
+                print(f"记录入库回调出错: {e}")
+    
+    def _make_record(self, source, text_data, client_address, timestamp, photo_path):
+        """将 "日期,时间,姓名" 格式的文本转换为数据库记录"""
+        parts = [part.strip() for part in text_data.split(',')]
+        received_at = datetime.strptime(timestamp, "%Y%m%d_%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+        return {
+            'source': source,
+            'received_at': received_at,
+            'date': parts[0] if len(parts) >= 3 else None,
+            'time': parts[1] if len(parts) >= 3 else None,
+            'name': parts[2] if len(parts) >= 3 else None,
+            'client_ip': client_address[0] if client_address else None,
+            'client_port': client_address[1] if client_address else None,
+            'raw_text': text_data,
+            'photo_path': photo_path
+        }
+    
+    def _receive_text(self, reader, client_address):
         """
-        保存文本数据
+        接收文本数据
         
-        Args:
-            text_data: 文本内容
-            client_address: 客户端地址信息
+        Returns:
+            bool: 连接应继续返回True，需要断开返回False
+        """
+        try:
+            # 接收数据长度
+            length_data = reader.read_exact(8)
+            if not length_data:
+                return False
+            
+            data_length = self._parse_text_length(length_data, client_address)
+            if data_length is None:
+                return False
             
+            # 接收实际数据
+            received_data = reader.read_into(data_length)
+            if received_data is None:
+                return False
+            received_at = time.perf_counter()
+            
+            result = self._process_text(received_data.decode('utf-8'), client_address)
+            
+            # 写入WAL后发送确认
+            status = self._wait_status(result)
+            if status == protocol.STATUS_OK:
+                reader.sock.send("TEXT_RECEIVED".encode('utf-8'))
+            else:
+                reader.sock.send("TEXT_ERROR".encode('utf-8'))
+            self._observe_ack(client_address, 'legacy', status, received_at)
+            return True
+            
+        except Exception as e:
+            print(f"接收文本数据时出错: {e}")
+            self.client_errors.inc(client_address[0], 'exception')
+            return False
+    
+    def _receive_file(self, reader, client_address):
+        """
+        接收文件: 数据经连接的接收缓冲区分块写入临时文件，完成后原子重命名
+        
         Returns:
-            str: 保存的文件路径
+            bool: 连接应继续返回True，需要断开返回False
         """
+        temp_file = temp_path = None
         try:
+            # 1. 接收文件信息头（256字节）
+            # 客户端会先发送文件名和文件大小信息
+            file_info = reader.read_exact(256)
+            if not file_info:
+                return False
+            
+            # 2. 解析并检查文件信息，头部异常时后续数据的边界已无法确定，只能断开
+            file_info = self._check_file_info(file_info, client_address)
+            if file_info is None:
+                reader.sock.send("FILE_ERROR".encode('utf-8'))
+                return False
+            filename, filesize = file_info
+            print(f"开始接收文件: {filename}, 大小: {filesize} 字节")
+            
+            # 3. 接收文件的实际数据，直接写入临时文件
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            client_info = f"_{client_address[0]}_{client_address[1]}" if client_address else ""
-            filename = f"text_{timestamp}{client_info}.txt"
-            filepath = os.path.join(self.data_dir, "texts", filename)
-            
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(f"时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                if client_address:
-                    f.write(f"客户端: {client_address[0]}:{client_address[1]}\n")
-                f.write(f"数据长度: {len(text_data)}\n")
-                f.write("-" * 50 + "\n")
-                f.write(text_data + "\n")
-            
-            print(f"文本数据已保存: {filepath}")
-            return filepath
+            temp_file, temp_path = self._open_incoming(timestamp)
+            if not reader.read_to_file(filesize, temp_file):  # 连接中断
+                return False
+            filepath = self._commit_incoming(temp_file, temp_path, filename, client_address)
+            temp_file = temp_path = None
+            received_at = time.perf_counter()
+            
+            # 4. 触发回调并提交写入器（只提交文件路径）
+            result = self._process_file(filename, filepath, filesize, client_address, timestamp)
+            
+            # 5. 写入WAL后向客户端发送确认消息
+            status = self._wait_status(result)
+            if status == protocol.STATUS_OK:
+                reader.sock.send("FILE_RECEIVED".encode('utf-8'))
+            else:
+                reader.sock.send("FILE_ERROR".encode('utf-8'))
+            self._observe_ack(client_address, 'legacy', status, received_at)
+            return True
             
         except Exception as e:
-            print(f"保存文本数据时出错: {e}")
+            print(f"接收文件时出错: {e}")
+            self.client_errors.inc(client_address[0], 'exception')
+            return False
+        finally:
+            if temp_path:
+                self._discard_incoming(temp_file, temp_path)
+    
+    def _parse_file_info(self, file_info):
+        """解析旧协议的文件信息头，格式为 "文件名|文件大小"，例如 "photo.jpg|1024000" """
+        filename, filesize_str = file_info.decode('utf-8').strip().split('|')
+        return filename, int(filesize_str)
+    
+    def _parse_text_length(self, length_data, client_address):
+        """解析旧协议文本的长度字段，异常或超过上限返回None"""
+        try:
+            data_length = int(length_data.decode('utf-8').strip())
+        except ValueError:
+            data_length = -1
+        if not 0 <= data_length <= MAX_TEXT_SIZE:
+            print(f"客户端 {client_address} 文本长度异常: {length_data!r}")
+            self.client_errors.inc(client_address[0], 'malformed')
             return None
+        return data_length
+    
+    def _check_file_info(self, file_info, client_address):
+        """
+        解析并检查文件信息头，不信任客户端声明的大小
+        
+        Returns:
+            tuple: (文件名, 文件大小)，头部格式错误或大小超过上限返回None
+        """
+        try:
+            filename, filesize = self._parse_file_info(file_info)
+        except (ValueError, UnicodeDecodeError):
+            print(f"客户端 {client_address} 文件信息头格式错误")
+            self.client_errors.inc(client_address[0], 'malformed')
+            return None
+        if not 0 <= filesize <= self.max_file_size:
+            print(f"拒绝文件 {filename}: 大小 {filesize} 字节超过上限 {self.max_file_size} 字节")
+            self.client_errors.inc(client_address[0], 'oversize')
+            return None
+        return filename, filesize
+    
+    def _open_incoming(self, timestamp):
+        """
+        在incoming目录创建接收用的临时文件
+        
+        Returns:
+            tuple: (文件对象, 临时文件路径)
+        """
+        fd, temp_path = tempfile.mkstemp(prefix=f"{timestamp}_", suffix=".part", dir=self.incoming_dir)
+        return os.fdopen(fd, 'wb'), temp_path
+    
+    def _commit_incoming(self, temp_file, temp_path, filename, client_address):
+        """
+        临时文件写完后原子重命名到正式目录
+        
+        不单独fsync: 与帧协议的照片相同，由写入器截断WAL前的统一同步保证落盘，
+        每个文件两次fsync会使小文件的接收速度下降两个数量级。
+        
+        Returns:
+            str: 正式文件路径
+        """
+        temp_file.close()
+        # 临时文件名（时间戳_随机串）作为前缀，保证正式文件名唯一
+        prefix = os.path.basename(temp_path)[:-len(".part")]
+        filepath = self._storage_path(filename, client_address, prefix)
+        os.replace(temp_path, filepath)
+        return filepath
+    
+    def _discard_incoming(self, temp_file, temp_path):
+        """删除未完成的临时文件"""
+        try:
+            if temp_file:
+                temp_file.close()
+            os.remove(temp_path)
+        except OSError:
+            pass
     
-    def save_file(self, filename, file_data, client_address=None):
+    def _process_text(self, text_data, client_address):
+        """旧协议文本: 触发回调并提交写入器，返回Future"""
+        self.messages_received.inc('text')
+        self.records_received.inc()
+        self.bytes_received.inc(amount=len(text_data.encode('utf-8')))
+        if self.on_text_received:
+            self.on_text_received(text_data, client_address)
+        header = {
+            'kind': 'text',
+            'text': text_data,
+            'client': list(client_address),
+            'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S")
+        }
+        return self.writer.submit(header)
+    
+    def _process_file(self, filename, filepath, filesize, client_address, timestamp):
+        """旧协议文件: 已保存的文件路径提交写入器，返回Future"""
+        self.messages_received.inc('file')
+        self.bytes_received.inc(amount=filesize)
+        header = {
+            'kind': 'file',
+            'filename': filename,
+            'path': os.path.relpath(filepath, self.data_dir),
+            'client': list(client_address),
+            'timestamp': timestamp
+        }
+        return self.writer.submit(header)
+    
+    def save_file(self, filename, file_data, client_address=None, timestamp=None,
+                  with_client_info=True):
         """
         保存文件/照片
         
@@ -255,24 +963,15 @@ class TCPServerModule:
             filename: 原文件名
             file_data: 文件二进制数据
             client_address: 客户端地址信息
+            timestamp: 文件名前缀时间戳，默认为当前时间
+            with_client_info: 文件名中是否追加客户端地址
             
         Returns:
             str: 保存的文件路径
         """
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            client_info = f"_{client_address[0]}_{client_address[1]}" if client_address else ""
-            
-            # 根据文件扩展名确定存储目录
-            file_ext = os.path.splitext(filename)[1].lower()
-            if file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff']:
-                save_dir = "images"
-            else:
-                save_dir = "other_files"
-            
-            # 生成新文件名
-            new_filename = f"{timestamp}{client_info}_{filename}"
-            filepath = os.path.join(self.data_dir, save_dir, new_filename)
+            timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+            filepath = self._storage_path(filename, client_address, timestamp, with_client_info)
             
             with open(filepath, 'wb') as f:
                 f.write(file_data)
@@ -284,9 +983,38 @@ class TCPServerModule:
             print(f"保存文件时出错: {e}")
             return None
     
+    def _storage_path(self, filename, client_address, prefix, with_client_info=True):
+        """
+        文件的正式保存路径: 数据目录/images或other_files/前缀[_客户端地址]_原文件名
+        """
+        # 文件名来自客户端，去掉路径部分防止写出数据目录
+        filename = os.path.basename(filename)
+        client_info = f"_{client_address[0]}_{client_address[1]}" if client_address and with_client_info else ""
+        
+        # 根据文件扩展名确定存储目录
+        file_ext = os.path.splitext(filename)[1].lower()
+        if file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff']:
+            save_dir = "images"
+        else:
+            save_dir = "other_files"
+        
+        return os.path.join(self.data_dir, save_dir, f"{prefix}{client_info}_{filename}")
+    
+    def stop_accepting(self):
+        """停止接受新连接，已建立的连接继续处理（用于停止前排空）"""
+        if not self.accepting:
+            return
+        self.accepting = False
+        if self.server_thread:
+            self.server_thread.join(timeout=5)
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+    
     def stop_server(self):
         """停止服务器"""
         self.running = False
+        self.accepting = False
         
         # 关闭所有客户端连接
         for client in self.clients:
@@ -301,6 +1029,11 @@ class TCPServerModule:
             self.socket = None
         
         self.clients.clear()
+        
+        # 处理完写入队列中的消息
+        self.writer.stop()
+        self.stop_metrics()
+        self.stop_recognition()
         print("TCP服务器已停止")
     
     def is_running(self):
@@ -312,17 +1045,25 @@ class TCPServerModule:
         return len(self.clients)
     
     def set_callbacks(self, text_callback=None, file_callback=None, 
-                     connect_callback=None, disconnect_callback=None):
+                     connect_callback=None, disconnect_callback=None, photo_callback=None,
+                     record_callback=None):
         """
         设置回调函数
         
         Args:
             text_callback: 文本接收回调函数 function(text, client_address)
-            file_callback: 文件接收回调函数 function(filename, file_data, client_address)
+            file_callback: 文件保存后的回调函数 function(filename, file_path, client_address)，
+                           在写盘线程中调用，只传递文件路径而不是文件数据
             connect_callback: 客户端连接回调函数 function(client_address)
             disconnect_callback: 客户端断开回调函数 function(client_address)
+            photo_callback: 照片保存后的回调函数 function(photo_path)，在写盘线程中调用，
+                            photo_path相对于数据目录
+            record_callback: 记录入库后的回调函数 function(record)，在写盘线程中调用，
+                             record为记录字典，其中source为唯一标识
         """
         self.on_text_received = text_callback
         self.on_file_received = file_callback
         self.on_client_connected = connect_callback
-        self.on_client_disconnected = disconnect_callback
\ No newline at end of file
+        self.on_client_disconnected = disconnect_callback
+        self.on_photo_saved = photo_callback
+        self.on_record_saved = record_callback
\ No newline at end of file
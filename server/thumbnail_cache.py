@@ -0,0 +1,161 @@
+# thumbnail_cache.py
+import os
+import queue
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QPixmap
+
+
+class ThumbnailStore:
+    """
+    磁盘缩略图
+
+    缩略图保存在 data_dir/thumbnails 下，文件名为原图文件名加上其相对路径的散列（统一为.jpg），
+    不同子目录中的同名原图或仅扩展名不同的原图不会共用缩略图。
+    界面显示时只解码缩略图，原图仅在用户查看原图时才读取。
+    """
+
+    def __init__(self, data_dir, max_width=480, max_height=360, quality=85):
+        self.data_dir = data_dir
+        self.thumbnails_dir = os.path.join(data_dir, "thumbnails")
+        self.max_width = max_width
+        self.max_height = max_height
+        self.quality = quality
+
+        if not os.path.exists(self.thumbnails_dir):
+            os.makedirs(self.thumbnails_dir)
+
+    def thumbnail_path(self, photo_path):
+        """原图路径（绝对路径或相对data_dir）对应的缩略图路径"""
+        if os.path.isabs(photo_path):
+            photo_path = os.path.relpath(photo_path, self.data_dir)
+        relative = os.path.normpath(photo_path).replace(os.sep, '/')
+        digest = hashlib.sha1(relative.encode('utf-8')).hexdigest()[:12]
+        name = os.path.splitext(os.path.basename(relative))[0]
+        return os.path.join(self.thumbnails_dir, f"{name}_{digest}.jpg")
+
+    def generate(self, photo_path):
+        """
+        生成缩略图（QImage可在非界面线程中使用）
+
+        Returns:
+            str: 缩略图路径，原图无法解码返回None
+        """
+        if not os.path.isabs(photo_path):
+            photo_path = os.path.join(self.data_dir, photo_path)
+        image = QImage(photo_path)
+        if image.isNull():
+            return None
+        if image.width() > self.max_width or image.height() > self.max_height:
+            image = image.scaled(self.max_width, self.max_height,
+                                 Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        # 先写唯一的临时文件再替换: 后台线程和界面线程可能同时生成同一张缩略图，
+        # 各自写自己的临时文件，界面线程也不会读到写了一半的缩略图
+        thumbnail_path = self.thumbnail_path(photo_path)
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.thumbnails_dir)
+        os.close(fd)
+        try:
+            if not image.save(temp_path, "JPG", self.quality):
+                return None
+            os.replace(temp_path, thumbnail_path)
+            temp_path = None
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+        return thumbnail_path
+
+    def get_or_generate(self, photo_path):
+        """返回已有的缩略图，不存在时立即生成"""
+        thumbnail_path = self.thumbnail_path(photo_path)
+        if os.path.exists(thumbnail_path):
+            return thumbnail_path
+        return self.generate(photo_path)
+
+
+class ThumbnailWorker:
+    """后台生成缩略图，服务器保存照片后提交，不占用写盘线程和界面线程"""
+
+    def __init__(self, thumbnail_store, max_pending=1024):
+        self.thumbnail_store = thumbnail_store
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.worker = threading.Thread(target=self._worker_loop, name="thumbnail", daemon=True)
+        self.worker.start()
+
+    def submit(self, photo_path):
+        """
+        提交一张照片，队列已满时丢弃（显示时会补生成）
+
+        Returns:
+            bool: 成功入队返回True
+        """
+        try:
+            self.queue.put_nowait(photo_path)
+            return True
+        except queue.Full:
+            return False
+
+    def _worker_loop(self):
+        while True:
+            photo_path = self.queue.get()
+            if photo_path is None:
+                break
+            try:
+                self.thumbnail_store.generate(photo_path)
+            except Exception as e:
+                print(f"生成缩略图失败 {photo_path}: {e}")
+
+    def close(self, timeout=5.0):
+        """处理完已提交的照片后停止"""
+        self.queue.put(None)
+        self.worker.join(timeout)
+
+
+class PixmapCache:
+    """已解码图片的LRU缓存，按像素占用的内存限制总大小"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.pixmaps = OrderedDict()
+        self.total_bytes = 0
+
+    @staticmethod
+    def _cost(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def get(self, key):
+        """命中时移到最近使用位置，未命中返回None"""
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        cost = self._cost(pixmap)
+        if cost > self.max_bytes:
+            return
+        if key in self.pixmaps:
+            self.total_bytes -= self._cost(self.pixmaps.pop(key))
+        self.pixmaps[key] = pixmap
+        self.total_bytes += cost
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.pixmaps.popitem(last=False)
+            self.total_bytes -= self._cost(evicted)
+
+    def load_file(self, path):
+        """从缓存取图片，未命中时解码文件并缓存，解码失败返回None"""
+        pixmap = self.get(path)
+        if pixmap is None:
+            pixmap = QPixmap(path)
+            if pixmap.isNull():
+                return None
+            self.put(path, pixmap)
+        return pixmap
+
+    def clear(self):
+        self.pixmaps.clear()
+        self.total_bytes = 0
\ No newline at end of file
@@ -0,0 +1,41 @@
+# update_batcher.py
+from PyQt5.QtCore import QObject, QTimer
+
+
+class UpdateBatcher(QObject):
+    """
+    界面更新合并器
+
+    后台线程的信号先放入待处理列表，最多每 interval_ms 毫秒在界面线程中
+    统一处理一次，突发大量记录时界面按固定频率刷新，不会因逐条更新而卡住。
+    """
+
+    def __init__(self, flush_callback, interval_ms=100, parent=None):
+        """
+        Args:
+            flush_callback: 处理函数 function(items)，items为这段时间内收到的全部条目（按到达顺序）
+            interval_ms: 最短刷新间隔（毫秒），默认100即每秒最多10次
+            parent: 父对象
+        """
+        super().__init__(parent)
+        self.flush_callback = flush_callback
+        self.pending = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.flush)
+
+    def add(self, item):
+        """加入一个待处理条目，必须在界面线程中调用（连接到跨线程信号即可）"""
+        self.pending.append(item)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """立即处理所有待处理条目"""
+        self.timer.stop()
+        if not self.pending:
+            return
+        items = self.pending
+        self.pending = []
+        self.flush_callback(items)
\ No newline at end of file